@@ -0,0 +1,32 @@
+import time
+
+
+def percentile(values: list, fraction: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def measure(function, count: int) -> dict:
+    """Calls function count times and returns throughput and latency statistics (in microseconds)."""
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(count):
+        start = time.perf_counter_ns()
+        try:
+            function()
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter_ns() - start)
+    elapsed = time.perf_counter() - started
+    return {
+        'count': count,
+        'errors': errors,
+        'ops_per_second': count / elapsed if elapsed else None,
+        'p50_us': percentile(latencies, 0.5) / 1000,
+        'p99_us': percentile(latencies, 0.99) / 1000,
+        'p999_us': percentile(latencies, 0.999) / 1000,
+        'max_us': max(latencies) / 1000,
+    }
@@ -0,0 +1,42 @@
+import argparse
+import datetime
+import json
+import platform
+import sys
+
+from . import allocator, handlers, http, load, memory, references, shared, space, startup
+
+SUITES = {
+    'allocator': allocator.run,
+    'references': references.run,
+    'space': space.run,
+    'handlers': handlers.run,
+    'http': http.run,
+    'memory': memory.run,
+    'startup': startup.run,
+    'shared': shared.run,
+    'load': load.run,
+}
+
+parser = argparse.ArgumentParser(description='pyIPAM benchmarks')
+parser.add_argument('suites', nargs='*', choices=[[]] + list(SUITES), help='suites to run (default: all)')
+parser.add_argument('--count', type=int, default=1000, help='operations measured per case')
+parser.add_argument('--output', default='-', help='file to write JSON results to (default: stdout)')
+args = parser.parse_args()
+
+results = {
+    'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    'python': platform.python_version(),
+    'count': args.count,
+    'results': {},
+}
+for name in args.suites or SUITES:
+    print('Running {}...'.format(name), file=sys.stderr)
+    results['results'][name] = SUITES[name](args.count)
+
+if args.output == '-':
+    json.dump(results, sys.stdout, indent=2)
+    print()
+else:
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
@@ -0,0 +1,36 @@
+from lib.Ipam import *
+
+from . import measure
+
+POOLS = ['10.0.0.0/24', '10.0.0.0/16', '10.0.0.0/8', 'fd00::/64']
+FILLS = [('empty', 0.0), ('50%', 0.5), ('99%', 0.99), ('exhausted', 1.0)]
+
+
+def prefill(pool: Pool, fraction: float):
+    # Fill the beginning of the host range and rewind the cursor,
+    # so that every allocation has to skip over allocated addresses
+    hosts = pool.last - pool.first
+    pool.allocate_range(pool.first, pool.first + int(hosts * fraction))
+    pool.current = pool.first
+
+
+def run(count: int) -> list:
+    results = []
+    for network in POOLS:
+        for name, fraction in FILLS:
+            pool = Pool(pool=network)
+            prefill(pool, fraction)
+            free = pool.free
+            result = {
+                'pool': network,
+                'fill': name,
+                'allocator': type(pool.allocator).__name__,
+            }
+            result['allocate'] = measure(pool.allocate, min(count, free) if free else count)
+            addresses = [pool.address(offset) for offset in range(pool.first, pool.first + min(count, pool.last - pool.first))]
+            iterator = iter(addresses)
+            result['deallocate'] = measure(lambda: pool.deallocate(next(iterator)), len(addresses))
+            results.append(result)
+    return results
+
+
@@ -0,0 +1,30 @@
+from lib.IpamDriver import handlers
+
+from . import measure
+
+NETWORKS = ['10.254.0.0/16', 'fd00:fe::/64']
+
+
+def run(count: int) -> list:
+    """Request handlers called directly, without HTTP, to show the cost of request processing itself"""
+    request_pool = handlers['/IpamDriver.RequestPool']
+    release_pool = handlers['/IpamDriver.ReleasePool']
+    request_address = handlers['/IpamDriver.RequestAddress']
+    release_address = handlers['/IpamDriver.ReleaseAddress']
+    results = []
+    for network in NETWORKS:
+        pool_id = request_pool({'AddressSpace': 'local', 'Pool': network})['PoolID']
+        addresses = []
+        result = {
+            'pool': network,
+            'RequestAddress': measure(lambda: addresses.append(request_address({'PoolID': pool_id})['Address']), count),
+        }
+        addresses = [address.split('/')[0] for address in addresses]
+        iterator = iter(addresses)
+        result['ReleaseAddress'] = measure(lambda: release_address({'PoolID': pool_id, 'Address': next(iterator)}), count)
+        iterator = iter(addresses)
+        result['RequestAddress (manual)'] = measure(
+            lambda: request_address({'PoolID': pool_id, 'Address': next(iterator)}), count)
+        release_pool({'PoolID': pool_id})
+        results.append(result)
+    return results
@@ -0,0 +1,34 @@
+import json
+
+from . import measure
+
+
+def run(count: int) -> list:
+    from run import app
+    client = app.test_client()
+
+    def call(endpoint: str, data: dict) -> dict:
+        response = client.post('/IpamDriver.' + endpoint, data=json.dumps(data))
+        return response.get_json()
+
+    pool_id = call('RequestPool', {'AddressSpace': 'local', 'Pool': '10.255.0.0/16'})['PoolID']
+    addresses = []
+    results = [
+        {
+            'endpoint': 'GetCapabilities',
+            'stats': measure(lambda: call('GetCapabilities', {}), count),
+        },
+        {
+            'endpoint': 'RequestAddress',
+            'stats': measure(lambda: addresses.append(call('RequestAddress', {'PoolID': pool_id})['Address']), count),
+        },
+    ]
+    iterator = iter(addresses)
+    results.append({
+        'endpoint': 'ReleaseAddress',
+        'stats': measure(lambda: call('ReleaseAddress', {
+            'PoolID': pool_id, 'Address': next(iterator).split('/')[0],
+        }), len(addresses)),
+    })
+    call('ReleasePool', {'PoolID': pool_id})
+    return results
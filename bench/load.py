@@ -0,0 +1,273 @@
+"""
+Load generator driving the plugin socket with sequences of IPAM requests.
+
+Sequences are JSON lines of {"endpoint": "RequestAddress", "data": {...}}, as sent
+by Docker Engine to /IpamDriver.<endpoint>. ReleaseAddress entries without
+an address release the oldest address handed out in the pool by this run,
+so that synthetic sequences do not depend on addresses chosen by the plugin.
+PoolIDs of recorded requests are replaced with ones returned by the plugin
+for the pool. RequestPool entries without Pool (subnet chosen by the plugin)
+must include the recorded response, {"response": {"PoolID": ...}}, to be matched
+with later requests. Requests for different pools are sent concurrently,
+requests for the same pool in order of the sequence.
+
+    python -m bench.load --socket /run/docker/plugins/<plugin id>/pyipam.sock --concurrency 8
+    python -m bench.load --server waitress --threads 8 --rate 2000 --input recorded.jsonl
+    python -m bench.load --networks 10 --addresses 50 --output sequence.jsonl
+"""
+
+import argparse
+import collections
+import contextlib
+import ipaddress
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from . import percentile
+from .startup import ROOT, TIMEOUT, UnixHTTPConnection, activate
+
+
+def synthetic(networks: int, addresses: int) -> list:
+    """Every network is created, filled with addresses, emptied and released"""
+    entries = []
+    for index in range(networks):
+        pool = '10.{}.{}.0/24'.format(index // 256, index % 256)
+        pool_id = 'local-' + pool
+        entries.append({'endpoint': 'RequestPool', 'data': {'AddressSpace': 'local', 'Pool': pool}})
+        entries.extend({'endpoint': 'RequestAddress', 'data': {'PoolID': pool_id}} for _ in range(addresses))
+        entries.extend({'endpoint': 'ReleaseAddress', 'data': {'PoolID': pool_id}} for _ in range(addresses))
+        entries.append({'endpoint': 'ReleasePool', 'data': {'PoolID': pool_id}})
+    return entries
+
+
+def load(path: str) -> list:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def recorded_pool_id(entry: dict) -> str:
+    """PoolID the entry refers to in the recorded sequence"""
+    data = entry['data']
+    if entry['endpoint'] != 'RequestPool':
+        return data.get('PoolID', '')
+    recorded = (entry.get('response') or {}).get('PoolID')
+    if recorded:
+        return recorded
+    if not data.get('Pool'):
+        raise ValueError('RequestPool without Pool must include the recorded response with PoolID')
+    return '{}-{}'.format(data.get('AddressSpace'), ipaddress.ip_network(data['Pool'], strict=False))
+
+
+def partition(entries: list, concurrency: int) -> list:
+    # Pools are spread over workers in order of their first request
+    workers = [[] for _ in range(concurrency)]
+    assigned = {}
+    for entry in entries:
+        key = recorded_pool_id(entry)
+        if key not in assigned:
+            assigned[key] = len(assigned) % concurrency
+        workers[assigned[key]].append(entry)
+    return workers
+
+
+class Pacer:
+    """Spaces requests of all workers evenly to achieve given rate, if any"""
+
+    def __init__(self, rate: float = None):
+        self.interval = 1 / rate if rate else 0
+        self.next = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            slot = self.next = max(self.next + self.interval, time.perf_counter() - self.interval)
+        delay = slot - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Load:
+    def __init__(self, socket: str, entries: list, concurrency: int = 4, rate: float = None):
+        self.socket = socket
+        self.workers = partition(entries, concurrency)
+        self.pacer = Pacer(rate)
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self.duplicates = []
+        # Recorded PoolID -> one returned by the plugin, addresses currently handed out
+        # (with number of holders) and whether duplicates are allowed
+        self.pool_ids = {}
+        self.held = collections.defaultdict(collections.Counter)
+        self.shared = {}
+        self.lock = threading.Lock()
+
+    def call(self, connection: UnixHTTPConnection, endpoint: str, data: dict) -> dict:
+        self.pacer.wait()
+        start = time.perf_counter_ns()
+        connection.request('POST', '/IpamDriver.' + endpoint, json.dumps(data))
+        response = connection.getresponse()
+        body = response.read()
+        elapsed = time.perf_counter_ns() - start
+        response = json.loads(body) if response.status == 200 else {'Err': 'HTTP {}'.format(response.status)}
+        with self.lock:
+            self.latencies[endpoint].append(elapsed)
+            if 'Err' in response:
+                self.errors[endpoint] += 1
+        return response
+
+    def step(self, connection: UnixHTTPConnection, entry: dict):
+        endpoint, data = entry['endpoint'], dict(entry['data'])
+        pool_id = recorded_pool_id(entry)
+        if endpoint != 'RequestPool':
+            data['PoolID'] = self.pool_ids.get(pool_id, pool_id)
+        held = self.held[pool_id]
+        if endpoint == 'ReleaseAddress' and not data.get('Address'):
+            if not held:
+                return
+            data['Address'] = next(iter(held))
+        response = self.call(connection, endpoint, data)
+        if 'Err' in response:
+            return
+
+        if endpoint == 'RequestPool':
+            self.pool_ids[pool_id] = response['PoolID']
+            held.clear()
+            self.shared[pool_id] = (data.get('Options') or {}).get('validate') == '0'
+        elif endpoint == 'RequestAddress':
+            address = response['Address'].split('/')[0]
+            if held[address] and not (data.get('Address') and self.shared.get(pool_id)):
+                with self.lock:
+                    self.duplicates.append((data['PoolID'], address))
+            held[address] += 1
+        elif endpoint == 'ReleaseAddress':
+            held[data['Address']] -= 1
+            if held[data['Address']] <= 0:
+                del held[data['Address']]
+        elif endpoint == 'ReleasePool':
+            self.held.pop(pool_id, None)
+            self.pool_ids.pop(pool_id, None)
+
+    def work(self, entries: list):
+        connection = UnixHTTPConnection(self.socket)
+        try:
+            for entry in entries:
+                self.step(connection, entry)
+        finally:
+            connection.close()
+
+    def run(self) -> dict:
+        threads = [threading.Thread(target=self.work, args=(entries,)) for entries in self.workers if entries]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        latencies = [latency for values in self.latencies.values() for latency in values]
+        result = {
+            'concurrency': len(self.workers),
+            'requests': len(latencies),
+            'errors': sum(self.errors.values()),
+            'duplicates': len(self.duplicates),
+            'seconds': elapsed,
+            'requests_per_second': len(latencies) / elapsed if elapsed else None,
+        }
+        result.update(self.statistics(latencies))
+        result['endpoints'] = {
+            endpoint: dict(self.statistics(values), requests=len(values), errors=self.errors[endpoint])
+            for endpoint, values in sorted(self.latencies.items())
+        }
+        return result
+
+    @staticmethod
+    def statistics(latencies: list) -> dict:
+        if not latencies:
+            return {}
+        return {
+            'p50_us': percentile(latencies, 0.5) / 1000,
+            'p99_us': percentile(latencies, 0.99) / 1000,
+            'p999_us': percentile(latencies, 0.999) / 1000,
+            'max_us': max(latencies) / 1000,
+        }
+
+
+@contextlib.contextmanager
+def plugin(server: str, threads: int = 4, environment: dict = None):
+    """Starts the plugin in production mode and yields path to its socket"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'pyipam.sock')
+        environment = dict(os.environ, ENVIRONMENT='production', SERVER=server, THREADS=str(threads),
+                           SOCKET=path, HOME=directory, **(environment or {}))
+        process = subprocess.Popen([sys.executable, 'run.py'], cwd=ROOT, env=environment,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            deadline = time.perf_counter() + TIMEOUT
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError('Plugin exited with code {}'.format(process.returncode))
+                if time.perf_counter() > deadline:
+                    raise RuntimeError('Plugin did not start in {} seconds'.format(TIMEOUT))
+                try:
+                    activate(path)
+                    break
+                except (ConnectionError, FileNotFoundError):
+                    time.sleep(0.01)
+            yield path
+        finally:
+            process.terminate()
+            process.wait()
+
+
+def run(count: int) -> list:
+    # count addresses spread over networks of up to 100 addresses
+    networks = max(1, count // 100)
+    entries = synthetic(networks, min(count, 100))
+    results = []
+    for server in ('waitress', 'asyncio'):
+        for concurrency in (1, 4):
+            with plugin(server) as path:
+                result = Load(path, entries, concurrency).run()
+            result.pop('endpoints')
+            results.append(dict(server=server, **result))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Drives the plugin socket with a sequence of IPAM requests')
+    parser.add_argument('--socket', help='socket of a running plugin (default: start one)')
+    parser.add_argument('--server', default='waitress', help='server of the started plugin')
+    parser.add_argument('--threads', type=int, default=4, help='threads of the started plugin')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes of the started plugin')
+    parser.add_argument('--input', help='JSON lines file with requests (default: synthetic sequence)')
+    parser.add_argument('--networks', type=int, default=20, help='networks of the synthetic sequence')
+    parser.add_argument('--addresses', type=int, default=100, help='addresses per network of the synthetic sequence')
+    parser.add_argument('--output', help='write the sequence to a file instead of sending it')
+    parser.add_argument('--concurrency', type=int, default=4, help='connections sending requests')
+    parser.add_argument('--rate', type=float, help='requests per second of all connections (default: unlimited)')
+    args = parser.parse_args()
+
+    entries = load(args.input) if args.input else synthetic(args.networks, args.addresses)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.writelines(json.dumps(entry) + '\n' for entry in entries)
+        return
+
+    with contextlib.ExitStack() as stack:
+        path = args.socket or stack.enter_context(plugin(args.server, args.threads, {'WORKERS': str(args.workers)}))
+        result = Load(path, entries, args.concurrency, args.rate).run()
+    json.dump(result, sys.stdout, indent=2)
+    print()
+    if result['duplicates']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
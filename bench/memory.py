@@ -0,0 +1,62 @@
+import gc
+import ipaddress
+import os
+import tracemalloc
+
+from lib.Ipam import *
+
+POOLS = 10000
+ADDRESSES = 100
+# Networks pools are carved from and their prefix lengths, fewer pools fit larger ones
+CASES = (('10.0.0.0/8', 24), ('0.0.0.0/0', 16), ('0.0.0.0/0', 12), ('fd00::/48', 64))
+# Pools built with allocation tracing, which is much slower
+TRACED_POOLS = 1000
+
+
+def resident_size() -> int:
+    # Resident set size in bytes, Linux only
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return None
+
+
+def build(network: str, prefixlen: int, count: int) -> Space:
+    space = Space('bench')
+    subnets = ipaddress.ip_network(network).subnets(new_prefix=prefixlen)
+    for _ in range(count):
+        pool = Pool(pool=str(next(subnets)))
+        space.add_pool(pool)
+        for _ in range(ADDRESSES):
+            pool.allocate()
+    return space
+
+
+def run(count: int) -> list:
+    # Pool and address counts are fixed, so that results are comparable
+    results = []
+    for network, prefixlen in CASES:
+        pools = min(POOLS, 1 << (prefixlen - ipaddress.ip_network(network).prefixlen))
+        gc.collect()
+        resident = resident_size()
+        space = build(network, prefixlen, pools)
+        gc.collect()
+        after = resident_size()
+        del space
+
+        traced_pools = min(TRACED_POOLS, pools)
+        tracemalloc.start()
+        space = build(network, prefixlen, traced_pools)
+        gc.collect()
+        traced = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del space
+        results.append({
+            'pools': pools,
+            'addresses': ADDRESSES,
+            'prefixlen': prefixlen,
+            'bytes_per_pool': traced / traced_pools,
+            'resident_bytes': after - resident if resident is not None else None,
+        })
+    return results
@@ -0,0 +1,33 @@
+from lib.Ipam import *
+
+from . import measure
+
+NETWORK = '10.0.0.0/8'
+
+
+def run(count: int) -> list:
+    results = []
+    for validate in ('1', '0'):
+        pool = Pool(pool=NETWORK, options={'validate': validate})
+        results.append({
+            'validate': validate,
+            'case': 'automatic',
+            'allocate': measure(pool.allocate, count),
+        })
+
+    # Every address handed out twice, so that every release drops a reference first
+    pool = Pool(pool=NETWORK, options={'validate': '0'})
+    addresses = [pool.address(offset) for offset in range(pool.first, pool.first + count)]
+    for address in addresses:
+        pool.allocate(address)
+    iterator = iter(addresses)
+    result = {
+        'validate': '0',
+        'case': 'duplicate',
+        'allocate': measure(lambda: pool.allocate(next(iterator)), count),
+    }
+    iterator = iter(addresses * 2)
+    result['deallocate'] = measure(lambda: pool.deallocate(next(iterator)), 2 * count)
+    result['references_left'] = len(pool.references)
+    results.append(result)
+    return results
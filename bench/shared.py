@@ -0,0 +1,58 @@
+import multiprocessing
+import os
+import tempfile
+import time
+
+import lib.IpamDriverData
+from lib.IpamDriver import handlers
+from lib.SharedState import *
+
+WORKERS = [1, 2, 4]
+
+
+def worker(path: str, network: str, count: int, start, connection):
+    # Runs in a forked process, with its own copy of driver state
+    lib.IpamDriverData.enable_shared_state(path)
+    pool_id = handlers['/IpamDriver.RequestPool']({'AddressSpace': 'local', 'Pool': network})['PoolID']
+    request_address = handlers['/IpamDriver.RequestAddress']
+    start.wait()
+    started = time.perf_counter()
+    addresses = [request_address({'PoolID': pool_id})['Address'] for _ in range(count)]
+    connection.send((time.perf_counter() - started, addresses))
+    connection.close()
+
+
+def measure(workers: int, separate: bool, count: int) -> dict:
+    context = multiprocessing.get_context('fork')
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'shared.state')
+        SharedState.create(path)
+        start = context.Event()
+        processes, connections = [], []
+        for index in range(workers):
+            network = '10.{}.0.0/12'.format(16 * index if separate else 0)
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=worker, args=(path, network, count, start, sender))
+            process.start()
+            sender.close()
+            processes.append(process)
+            connections.append(receiver)
+        start.set()
+        results = [connection.recv() for connection in connections]
+        for process in processes:
+            process.join()
+
+    elapsed = max(seconds for seconds, _ in results)
+    addresses = [address for _, allocated in results for address in allocated]
+    return {
+        'workers': workers,
+        'pools': 'separate' if separate else 'shared',
+        # Throughput can only scale up to the number of CPUs
+        'cpus': os.cpu_count(),
+        'ops_per_second': len(addresses) / elapsed if elapsed else None,
+        'duplicates': len(addresses) - len(set(addresses)),
+    }
+
+
+def run(count: int) -> list:
+    return [measure(workers, separate, count) for separate in (True, False) for workers in WORKERS]
@@ -0,0 +1,24 @@
+import ipaddress
+
+from lib.Ipam import *
+
+from . import measure
+
+SIZES = [10, 100, 1000, 10000]
+
+
+def run(count: int) -> list:
+    results = []
+    for size in SIZES:
+        space = Space('bench')
+        subnets = ipaddress.ip_network('10.0.0.0/8').subnets(new_prefix=24)
+        for _ in range(size):
+            space.add_pool(Pool(pool=str(next(subnets))))
+        pools = [Pool(pool=str(next(subnets))) for _ in range(count)]
+        iterator = iter(pools)
+        results.append({
+            'existing_pools': size,
+            'add_pool': measure(lambda: space.add_pool(next(iterator)), count),
+            'carve_pool': measure(lambda: space.carve_pool(False, {'supernet': '10.0.0.0/8'}), count),
+        })
+    return results
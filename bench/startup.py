@@ -0,0 +1,82 @@
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from . import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Plugin restarts are slow, so only a few of them are measured
+MAX_RUNS = 10
+TIMEOUT = 30
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str):
+        super().__init__('localhost', timeout=TIMEOUT)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(TIMEOUT)
+        self.sock.connect(self.path)
+
+
+def activate(path: str):
+    connection = UnixHTTPConnection(path)
+    try:
+        connection.request('POST', '/Plugin.Activate', body=b'{}')
+        response = connection.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError('Plugin.Activate returned {}'.format(response.status))
+    finally:
+        connection.close()
+
+
+def start(server: str) -> tuple:
+    """Starts the plugin and returns seconds until its socket exists and until Plugin.Activate succeeds"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'pyipam.sock')
+        environment = dict(os.environ, ENVIRONMENT='production', SERVER=server, SOCKET=path, HOME=directory)
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, 'run.py'], cwd=ROOT, env=environment,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            listening = None
+            while True:
+                elapsed = time.perf_counter() - started
+                if process.poll() is not None:
+                    raise RuntimeError('Plugin exited with code {}'.format(process.returncode))
+                if elapsed > TIMEOUT:
+                    raise RuntimeError('Plugin did not start in {} seconds'.format(TIMEOUT))
+                if listening is None and os.path.exists(path):
+                    listening = elapsed
+                if listening is not None:
+                    try:
+                        activate(path)
+                        return listening, time.perf_counter() - started
+                    except ConnectionError:
+                        pass
+                time.sleep(0.001)
+        finally:
+            process.terminate()
+            process.wait()
+
+
+def run(count: int) -> list:
+    results = []
+    for server in ('waitress', 'asyncio'):
+        listening, activated = zip(*(start(server) for _ in range(min(count, MAX_RUNS))))
+        results.append({
+            'server': server,
+            'runs': len(activated),
+            'socket_p50_ms': percentile(listening, 0.5) * 1000,
+            'socket_max_ms': max(listening) * 1000,
+            'activate_p50_ms': percentile(activated, 0.5) * 1000,
+            'activate_max_ms': max(activated) * 1000,
+        })
+    return results
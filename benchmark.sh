@@ -0,0 +1,7 @@
+#!/bin/bash
+
+if [ -d venv ]; then
+  . ./venv/bin/activate
+fi
+
+python -m bench "$@"
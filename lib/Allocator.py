@@ -0,0 +1,405 @@
+import array
+import bisect
+
+from docker_plugin_api.Plugin import InputValidationException
+
+WORD_BITS = 64
+WORD_MASK = (1 << WORD_BITS) - 1
+
+# Largest pool (in addresses) that can be tracked with a bitmap
+BITMAP_MAX_SIZE = 1 << 24
+# Pools larger than this are tracked with free intervals by default, unless allocations are scattered:
+# bitmap size follows the pool size (8 KiB for a /16, 2 MiB for a /8), while intervals follow
+# the number of allocated ranges, which stays small when pools are filled sequentially
+BITMAP_DEFAULT_SIZE = 1 << 12
+
+
+def _lowest_bit(word: int) -> int:
+    return (word & -word).bit_length() - 1
+
+
+class Allocator:
+    """Tracks allocated offsets in range [0, size)."""
+
+    __slots__ = ('size', 'count')
+
+    def __init__(self, size: int):
+        self.size = size
+        self.count = 0
+
+    def is_allocated(self, offset: int) -> bool:
+        raise NotImplementedError()
+
+    def allocate(self, offset: int) -> bool:
+        """Marks offset as allocated. Returns False if it already was."""
+        raise NotImplementedError()
+
+    def release(self, offset: int) -> bool:
+        """Marks offset as free. Returns False if it already was."""
+        raise NotImplementedError()
+
+    def find_free(self, start: int, end: int):
+        """Returns the lowest free offset in range [start, end) or None."""
+        raise NotImplementedError()
+
+    def ranges(self):
+        """Yields (start, end) tuples of allocated offsets, in order."""
+        raise NotImplementedError()
+
+    def snapshot(self) -> 'Allocator':
+        """Returns a copy that can be read without holding the lock guarding this allocator."""
+        raise NotImplementedError()
+
+    def allocate_range(self, start: int, end: int) -> int:
+        """Marks offsets in range [start, end) as allocated. Returns number of newly allocated ones."""
+        return sum(self.allocate(offset) for offset in range(start, end))
+
+    def release_range(self, start: int, end: int) -> int:
+        """Marks offsets in range [start, end) as free. Returns number of newly freed ones."""
+        return sum(self.release(offset) for offset in range(start, end))
+
+    def __contains__(self, offset: int) -> bool:
+        return self.is_allocated(offset)
+
+    def __iter__(self):
+        for start, end in self.ranges():
+            yield from range(start, end)
+
+    def __len__(self):
+        return self.count
+
+
+class BitmapAllocator(Allocator):
+    """
+    Hierarchical bitmap. Level 0 holds a bit per offset, every next level
+    holds a bit per word of the level below that is set when the word is full.
+    """
+
+    __slots__ = ('levels',)
+
+    def __init__(self, size: int):
+        super().__init__(size)
+        self.levels = self.build_levels(size)
+
+    @staticmethod
+    def level_words(size: int) -> list:
+        """Returns number of words of every level"""
+        words = []
+        items = size
+        while True:
+            words.append(max(1, (items + WORD_BITS - 1) // WORD_BITS))
+            if words[-1] == 1:
+                return words
+            items = words[-1]
+
+    @classmethod
+    def buffer_size(cls, size: int) -> int:
+        return 8 * sum(cls.level_words(size))
+
+    @classmethod
+    def build_levels(cls, size: int, buffer: memoryview = None, initialize: bool = True) -> list:
+        """Creates levels in new arrays or in given buffer of buffer_size bytes (e.g. shared memory)"""
+        levels = []
+        items = size
+        position = 0
+        for words in cls.level_words(size):
+            if buffer is None:
+                level = array.array('Q', bytes(8 * words))
+            else:
+                level = buffer[position:position + 8 * words].cast('Q')
+                position += 8 * words
+            # Bits past the end are permanently set, so that partial words can become full
+            if initialize and (items % WORD_BITS or items == 0):
+                level[words - 1] = WORD_MASK ^ ((1 << (items % WORD_BITS)) - 1)
+            levels.append(level)
+            items = words
+        return levels
+
+    def is_allocated(self, offset: int) -> bool:
+        return bool(self.levels[0][offset >> 6] >> (offset & 63) & 1)
+
+    def allocate(self, offset: int) -> bool:
+        if self.is_allocated(offset):
+            return False
+        index = offset
+        for level in self.levels:
+            word = level[index >> 6] | (1 << (index & 63))
+            level[index >> 6] = word
+            if word != WORD_MASK:
+                break
+            index >>= 6
+        self.count += 1
+        return True
+
+    def release(self, offset: int) -> bool:
+        if not self.is_allocated(offset):
+            return False
+        index = offset
+        for level in self.levels:
+            word = level[index >> 6]
+            level[index >> 6] = word ^ (1 << (index & 63))
+            # Parent level only tracks words that were full
+            if word != WORD_MASK:
+                break
+            index >>= 6
+        self.count -= 1
+        return True
+
+    def _propagate(self, index: int, full: bool):
+        # Updates upper levels after level 0 word became full (or stopped being full)
+        for level in self.levels[1:]:
+            word = level[index >> 6]
+            bit = 1 << (index & 63)
+            if full:
+                word |= bit
+                level[index >> 6] = word
+                if word != WORD_MASK:
+                    break
+            else:
+                level[index >> 6] = word & ~bit
+                if word != WORD_MASK:
+                    break
+            index >>= 6
+
+    def allocate_range(self, start: int, end: int) -> int:
+        start, end = max(start, 0), min(end, self.size)
+        level = self.levels[0]
+        allocated = 0
+        offset = start
+        while offset < end:
+            if offset & 63 == 0 and offset + WORD_BITS <= end:
+                word = level[offset >> 6]
+                if word != WORD_MASK:
+                    bits = WORD_BITS - word.bit_count()
+                    level[offset >> 6] = WORD_MASK
+                    self._propagate(offset >> 6, True)
+                    self.count += bits
+                    allocated += bits
+                offset += WORD_BITS
+            else:
+                allocated += self.allocate(offset)
+                offset += 1
+        return allocated
+
+    def release_range(self, start: int, end: int) -> int:
+        start, end = max(start, 0), min(end, self.size)
+        level = self.levels[0]
+        released = 0
+        offset = start
+        while offset < end:
+            if offset & 63 == 0 and offset + WORD_BITS <= end:
+                word = level[offset >> 6]
+                if word:
+                    bits = word.bit_count()
+                    level[offset >> 6] = 0
+                    if word == WORD_MASK:
+                        self._propagate(offset >> 6, False)
+                    self.count -= bits
+                    released += bits
+                offset += WORD_BITS
+            else:
+                released += self.release(offset)
+                offset += 1
+        return released
+
+    def _find(self, depth: int, index: int):
+        level = self.levels[depth]
+        word_index = index >> 6
+        if word_index >= len(level):
+            return None
+        word = ~level[word_index] & WORD_MASK & (WORD_MASK << (index & 63))
+        if not word:
+            if depth + 1 == len(self.levels):
+                return None
+            word_index = self._find(depth + 1, word_index + 1)
+            if word_index is None:
+                return None
+            word = ~level[word_index] & WORD_MASK
+        return (word_index << 6) | _lowest_bit(word)
+
+    def find_free(self, start: int, end: int):
+        if start >= end:
+            return None
+        offset = self._find(0, max(start, 0))
+        if offset is None or offset >= end:
+            return None
+        return offset
+
+    def snapshot(self) -> 'BitmapAllocator':
+        copy = BitmapAllocator.__new__(BitmapAllocator)
+        copy.size, copy.count = self.size, self.count
+        copy.levels = []
+        for level in self.levels:
+            # Levels might be views of shared memory, copied as bytes in one go
+            copy.levels.append(array.array('Q'))
+            copy.levels[-1].frombytes(memoryview(level).cast('B'))
+        return copy
+
+    def ranges(self):
+        level = self.levels[0]
+        start = None
+        for word_index in range(len(level)):
+            word = level[word_index]
+            base = word_index << 6
+            if word == WORD_MASK and start is not None:
+                continue
+            if word == 0 and start is None:
+                continue
+            for bit in range(WORD_BITS):
+                if word >> bit & 1:
+                    if start is None:
+                        start = base + bit
+                elif start is not None:
+                    yield start, base + bit
+                    start = None
+        if start is not None and start < self.size:
+            yield start, self.size
+
+
+class IntervalAllocator(Allocator):
+    """Sorted list of disjoint free intervals [starts[i], ends[i])."""
+
+    __slots__ = ('starts', 'ends')
+
+    def __init__(self, size: int):
+        super().__init__(size)
+        self.starts = [0] if size else []
+        self.ends = [size] if size else []
+
+    def _free_index(self, offset: int) -> int:
+        """Returns index of the free interval containing offset or -1."""
+        index = bisect.bisect_right(self.starts, offset) - 1
+        if index >= 0 and offset < self.ends[index]:
+            return index
+        return -1
+
+    def is_allocated(self, offset: int) -> bool:
+        return self._free_index(offset) < 0
+
+    def allocate(self, offset: int) -> bool:
+        index = self._free_index(offset)
+        if index < 0:
+            return False
+        start, end = self.starts[index], self.ends[index]
+        if start == offset and end == offset + 1:
+            del self.starts[index]
+            del self.ends[index]
+        elif start == offset:
+            self.starts[index] = offset + 1
+        elif end == offset + 1:
+            self.ends[index] = offset
+        else:
+            self.ends[index] = offset
+            self.starts.insert(index + 1, offset + 1)
+            self.ends.insert(index + 1, end)
+        self.count += 1
+        return True
+
+    def release(self, offset: int) -> bool:
+        if not 0 <= offset < self.size:
+            return False
+        index = bisect.bisect_right(self.starts, offset)
+        if index > 0 and offset < self.ends[index - 1]:
+            return False
+        merge_left = index > 0 and self.ends[index - 1] == offset
+        merge_right = index < len(self.starts) and self.starts[index] == offset + 1
+        if merge_left and merge_right:
+            self.ends[index - 1] = self.ends[index]
+            del self.starts[index]
+            del self.ends[index]
+        elif merge_left:
+            self.ends[index - 1] = offset + 1
+        elif merge_right:
+            self.starts[index] = offset
+        else:
+            self.starts.insert(index, offset)
+            self.ends.insert(index, offset + 1)
+        self.count -= 1
+        return True
+
+    def find_free(self, start: int, end: int):
+        if start >= end:
+            return None
+        index = bisect.bisect_right(self.starts, start) - 1
+        if index >= 0 and start < self.ends[index]:
+            return start
+        index += 1
+        if index < len(self.starts) and self.starts[index] < end:
+            return self.starts[index]
+        return None
+
+    def allocate_range(self, start: int, end: int) -> int:
+        start, end = max(start, 0), min(end, self.size)
+        if start >= end:
+            return 0
+        first = bisect.bisect_right(self.starts, start) - 1
+        if first < 0 or self.ends[first] <= start:
+            first += 1
+        last = first
+        starts, ends = [], []
+        allocated = 0
+        while last < len(self.starts) and self.starts[last] < end:
+            interval_start, interval_end = self.starts[last], self.ends[last]
+            allocated += min(interval_end, end) - max(interval_start, start)
+            if interval_start < start:
+                starts.append(interval_start)
+                ends.append(start)
+            if interval_end > end:
+                starts.append(end)
+                ends.append(interval_end)
+            last += 1
+        self.starts[first:last] = starts
+        self.ends[first:last] = ends
+        self.count += allocated
+        return allocated
+
+    def release_range(self, start: int, end: int) -> int:
+        start, end = max(start, 0), min(end, self.size)
+        if start >= end:
+            return 0
+        first = bisect.bisect_left(self.ends, start)
+        last = bisect.bisect_right(self.starts, end)
+        released = end - start
+        for index in range(first, last):
+            released -= max(0, min(self.ends[index], end) - max(self.starts[index], start))
+        if first < last:
+            start = min(start, self.starts[first])
+            end = max(end, self.ends[last - 1])
+        self.starts[first:last] = [start]
+        self.ends[first:last] = [end]
+        self.count -= released
+        return released
+
+    def snapshot(self) -> 'IntervalAllocator':
+        copy = IntervalAllocator.__new__(IntervalAllocator)
+        copy.size, copy.count = self.size, self.count
+        copy.starts, copy.ends = list(self.starts), list(self.ends)
+        return copy
+
+    def ranges(self):
+        previous = 0
+        for start, end in zip(self.starts, self.ends):
+            if start > previous:
+                yield previous, start
+            previous = end
+        if previous < self.size:
+            yield previous, self.size
+
+
+allocators = {
+    'bitmap': BitmapAllocator,
+    'interval': IntervalAllocator,
+}
+
+
+def create_allocator(size: int, kind: str = None, scattered: bool = False) -> Allocator:
+    if kind is None or kind == '':
+        kind = 'bitmap' if size <= (BITMAP_MAX_SIZE if scattered else BITMAP_DEFAULT_SIZE) else 'interval'
+    if kind not in allocators:
+        raise InputValidationException('Unknown allocator {}'.format(kind))
+    if kind == 'bitmap' and size > BITMAP_MAX_SIZE:
+        raise InputValidationException('Bitmap allocator supports pools of up to {} addresses'.format(BITMAP_MAX_SIZE))
+    return allocators[kind](size)
+
+
+__all__ = ['BITMAP_MAX_SIZE', 'BITMAP_DEFAULT_SIZE', 'Allocator', 'BitmapAllocator', 'IntervalAllocator', 'allocators', 'create_allocator']
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+
+from docker_plugin_api.Plugin import InputValidationException
+
+logger = logging.getLogger('pyIPAM')
+
+# Seconds to wait for each part of a request before dropping the connection
+READ_TIMEOUT = 30
+MAX_LINE = 8192
+MAX_HEADERS = 100
+MAX_BODY = 1 << 20
+
+REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    500: 'Internal Server Error',
+}
+
+
+def dispatch(handlers: dict, path: str, body: bytes):
+    handler = handlers.get(path)
+    if handler is None:
+        return 404, {'Err': 'Unknown endpoint {}'.format(path)}
+    try:
+        data = json.loads(body) if body.strip() else {}
+    except ValueError as e:
+        return 400, {'Err': 'Invalid JSON: {}'.format(e)}
+    try:
+        return 200, handler(data)
+    except InputValidationException as e:
+        logger.error(e)
+        return 200, {'Err': e.args[0]}
+    except Exception as e:
+        logger.exception(e)
+        return 500, {'Err': 'Internal error'}
+
+
+async def _read(coroutine):
+    return await asyncio.wait_for(coroutine, READ_TIMEOUT)
+
+
+async def _read_line(reader: asyncio.StreamReader) -> bytes:
+    line = await _read(reader.readline())
+    if len(line) > MAX_LINE:
+        raise ValueError('Line too long')
+    return line
+
+
+async def _read_body(reader: asyncio.StreamReader, headers: dict) -> bytes:
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        length = 0
+        while True:
+            size = int((await _read_line(reader)).split(b';')[0], 16)
+            if size == 0:
+                # Skip trailers
+                while (await _read_line(reader)).strip():
+                    pass
+                return b''.join(chunks)
+            length += size
+            if length > MAX_BODY:
+                raise ValueError('Body too large')
+            chunks.append(await _read(reader.readexactly(size)))
+            await _read_line(reader)
+    length = int(headers.get('content-length', '0'))
+    if not 0 <= length <= MAX_BODY:
+        raise ValueError('Invalid body length')
+    return await _read(reader.readexactly(length)) if length else b''
+
+
+async def handle_connection(handlers: dict, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            request_line = await _read_line(reader)
+            if not request_line.strip():
+                break
+            method, path, version = request_line.decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await _read_line(reader)
+                if not line.strip():
+                    break
+                if len(headers) >= MAX_HEADERS:
+                    raise ValueError('Too many headers')
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await _read_body(reader, headers)
+
+            if method != 'POST':
+                status, response = 405, {'Err': 'Method {} not allowed'.format(method)}
+            else:
+                status, response = dispatch(handlers, path, body)
+            keep_alive = version.strip() == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+            if isinstance(response, dict):
+                response = json.dumps(response).encode()
+                writer.write(
+                    'HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n{}\r\n'.format(
+                        status, REASONS[status], len(response), '' if keep_alive else 'Connection: close\r\n',
+                    ).encode('latin-1') + response
+                )
+                await writer.drain()
+            else:
+                # Iterators of strings are streamed in chunks as they are produced
+                writer.write(
+                    'HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nTransfer-Encoding: chunked\r\n{}\r\n'.format(
+                        status, REASONS[status], '' if keep_alive else 'Connection: close\r\n',
+                    ).encode('latin-1')
+                )
+                for chunk in response:
+                    chunk = chunk.encode()
+                    if chunk:
+                        writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                        await writer.drain()
+                writer.write(b'0\r\n\r\n')
+                await writer.drain()
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def _serve(handlers: dict, path: str = None, sock: socket.socket = None):
+    if sock is not None:
+        path = None
+    elif os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(
+        lambda reader, writer: handle_connection(handlers, reader, writer), path=path, sock=sock,
+    )
+    async with server:
+        await server.serve_forever()
+
+
+def serve(handlers: dict, path: str = None, sock: socket.socket = None):
+    """Serves handlers on unix socket at path, or on already listening sock"""
+    asyncio.run(_serve(handlers, path, sock))
+
+
+__all__ = ['dispatch', 'handle_connection', 'serve']
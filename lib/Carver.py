@@ -0,0 +1,83 @@
+import ipaddress
+import random
+
+from docker_plugin_api.Plugin import InputValidationException
+
+from .Allocator import *
+
+DEFAULT_SUPERNET = '172.16.0.0/12'
+DEFAULT_PREFIXLEN = 24
+DEFAULT_SUPERNET6 = 'fd00::/8'
+DEFAULT_PREFIXLEN6 = 64
+
+# Number of carvers kept up to date by each Space
+MAX_CARVERS = 8
+
+
+def carve_options(v6: bool, options: dict = None):
+    options = options or {}
+    if v6:
+        supernet = options.get('supernet6') or DEFAULT_SUPERNET6
+        prefixlen = options.get('prefixlen6') or DEFAULT_PREFIXLEN6
+    else:
+        supernet = options.get('supernet') or DEFAULT_SUPERNET
+        prefixlen = options.get('prefixlen') or DEFAULT_PREFIXLEN
+    try:
+        supernet = ipaddress.ip_network(supernet, strict=False)
+        prefixlen = int(prefixlen)
+    except ValueError as e:
+        raise InputValidationException('Invalid supernet or prefixlen option: {}'.format(e))
+    if (supernet.version == 6) != bool(v6):
+        raise InputValidationException('Supernet {} does not match requested IP version'.format(supernet))
+    if not supernet.prefixlen <= prefixlen <= supernet.max_prefixlen:
+        raise InputValidationException('Prefix length {} does not fit in supernet {}'.format(prefixlen, supernet))
+    return supernet, prefixlen
+
+
+class SubnetCarver:
+    """
+    Splits supernet into blocks of given prefix length and keeps track
+    of the ones that do not overlap any pool.
+    """
+
+    def __init__(self, supernet, prefixlen: int):
+        self.supernet = supernet
+        self.prefixlen = prefixlen
+        self.base = int(supernet.network_address)
+        self.shift = supernet.max_prefixlen - prefixlen
+        self.blocks = IntervalAllocator(1 << (prefixlen - supernet.prefixlen))
+
+    def _block_range(self, network):
+        start = (int(network.network_address) - self.base) >> self.shift
+        end = ((int(network.broadcast_address) - self.base) >> self.shift) + 1
+        return start, end
+
+    def block(self, index: int):
+        return ipaddress.ip_network((self.base + (index << self.shift), self.prefixlen))
+
+    def mark(self, network):
+        if network.version == self.supernet.version and network.overlaps(self.supernet):
+            self.blocks.allocate_range(*self._block_range(network))
+
+    def unmark(self, network, is_used):
+        if network.version != self.supernet.version or not network.overlaps(self.supernet):
+            return
+        start, end = self._block_range(network)
+        if network.prefixlen >= self.prefixlen:
+            # Other pools might still be using the same block
+            if not is_used(self.block(start)):
+                self.blocks.release(start)
+        else:
+            self.blocks.release_range(start, end)
+
+    def carve(self, rng: random.Random = random):
+        start = rng.randrange(self.blocks.size)
+        index = self.blocks.find_free(start, self.blocks.size)
+        if index is None:
+            index = self.blocks.find_free(0, start)
+        if index is None:
+            raise InputValidationException('No free /{} subnets left in {}'.format(self.prefixlen, self.supernet))
+        return self.block(index)
+
+
+__all__ = ['MAX_CARVERS', 'carve_options', 'SubnetCarver']
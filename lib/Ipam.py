@@ -1,14 +1,36 @@
+import collections
+import hashlib
 import ipaddress
 import random
+import threading
+import time
 
 from docker_plugin_api.Plugin import InputValidationException
 
+from .Allocator import *
+from .Carver import *
+from .PrefixTrie import *
+from .RangeSet import *
+
+
+STRATEGIES = ('sequential', 'random', 'mac-hash')
+
+# Lookup tables for dotted-quad addresses, only canonical octets (no leading zeros) are present
+OCTETS = {str(octet): octet for octet in range(256)}
+OCTET_STRINGS = tuple(str(octet) for octet in range(256))
+# Prefix length suffixes shared by all pools
+SUFFIXES = tuple('/{}'.format(prefixlen) for prefixlen in range(129))
+
 
 def random_hex(len=4):
     return ''.join(random.choice('0123456789abcdef') for _ in range(len))
 
 
 class Pool:
+    __slots__ = ('options', 'validate', 'ptp', 'strategy', 'v6', 'id', 'base', 'prefixlen', 'subpool_base',
+                 'subpool_prefixlen', 'size', 'allocator', 'first', 'last', 'spans', 'current', 'used', 'references',
+                 'reuse_delay', 'quarantine', 'quarantined', 'restored', 'restored_until', 'replayed', 'journal_sequence', 'lock')
+
     def __init__(self, pool: str = None, options: dict = None, subPool: str = None, v6: bool = None):
         if pool == '':
             pool = None
@@ -27,98 +49,461 @@ class Pool:
             elif v6 is None:
                 raise InputValidationException('Trying to get random pool without specifying IP version (v6 field)')
 
-            if v6:
-                pool = 'fd00:{}:{}:{}::/64'.format(random_hex(), random_hex(), random_hex())
-            else:
-                pool = '172.{}.{}.0/24'.format(random.randrange(16, 32), random.randrange(0, 256))
+            # Space.carve_pool should be preferred, as it avoids existing pools
+            pool = SubnetCarver(*carve_options(v6, self.options)).carve()
 
-        self.pool = ipaddress.ip_network(pool, strict=False)
+        pool = ipaddress.ip_network(pool, strict=False)
         if subPool is not None:
-            self.subpool = ipaddress.ip_network(subPool, strict=False)
+            subpool = ipaddress.ip_network(subPool, strict=False)
         else:
-            self.subpool = self.pool
+            subpool = pool
 
-        if not self.subpool.subnet_of(self.pool):
+        if not subpool.subnet_of(pool):
             raise InputValidationException('Subpool must be a subnet of pool')
 
         self.validate = self.options.get('validate', '1') == '1'
         self.ptp = self.options.get('ptp', '0') == '1'
+        self.strategy = self.options.get('strategy') or 'sequential'
+        if self.strategy not in STRATEGIES:
+            raise InputValidationException('Unknown allocation strategy {}, expected one of: {}'.format(
+                self.strategy, ', '.join(STRATEGIES)))
+        try:
+            self.reuse_delay = float(self.options.get('reuse_delay') or 0)
+        except ValueError:
+            raise InputValidationException('Invalid reuse_delay {}, expected seconds'.format(
+                self.options['reuse_delay']))
+        if not 0 <= self.reuse_delay < float('inf'):
+            raise InputValidationException('Invalid reuse_delay {}, expected seconds'.format(
+                self.options['reuse_delay']))
+
+        self.v6 = isinstance(pool, ipaddress.IPv6Network)
 
-        self.allocations = set()
-        self.current = self.subpool.hosts() if not self.ptp else self.subpool.__iter__()
+        # Networks are kept as integers, ipaddress objects are only created on demand
+        self.id = str(pool)
+        self.base = int(pool.network_address)
+        self.prefixlen = pool.prefixlen
+        self.subpool_base = int(subpool.network_address)
+        self.subpool_prefixlen = subpool.prefixlen
 
-        self.v6 = isinstance(self.pool, ipaddress.IPv6Network)
+        # Allocations are kept as integer offsets from the pool network address,
+        # so that manual assignments outside of subpool can be tracked as well
+        self.size = pool.num_addresses
+        self.allocator = create_allocator(self.size, self.options.get('allocator'), self.strategy != 'sequential')
+        self.first, self.last = self._host_range()
+        # Parts of host range for automatic assignment, if narrowed down by include or exclude options
+        self.spans = self._spans()
+        if self.spans is not None and len(self.spans):
+            self.first, self.last = self.spans.starts[0], self.spans.ends[-1]
+        self.current = self.first
+        # Allocations within host range, maintained on every change for utilization reporting
+        self.used = 0
+        # Offset -> number of holders besides the first one, for addresses handed out
+        # more than once with validation disabled (created on first such allocation)
+        self.references = None
+        # Released addresses stay allocated until reuse_delay passes: (expiry, offset) in order of release
+        # and offset -> expiry of its latest release, entries not matching it are stale and skipped
+        self.quarantine = collections.deque() if self.reuse_delay else None
+        self.quarantined = {} if self.reuse_delay else None
+        # Allocations restored from persistent state, not yet re-requested by Docker (created by restore)
+        self.restored = None
+        self.restored_until = 0
+        # Number of restored allocations requested again by Docker
+        self.replayed = 0
+        # Sequence number of the last journal entry applied to this pool
+        self.journal_sequence = 0
+        # Reentrant, so that the change and its journal entry can be done atomically
+        self.lock = threading.RLock()
+
+    @property
+    def bits(self) -> int:
+        return 128 if self.v6 else 32
+
+    @property
+    def pool(self):
+        return ipaddress.ip_network((self.base, self.prefixlen))
+
+    @property
+    def subpool(self):
+        return ipaddress.ip_network((self.subpool_base, self.subpool_prefixlen))
+
+    def _host_range(self):
+        # Same range as returned by subpool.hosts() (or whole subpool in ptp mode)
+        start = self.subpool_base - self.base
+        end = start + (1 << (self.bits - self.subpool_prefixlen))
+        if not self.ptp and self.subpool_prefixlen < self.bits - 1:
+            start += 1
+            if not self.v6:
+                end -= 1
+        return start, end
+
+    def _ranges(self, option: str) -> RangeSet:
+        # Comma-separated networks, addresses and first-last address ranges
+        ranges = []
+        for item in self.options[option].split(','):
+            item = item.strip()
+            if not item:
+                continue
+            try:
+                if '/' in item:
+                    network = ipaddress.ip_network(item, strict=False)
+                    first, last = network.network_address, network.broadcast_address
+                else:
+                    first, _, last = item.partition('-')
+                    first = ipaddress.ip_address(first.strip())
+                    last = ipaddress.ip_address(last.strip()) if last else first
+            except ValueError as e:
+                raise InputValidationException('Invalid {} range {}: {}'.format(option, item, e))
+            if first.version != last.version or (first.version == 6) != self.v6 or \
+                    not self.base <= int(first) <= int(last) < self.base + self.size:
+                raise InputValidationException('Range {} of {} option is not within pool {}'.format(item, option, self))
+            ranges.append((int(first) - self.base, int(last) - self.base + 1))
+        return RangeSet(ranges)
+
+    def _spans(self) -> RangeSet:
+        if not self.options.get('include') and not self.options.get('exclude'):
+            return None
+        spans = RangeSet([(self.first, self.last)])
+        if self.options.get('include'):
+            spans = self._ranges('include').intersection(self.first, self.last)
+        if self.options.get('exclude'):
+            spans = spans.difference(self._ranges('exclude'))
+        return spans
 
     def __eq__(self, pool: 'Pool') -> bool:
-        return self.v6 == pool.v6 and self.pool == pool.pool and self.subpool == pool.subpool
+        return self.v6 == pool.v6 and self.base == pool.base and self.prefixlen == pool.prefixlen and \
+            self.subpool_base == pool.subpool_base and self.subpool_prefixlen == pool.subpool_prefixlen
 
     def overlaps(self, pool: 'Pool') -> bool:
         if self.v6 != pool.v6:
             raise InputValidationException('Cannot compare v6 and non-v6 pools')
-        return self.pool.overlaps(pool.pool)
-
-    def _is_allocated(self, address: str):
-        return str(address) in self.allocations
-
-    def _find_next_address(self):
-        for address in self.current:
-            if not self._is_allocated(address):
-                return address
-        self.current = self.subpool.hosts() if not self.ptp else self.subpool.__iter__()
-        for address in self.current:
-            if not self._is_allocated(address):
-                return address
-        raise InputValidationException('No free addresses in pool')
-
-    def allocate(self, address: str = None) -> str:
-        if address is None or address == '':
-            address = self._find_next_address()
+        return (self.base ^ pool.base) >> (self.bits - min(self.prefixlen, pool.prefixlen)) == 0
+
+    def offset(self, address: str) -> int:
+        if not self.v6:
+            # Plain dotted quads are parsed without ipaddress, anything else is left to it
+            parts = address.split('.')
+            if len(parts) == 4:
+                try:
+                    return (OCTETS[parts[0]] << 24 | OCTETS[parts[1]] << 16 | OCTETS[parts[2]] << 8 |
+                            OCTETS[parts[3]]) - self.base
+                except KeyError:
+                    pass
+        address = ipaddress.ip_address(address)
+        if (address.version == 6) != self.v6:
+            return -1
+        return int(address) - self.base
+
+    def address(self, offset: int) -> str:
+        if self.v6:
+            return str(ipaddress.IPv6Address(self.base + offset))
+        value = self.base + offset
+        return '.'.join((OCTET_STRINGS[value >> 24], OCTET_STRINGS[value >> 16 & 255],
+                         OCTET_STRINGS[value >> 8 & 255], OCTET_STRINGS[value & 255]))
+
+    def is_allocated(self, offset: int) -> bool:
+        return 0 <= offset < self.size and self.allocator.is_allocated(offset)
+
+    @property
+    def capacity(self) -> int:
+        return self.last - self.first if self.spans is None else len(self.spans)
+
+    @property
+    def free(self) -> int:
+        return self.capacity - self.used
+
+    @property
+    def utilization(self) -> float:
+        return self.used / self.capacity if self.capacity else 1.0
+
+    def _allocate_offset(self, offset: int) -> bool:
+        if not self.allocator.allocate(offset):
+            return False
+        if self.first <= offset < self.last and (self.spans is None or offset in self.spans):
+            self.used += 1
+        return True
+
+    def _release_offset(self, offset: int) -> bool:
+        if not self.allocator.release(offset):
+            return False
+        if self.first <= offset < self.last and (self.spans is None or offset in self.spans):
+            self.used -= 1
+        return True
+
+    def _update_range(self, update, start: int, end: int, sign: int) -> int:
+        # Host range parts are updated separately to keep the number of used addresses
+        spans = self.spans.within(start, end) if self.spans is not None else \
+            [(max(start, self.first), min(end, self.last))]
+        changed = 0
+        for inner_start, inner_end in spans:
+            if inner_start >= inner_end:
+                continue
+            inner = update(inner_start, inner_end)
+            self.used += sign * inner
+            changed += inner + update(start, inner_start)
+            start = inner_end
+        return changed + update(start, end)
+
+    def allocate_range(self, start: int, end: int) -> int:
+        """Marks offsets from start to end (exclusive) as allocated, used when loading state"""
+        with self.lock:
+            return self._update_range(self.allocator.allocate_range, start, end, 1)
+
+    def release_range(self, start: int, end: int) -> int:
+        with self.lock:
+            return self._update_range(self.allocator.release_range, start, end, -1)
+
+    def restore(self, window: float):
+        # Docker re-requests addresses in use within the window after restart
+        with self.lock:
+            self.restored = IntervalAllocator(self.size)
+            for start, end in self.allocator.ranges():
+                self.restored.allocate_range(start, end)
+            if self.quarantined:
+                for offset in self.quarantined:
+                    self.restored.release(offset)
+            self.restored_until = time.monotonic() + window
+            self.replayed = 0
+            # Every holder requests the address again, counting it from scratch
+            self.references = None
+
+    def _expire_restored(self):
+        if time.monotonic() < self.restored_until:
+            return
+        if self.replayed:
+            # Docker replayed this pool, so addresses it did not request again are stale
+            for start, end in list(self.restored.ranges()):
+                self.release_range(start, end)
+        self.restored = None
+
+    def _quarantine(self, offset: int):
+        # Address is kept allocated, so that automatic assignment skips it
+        expires = time.monotonic() + self.reuse_delay
+        self.quarantined[offset] = expires
+        self.quarantine.append((expires, offset))
+
+    def _expire_quarantine(self):
+        # Expiry times are increasing, so only the head of the queue is checked
+        now = time.monotonic()
+        while self.quarantine and self.quarantine[0][0] <= now:
+            expires, offset = self.quarantine.popleft()
+            if self.quarantined.get(offset) == expires:
+                del self.quarantined[offset]
+                self._release_offset(offset)
+
+    def _free_offset(self, offset: int):
+        if self.quarantined is None:
+            self._release_offset(offset)
+        elif offset not in self.quarantined and self.allocator.is_allocated(offset):
+            self._quarantine(offset)
+
+    def _find_free_from(self, offset: int) -> int:
+        # First free offset at or after given one, wrapping around to the beginning of host range
+        if self.spans is not None:
+            found = self.spans.find_free(self.allocator, offset)
+        else:
+            found = self.allocator.find_free(offset, self.last)
+            if found is None:
+                found = self.allocator.find_free(self.first, offset)
+        if found is None:
+            raise InputValidationException('No free addresses in pool')
+        return found
+
+    def _find_next_address(self, mac: str = None) -> int:
+        if self.strategy == 'sequential' or self.capacity <= 0 or (self.strategy == 'mac-hash' and not mac):
+            offset = self._find_free_from(self.current)
+            self.current = offset + 1
+            return offset
+        if self.strategy == 'random':
+            start = random.randrange(self.capacity)
+        else:
+            # Stable address for given MAC, unless it is already taken
+            digest = hashlib.blake2b(mac.strip().lower().encode(), digest_size=16).digest()
+            start = int.from_bytes(digest, 'big') % self.capacity
+        return self._find_free_from(self.first + start if self.spans is None else self.spans.nth(start))
+
+    def _reference(self, offset: int):
+        if self.references is None:
+            self.references = {}
+        self.references[offset] = self.references.get(offset, 0) + 1
+
+    def _dereference(self, offset: int) -> bool:
+        """Drops a holder of an address handed out more than once. Returns False if there was none."""
+        if self.references is None or offset not in self.references:
+            return False
+        if self.references[offset] == 1:
+            del self.references[offset]
         else:
-            address = ipaddress.ip_address(address)
+            self.references[offset] -= 1
+        return True
 
+    def _check_offset(self, offset: int):
         if not self.ptp:
-            if self.pool.network_address == address:
+            if offset == 0:
                 raise InputValidationException('Cannot allocate network address to a host')
-            if not self.v6 and self.pool.broadcast_address == address:
+            if not self.v6 and offset == self.size - 1:
                 raise InputValidationException('Cannot allocate broadcast address to a host')
-        if address not in self.pool:
+        if not 0 <= offset < self.size:
             raise InputValidationException('Requested address does not belong to a pool')
 
-        address = str(address)
-        if self.validate and self._is_allocated(address):
-            raise InputValidationException('Requested address {} is already used'.format(address))
-        self.allocations.add(address)
+    def _allocate_checked(self, offset: int) -> str:
+        address = self.address(offset)
+        if not self._allocate_offset(offset):
+            if self.quarantined and self.quarantined.pop(offset, None) is not None:
+                # Requested explicitly before its quarantine expired
+                pass
+            elif self.restored is not None and self.restored.release(offset):
+                self.replayed += 1
+            elif self.validate:
+                raise InputValidationException('Requested address {} is already used'.format(address))
+            else:
+                self._reference(offset)
+        return address + SUFFIXES[self.bits if self.ptp else self.prefixlen]
+
+    def allocate(self, address: str = None, mac: str = None) -> str:
+        with self.lock:
+            if self.restored is not None:
+                self._expire_restored()
+            if self.quarantine:
+                self._expire_quarantine()
+            if address is None or address == '':
+                offset = self._find_next_address(mac)
+            else:
+                offset = self.offset(address)
+            self._check_offset(offset)
+            return self._allocate_checked(offset)
 
-        prefixlen = self.pool.prefixlen
-        if self.ptp:
-            prefixlen = 128 if self.v6 else 32
-        return '{}/{}'.format(address, prefixlen)
+    def _offsets(self, addresses: list) -> list:
+        try:
+            offsets = [self.offset(address) for address in addresses]
+        except ValueError as e:
+            raise InputValidationException('Invalid address: {}'.format(e))
+        if len(set(offsets)) != len(offsets):
+            raise InputValidationException('Requested addresses contain duplicates')
+        return offsets
+
+    def allocate_many(self, count: int = 0, addresses: list = (), mac: str = None) -> list:
+        """Allocates given addresses followed by count automatically chosen ones, either all or none of them"""
+        with self.lock:
+            if self.restored is not None:
+                self._expire_restored()
+            if self.quarantine:
+                self._expire_quarantine()
+            offsets = self._offsets(addresses)
+            if count < 0 or count > self.free:
+                raise InputValidationException('Not enough free addresses in pool')
+
+            current, replayed = self.current, self.replayed
+            allocated, fresh, exempted, referenced, unquarantined = [], [], [], [], []
+            try:
+                for index in range(len(offsets) + count):
+                    offset = offsets[index] if index < len(offsets) else self._find_next_address(mac)
+                    self._check_offset(offset)
+                    if not self.allocator.is_allocated(offset):
+                        changes, change = fresh, offset
+                    elif self.quarantined and offset in self.quarantined:
+                        changes, change = unquarantined, (offset, self.quarantined[offset])
+                    elif self.restored is not None and self.restored.is_allocated(offset):
+                        changes, change = exempted, offset
+                    else:
+                        changes, change = referenced, offset
+                    allocated.append(self._allocate_checked(offset))
+                    # Recorded once done, so that a failed allocation is not undone
+                    changes.append(change)
+            except InputValidationException:
+                # Undo allocations done so far
+                for offset in fresh:
+                    self._release_offset(offset)
+                for offset in exempted:
+                    self.restored.allocate(offset)
+                for offset in referenced:
+                    self._dereference(offset)
+                for offset, expires in unquarantined:
+                    self.quarantined[offset] = expires
+                self.current, self.replayed = current, replayed
+                raise
+            return allocated
 
     def deallocate(self, address: str):
-        address = ipaddress.ip_address(address)
-        address = str(address)
-        if address in self.allocations:
-            self.allocations.remove(address)
+        with self.lock:
+            if self.restored is not None:
+                self._expire_restored()
+            offset = self.offset(address)
+            if 0 <= offset < self.size and not self._dereference(offset):
+                self._free_offset(offset)
+                if self.restored is not None:
+                    self.restored.release(offset)
+
+    def deallocate_many(self, addresses: list):
+        """Releases all given addresses, or none if any of them does not belong to the pool"""
+        with self.lock:
+            if self.restored is not None:
+                self._expire_restored()
+            offsets = self._offsets(addresses)
+            for address, offset in zip(addresses, offsets):
+                if not 0 <= offset < self.size:
+                    raise InputValidationException('Address {} does not belong to a pool'.format(address))
+            for offset in offsets:
+                if self._dereference(offset):
+                    continue
+                self._free_offset(offset)
+                if self.restored is not None:
+                    self.restored.release(offset)
 
     def __str__(self):
-        return str(self.pool)
+        return self.id
 
 
 class Space:
+    __slots__ = ('name', 'pools', 'pools6', 'trie', 'trie6', 'carvers', 'journal_sequence', 'lock')
+
     def __init__(self, name: str):
         self.name = name
         self.pools = {}
         self.pools6 = {}
+        self.trie = PrefixTrie(32)
+        self.trie6 = PrefixTrie(128)
+        # Most recently used carvers, rebuilt on demand when evicted
+        self.carvers = collections.OrderedDict()
+        # Sequence number of the last journal entry adding or removing a pool
+        self.journal_sequence = 0
+        # Reentrant, so that carve_pool and add_pool can be done atomically
+        self.lock = threading.RLock()
+
+    def _family(self, v6: bool):
+        return (self.pools6, self.trie6) if v6 else (self.pools, self.trie)
 
     def add_pool(self, pool: Pool) -> str:
-        check = self.pools6 if pool.v6 else self.pools
-        for id, p in check.items():
-            if pool == p:
-                return id
-            if pool.overlaps(p):
-                raise InputValidationException('There is already defined pool {} that overlaps this one'.format(id))
-        check[str(pool)] = pool
-        return str(pool)
+        with self.lock:
+            pools, trie = self._family(pool.v6)
+            existing = pools.get(pool.id)
+            if existing is not None and existing == pool:
+                return existing.id
+            key, length = pool.base, pool.prefixlen
+            overlap = trie.find_overlap(key, length)
+            if overlap is not None:
+                raise InputValidationException('There is already defined pool {} that overlaps this one'.format(overlap))
+            trie.insert(key, length, pool)
+            pools[pool.id] = pool
+            for carver in self.carvers.values():
+                carver.mark(pool.pool)
+            return pool.id
+
+    def load_pools(self, pools):
+        with self.lock:
+            for v6 in (False, True):
+                family = sorted((pool for pool in pools if pool.v6 == v6), key=lambda pool: (pool.base, pool.prefixlen))
+                ids, trie = self._family(v6)
+                previous = None
+                for pool in family:
+                    if previous is not None and previous.overlaps(pool) or \
+                            trie.find_overlap(pool.base, pool.prefixlen) is not None:
+                        raise InputValidationException('There is already defined pool that overlaps {}'.format(pool))
+                    previous = pool
+                trie.load((pool.base, pool.prefixlen, pool) for pool in family)
+                ids.update((pool.id, pool) for pool in family)
+                for carver in self.carvers.values():
+                    for pool in family:
+                        carver.mark(pool.pool)
 
     def get_pool(self, pool: str) -> Pool:
         pool = str(pool)
@@ -129,14 +514,54 @@ class Space:
         else:
             raise InputValidationException('Unknown pool {}'.format(pool))
 
+    def get_existing(self, pool: str, subpool: str = None) -> Pool:
+        """Returns pool with exactly given ID and subpool if it exists, without parsing either of them"""
+        existing = self.pools.get(pool) or self.pools6.get(pool)
+        if existing is None:
+            return None
+        if subpool:
+            return existing if str(existing.subpool) == subpool else None
+        if existing.subpool_base == existing.base and existing.subpool_prefixlen == existing.prefixlen:
+            return existing
+        return None
+
+    def find_pool(self, prefix: str) -> Pool:
+        with self.lock:
+            prefix = ipaddress.ip_network(prefix, strict=False)
+            pools, trie = self._family(prefix.version == 6)
+            pool = trie.longest_match(int(prefix.network_address), prefix.prefixlen)
+            if pool is None:
+                raise InputValidationException('No pool contains {}'.format(prefix))
+            return pool
+
     def remove_pool(self, pool: str):
-        pool = str(pool)
-        if pool in self.pools:
-            del self.pools[pool]
-        elif pool in self.pools6:
-            del self.pools6[pool]
-        else:
-            raise InputValidationException('Unknown pool {}'.format(pool))
+        with self.lock:
+            pool = str(pool)
+            if pool in self.pools:
+                pool = self.pools.pop(pool)
+            elif pool in self.pools6:
+                pool = self.pools6.pop(pool)
+            else:
+                raise InputValidationException('Unknown pool {}'.format(pool))
+            pools, trie = self._family(pool.v6)
+            trie.remove(pool.base, pool.prefixlen)
+            for carver in self.carvers.values():
+                carver.unmark(pool.pool, lambda block: trie.find_overlap(int(block.network_address), block.prefixlen))
+
+    def carve_pool(self, v6: bool, options: dict = None) -> str:
+        with self.lock:
+            supernet, prefixlen = carve_options(v6, options)
+            carver = self.carvers.get((supernet, prefixlen))
+            if carver is None:
+                carver = SubnetCarver(supernet, prefixlen)
+                for pool in self._family(v6)[0].values():
+                    carver.mark(pool.pool)
+                self.carvers[(supernet, prefixlen)] = carver
+                while len(self.carvers) > MAX_CARVERS:
+                    self.carvers.popitem(last=False)
+            else:
+                self.carvers.move_to_end((supernet, prefixlen))
+            return str(carver.carve())
 
 
-__all__ = ['random_hex', 'Pool', 'Space']
+__all__ = ['STRATEGIES', 'random_hex', 'Pool', 'Space']
@@ -0,0 +1,101 @@
+import json
+
+from docker_plugin_api.Plugin import Blueprint, InputValidationException
+import flask
+from .IpamDriverData import *
+
+app = Blueprint('IpamDebug', __name__)
+
+# Number of allocated ranges encoded in a single chunk of streamed response
+RANGES_PER_CHUNK = 1024
+
+
+# Read-only endpoints for inspecting state of the plugin
+
+
+def _pool_info(space, pool) -> dict:
+    return {
+        'PoolID': '{}-{}'.format(space.name, pool),
+        'Pool': str(pool),
+        'SubPool': str(pool.subpool),
+        'Options': pool.options,
+        'Allocated': len(pool.allocator),
+        'Used': pool.used,
+        'Free': pool.free,
+        'Utilization': pool.utilization,
+        'Quarantined': len(pool.quarantined) if pool.quarantined is not None else 0,
+    }
+
+
+def spaces_info(data: dict) -> dict:
+    result = {}
+    for name, space in list(spaces.items()):
+        with space.lock:
+            sync_pools()
+            pools = list(space.pools.values()) + list(space.pools6.values())
+        result[name] = [_pool_info(space, pool) for pool in pools]
+    return {
+        'Spaces': result,
+    }
+
+
+def pool_allocations(data: dict):
+    """
+    Returns iterator of JSON response chunks with allocations as [first, last] address ranges.
+    Allocations are copied with the pool lock held, ranges are encoded afterwards.
+    """
+    try:
+        pool_id = data['PoolID']
+    except KeyError as e:
+        raise InputValidationException('Invalid request: missing {}'.format(e))
+    space, pool = get_space_pool(pool_id)
+    with pool.lock:
+        info = _pool_info(space, pool)
+        allocator = pool.allocator.snapshot()
+    return _encode_allocations(info, pool, allocator)
+
+
+def _encode_allocations(info: dict, pool, allocator):
+    yield json.dumps(info)[:-1] + ', "Allocations": ['
+    chunk = []
+    separator = ''
+    for start, end in allocator.ranges():
+        chunk.append('["{}", "{}"]'.format(pool.address(start), pool.address(end - 1)))
+        if len(chunk) == RANGES_PER_CHUNK:
+            yield separator + ', '.join(chunk)
+            chunk = []
+            separator = ', '
+    if chunk:
+        yield separator + ', '.join(chunk)
+    yield ']}'
+
+
+def trace(data: dict):
+    """Returns iterator of recent requests as JSON lines"""
+    return tracer.dump()
+
+
+handlers = {
+    '/IpamDebug.Spaces': spaces_info,
+    '/IpamDebug.Allocations': pool_allocations,
+    '/IpamDebug.Trace': trace,
+}
+
+
+@app.route('/IpamDebug.Spaces', methods=['POST'])
+def Spaces():
+    return handlers['/IpamDebug.Spaces'](flask.request.get_json(force=True, silent=True) or {})
+
+
+@app.route('/IpamDebug.Allocations', methods=['POST'])
+def Allocations():
+    chunks = handlers['/IpamDebug.Allocations'](flask.request.get_json(force=True))
+    return flask.Response(chunks, mimetype='application/json')
+
+
+@app.route('/IpamDebug.Trace', methods=['POST'])
+def Trace():
+    return flask.Response(handlers['/IpamDebug.Trace']({}), mimetype='application/x-ndjson')
+
+
+__all__ = ['app', 'handlers']
@@ -7,29 +7,46 @@ from docker_plugin_api.IpamDriverEntities import *
 app = Blueprint('IpamDriver', __name__)
 
 
-@app.route('/IpamDriver.GetCapabilities', methods=['POST'])
-def GetCapabilities():
+# Handlers take decoded JSON request and return response to be encoded,
+# so that they can be shared between Flask and asyncio servers
+
+def get_capabilities(data: dict) -> dict:
     return {
         'RequiresMACAddress': True,
         'RequiresRequestReplay': True,
     }
 
 
-@app.route('/IpamDriver.GetDefaultAddressSpaces', methods=['POST'])
-def GetDefaultAddressSpaces():
+def get_default_address_spaces(data: dict) -> dict:
     return {
         'LocalDefaultAddressSpace': 'local',
         'GlobalDefaultAddressSpace': 'global',
     }
 
 
-@app.route('/IpamDriver.RequestPool', methods=['POST'])
-def RequestPool():
-    request = RequestPoolEntity(**flask.request.get_json(force=True))
+def request_pool(data: dict) -> dict:
+    request = RequestPoolEntity(**data)
     space = spaces[request.AddressSpace]
-    pool = Pool(pool=request.Pool, subPool=request.SubPool, options=request.Options, v6=request.V6)
-    pool_id = space.add_pool(pool)
-    full_id = '{}-{}'.format(space.name, pool_id)
+    with space.lock:
+        sync_pools()
+        # Replayed requests for known pools are answered without parsing or overlap checks
+        new = None
+        pool = space.get_existing(request.Pool, request.SubPool) if request.Pool else None
+        tracer.mark()
+        if pool is None:
+            if not request.Pool and not request.SubPool and request.V6 is not None:
+                request.Pool = space.carve_pool(request.V6, request.Options)
+            new = create_pool(pool=request.Pool, subPool=request.SubPool, options=request.Options, v6=request.V6)
+            # Same pool might still be known under a differently written network
+            pool = space.get_pool(space.add_pool(new))
+            if pool is new:
+                share_pool(space, pool)
+                journal_record('RequestPool', space, pool, subpool=str(pool.subpool), options=pool.options)
+        if pool is not new:
+            replay_pool(pool)
+            replay.record(pools=1)
+        full_id = register_pool(space, pool)
+    journal_checkpoint()
     return {
         'PoolID': full_id,
         'Pool': str(pool),
@@ -37,31 +54,101 @@ def RequestPool():
     }
 
 
-@app.route('/IpamDriver.ReleasePool', methods=['POST'])
-def ReleasePool():
-    request = ReleasePoolEntity(**flask.request.get_json(force=True))
+def release_pool(data: dict) -> dict:
+    request = ReleasePoolEntity(**data)
     space, pool = get_space_pool(request.PoolID)
-    space.remove_pool(pool)
+    with space.lock:
+        if sync_pools():
+            # Pool might have been replaced by another worker process in the meantime
+            pool = space.get_pool(pool)
+        space.remove_pool(pool)
+        unshare_pool(pool)
+        unregister_pool(request.PoolID)
+        journal_record('ReleasePool', space, pool)
+    journal_checkpoint()
     return {}
 
 
-@app.route('/IpamDriver.RequestAddress', methods=['POST'])
-def RequestAddress():
-    request = RequestAddressEntity(**flask.request.get_json(force=True))
-    space, pool = get_space_pool(request.PoolID)
-    address = pool.allocate(request.Address)
+# Fields of requests for the hot path, which are read without building entities
+REQUEST_ADDRESS_FIELDS = frozenset(('PoolID', 'Address', 'Options'))
+RELEASE_ADDRESS_FIELDS = frozenset(('PoolID', 'Address'))
+
+
+def request_address(data: dict) -> dict:
+    if 'PoolID' not in data or not data.keys() <= REQUEST_ADDRESS_FIELDS:
+        # Raises the same error for malformed requests as before
+        RequestAddressEntity(**data)
+    space, pool = get_space_pool(data['PoolID'])
+    requested = data.get('Address')
+    options = data.get('Options')
+    with pool.lock:
+        replayed = pool.replayed
+        address = pool.allocate(requested, options.get('com.docker.network.endpoint.macaddress') if options else None)
+        if pool.replayed != replayed:
+            replay.record(addresses=1)
+        journal_record('RequestAddress', space, pool, address=address.split('/')[0], auto=not requested)
+    journal_checkpoint()
     return {
         'Address': address,
         'Data': {},
     }
 
 
+def release_address(data: dict) -> dict:
+    if data.keys() != RELEASE_ADDRESS_FIELDS:
+        ReleaseAddressEntity(**data)
+    space, pool = get_space_pool(data['PoolID'])
+    with pool.lock:
+        pool.deallocate(data['Address'])
+        journal_record('ReleaseAddress', space, pool, address=data['Address'])
+    journal_checkpoint()
+    return {}
+
+
+handlers = {
+    '/IpamDriver.GetCapabilities': get_capabilities,
+    '/IpamDriver.GetDefaultAddressSpaces': get_default_address_spaces,
+    '/IpamDriver.RequestPool': request_pool,
+    '/IpamDriver.ReleasePool': release_pool,
+    '/IpamDriver.RequestAddress': request_address,
+    '/IpamDriver.ReleaseAddress': release_address,
+}
+
+
+# Routes look handlers up on every request, so that instrumented ones are used once installed
+
+def _request_data() -> dict:
+    return flask.request.get_json(force=True, silent=True) or {}
+
+
+@app.route('/IpamDriver.GetCapabilities', methods=['POST'])
+def GetCapabilities():
+    return handlers['/IpamDriver.GetCapabilities'](_request_data())
+
+
+@app.route('/IpamDriver.GetDefaultAddressSpaces', methods=['POST'])
+def GetDefaultAddressSpaces():
+    return handlers['/IpamDriver.GetDefaultAddressSpaces'](_request_data())
+
+
+@app.route('/IpamDriver.RequestPool', methods=['POST'])
+def RequestPool():
+    return handlers['/IpamDriver.RequestPool'](flask.request.get_json(force=True))
+
+
+@app.route('/IpamDriver.ReleasePool', methods=['POST'])
+def ReleasePool():
+    return handlers['/IpamDriver.ReleasePool'](flask.request.get_json(force=True))
+
+
+@app.route('/IpamDriver.RequestAddress', methods=['POST'])
+def RequestAddress():
+    return handlers['/IpamDriver.RequestAddress'](flask.request.get_json(force=True))
+
+
 @app.route('/IpamDriver.ReleaseAddress', methods=['POST'])
 def ReleaseAddress():
-    request = ReleaseAddressEntity(**flask.request.get_json(force=True))
-    space, pool = get_space_pool(request.PoolID)
-    pool.deallocate(request.Address)
-    return {}
+    return handlers['/IpamDriver.ReleaseAddress'](flask.request.get_json(force=True))
 
 
-__all__ = ['app']
+__all__ = ['app', 'handlers']
@@ -1,15 +1,166 @@
+import threading
+import time
+
+from docker_plugin_api.Plugin import InputValidationException
+
 from .Ipam import *
+from .Journal import *
+from .SharedState import *
+from .Tracing import *
 
 spaces = {
     'local': Space('local'),
     'global': Space('global'),
 }
 
+# PoolID -> (Space, Pool), kept in sync with pools of all spaces
+pool_ids = {}
+
+journal = None
+
+# SharedState used by worker processes, if enabled
+shared = None
+
+
+class ReplayProgress:
+    """Counts requests replayed by Docker Engine for already known pools and addresses"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.finished = None
+        self.pools = 0
+        self.addresses = 0
+        self.lock = threading.Lock()
+
+    def record(self, pools: int = 0, addresses: int = 0):
+        with self.lock:
+            self.pools += pools
+            self.addresses += addresses
+            self.finished = time.monotonic()
+
+    @property
+    def duration(self) -> float:
+        # From startup to the last replayed request
+        return self.finished - self.started if self.finished is not None else 0.0
+
+    def pending(self) -> int:
+        """Number of restored addresses not requested again yet"""
+        count = 0
+        for space in list(spaces.values()):
+            with space.lock:
+                pools = list(space.pools.values()) + list(space.pools6.values())
+            count += sum(pool.restored.count for pool in pools if pool.restored is not None)
+        return count
+
+
+replay = ReplayProgress()
+
+# Seconds in which addresses of a known pool may be requested again, once Docker Engine replays it
+replay_window = 300.0
+
+# Requests recorded once handlers are instrumented
+tracer = Tracer()
+
+
+def register_pool(space: Space, pool: Pool) -> str:
+    full_id = '{}-{}'.format(space.name, pool)
+    pool_ids[full_id] = (space, pool)
+    return full_id
+
+
+def unregister_pool(full_id: str):
+    pool_ids.pop(full_id, None)
+
 
 def get_space_pool(full_id: str):
-    space_id, pool_id = full_id.rsplit('-', 2)
-    space = spaces[space_id]
-    return space, space.get_pool(pool_id)
+    space_pool = pool_ids.get(full_id)
+    if shared is not None and (space_pool is None or not space_pool[1].valid()) and shared.changed():
+        # Pool might have been requested or released by another worker process
+        with shared.lock:
+            sync_pools()
+        space_pool = pool_ids.get(full_id)
+    if space_pool is None:
+        raise InputValidationException('Unknown pool {}'.format(full_id))
+    tracer.mark()
+    return space_pool
+
+
+def replay_pool(pool: Pool):
+    """
+    Opens replay window of a known pool requested again by Docker Engine, so that addresses
+    it holds may be requested again without conflicts, unless a window is already open.
+    Worker processes would exempt addresses separately, so shared pools are left as they are.
+    """
+    if shared is None:
+        with pool.lock:
+            if pool.restored is None:
+                pool.restore(replay_window)
+
+
+def enable_persistence(path: str, snapshot_interval: int = 1000, fsync: bool = True, replay_window: float = 300):
+    global journal
+    journal = Journal(path, spaces, snapshot_interval, fsync, replay_window)
+    journal.open()
+    for space in spaces.values():
+        for pool in list(space.pools.values()) + list(space.pools6.values()):
+            register_pool(space, pool)
+
+
+def enable_shared_state(path: str):
+    """Attaches to state file created by SharedState.create, shared with other worker processes"""
+    global shared
+    shared = SharedState(path)
+    # Pool table is a single one, so all spaces share its lock
+    for space in spaces.values():
+        space.lock = shared.lock
+    with shared.lock:
+        sync_pools()
+
+
+def create_pool(**kwargs) -> Pool:
+    return SharedPool(**kwargs) if shared is not None else Pool(**kwargs)
+
+
+def sync_pools() -> bool:
+    # Must be called with space lock held, returns whether any pool changed
+    if shared is None:
+        return False
+    added, removed = shared.sync(spaces)
+    for space, pool in removed:
+        unregister_pool('{}-{}'.format(space.name, pool))
+    for space, pool in added:
+        register_pool(space, pool)
+    return bool(added or removed)
+
+
+def share_pool(space: Space, pool: Pool):
+    # Must be called with space lock held, right after the pool was added to the space
+    if shared is None:
+        return
+    try:
+        shared.publish(space, pool)
+    except InputValidationException:
+        space.remove_pool(pool)
+        raise
+
+
+def unshare_pool(pool: Pool):
+    # Must be called with space lock held
+    if shared is not None:
+        shared.withdraw(pool)
+
+
+def journal_record(op: str, space: Space, pool: Pool, **fields):
+    # Must be called with the lock ordering the change held, see Journal.record
+    if journal is not None:
+        journal.record(op, space, pool, **fields)
+
+
+def journal_checkpoint():
+    if journal is not None:
+        journal.checkpoint()
 
 
-__all__ = ['spaces', 'get_space_pool']
+__all__ = ['spaces', 'ReplayProgress', 'replay', 'replay_pool', 'tracer', 'register_pool', 'unregister_pool', 'get_space_pool',
+           'enable_persistence', 'enable_shared_state', 'create_pool', 'sync_pools', 'share_pool', 'unshare_pool',
+           'journal_record', 'journal_checkpoint']
@@ -0,0 +1,60 @@
+from docker_plugin_api.Plugin import Blueprint, InputValidationException
+import flask
+from .IpamDriverData import *
+
+app = Blueprint('IpamExtension', __name__)
+
+
+# Endpoints not used by Docker Engine, for tools reserving many addresses in one round-trip
+
+
+def request_addresses(data: dict) -> dict:
+    try:
+        pool_id = data['PoolID']
+        count = int(data.get('Count') or 0)
+    except (KeyError, TypeError, ValueError) as e:
+        raise InputValidationException('Invalid request: {}'.format(e))
+    addresses = data.get('Addresses') or []
+    options = data.get('Options') or {}
+    space, pool = get_space_pool(pool_id)
+    with pool.lock:
+        allocated = pool.allocate_many(count, addresses, options.get('com.docker.network.endpoint.macaddress'))
+        journal_record('RequestAddresses', space, pool,
+                       addresses=[address.split('/')[0] for address in allocated], current=pool.current)
+    journal_checkpoint()
+    return {
+        'Addresses': allocated,
+    }
+
+
+def release_addresses(data: dict) -> dict:
+    try:
+        pool_id = data['PoolID']
+        addresses = data['Addresses']
+    except KeyError as e:
+        raise InputValidationException('Invalid request: missing {}'.format(e))
+    space, pool = get_space_pool(pool_id)
+    with pool.lock:
+        pool.deallocate_many(addresses)
+        journal_record('ReleaseAddresses', space, pool, addresses=addresses)
+    journal_checkpoint()
+    return {}
+
+
+handlers = {
+    '/IpamExtension.RequestAddresses': request_addresses,
+    '/IpamExtension.ReleaseAddresses': release_addresses,
+}
+
+
+@app.route('/IpamExtension.RequestAddresses', methods=['POST'])
+def RequestAddresses():
+    return handlers['/IpamExtension.RequestAddresses'](flask.request.get_json(force=True))
+
+
+@app.route('/IpamExtension.ReleaseAddresses', methods=['POST'])
+def ReleaseAddresses():
+    return handlers['/IpamExtension.ReleaseAddresses'](flask.request.get_json(force=True))
+
+
+__all__ = ['app', 'handlers']
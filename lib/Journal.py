@@ -0,0 +1,211 @@
+import json
+import os
+import threading
+
+from docker_plugin_api.Plugin import InputValidationException
+
+from .Allocator import *
+from .Ipam import *
+
+POOL_OPS = ('RequestPool', 'ReleasePool')
+
+
+class Journal:
+    """
+    Append-only log of mutations with periodic snapshots.
+
+    Entries are written while holding the lock that orders the change
+    (space lock for pool changes, pool lock for address changes), so the
+    log order matches the order of changes applied to every pool.
+    Spaces and pools remember the sequence number of the last entry
+    applied to them, so that entries already included in a snapshot
+    are skipped when loading.
+    """
+
+    def __init__(self, path: str, spaces: dict, snapshot_interval: int = 1000,
+                 fsync: bool = True, replay_window: float = 300):
+        self.path = path
+        self.spaces = spaces
+        self.snapshot_interval = snapshot_interval
+        self.fsync = fsync
+        self.replay_window = replay_window
+        self.snapshot_path = os.path.join(path, 'snapshot.json')
+        self.log_path = os.path.join(path, 'journal.log')
+        # Log being compacted by a snapshot in progress
+        self.old_log_path = os.path.join(path, 'journal.log.old')
+        self.sequence = 0
+        self.entries = 0
+        self.log = None
+        self.lock = threading.Lock()
+        self.snapshot_lock = threading.Lock()
+
+    def open(self):
+        os.makedirs(self.path, exist_ok=True)
+        self.load()
+        self.snapshot()
+
+    def close(self):
+        with self.lock:
+            if self.log is not None:
+                self.log.close()
+                self.log = None
+
+    def load(self):
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path) as f:
+                state = json.load(f)
+            self.sequence = state['sequence']
+            for name, space_state in state['spaces'].items():
+                space = self.spaces.setdefault(name, Space(name))
+                space.load_pools([self._load_pool(pool) for pool in space_state['pools']])
+                space.journal_sequence = space_state['sequence']
+
+        for path in (self.old_log_path, self.log_path):
+            if not os.path.exists(path):
+                continue
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Torn write at the end of the log
+                        break
+                    self.sequence = max(self.sequence, entry['seq'])
+                    try:
+                        self._apply(entry)
+                    except (InputValidationException, KeyError, ValueError):
+                        pass
+
+        for pool in self._pools():
+            pool.restore(self.replay_window)
+
+    def _pools(self):
+        pools = []
+        for space in list(self.spaces.values()):
+            with space.lock:
+                pools.extend(space.pools.values())
+                pools.extend(space.pools6.values())
+        return pools
+
+    def _apply(self, entry: dict):
+        space = self.spaces[entry['space']]
+        op = entry['op']
+        sequence = entry['seq']
+        if op in POOL_OPS:
+            if sequence <= space.journal_sequence:
+                return
+            space.journal_sequence = sequence
+            if op == 'RequestPool':
+                pool = Pool(pool=entry['pool'], subPool=entry['subpool'], options=entry['options'])
+                pool.journal_sequence = sequence
+                space.add_pool(pool)
+            else:
+                space.remove_pool(entry['pool'])
+            return
+
+        pool = space.get_pool(entry['pool'])
+        if sequence <= pool.journal_sequence:
+            return
+        pool.journal_sequence = sequence
+        if op == 'RequestAddress':
+            pool.allocate(entry['address'])
+            if entry.get('auto'):
+                pool.current = pool.offset(entry['address']) + 1
+        elif op == 'ReleaseAddress':
+            pool.deallocate(entry['address'])
+        elif op == 'RequestAddresses':
+            pool.allocate_many(addresses=entry['addresses'])
+            pool.current = entry['current']
+        elif op == 'ReleaseAddresses':
+            pool.deallocate_many(entry['addresses'])
+
+    def _dump_pool(self, pool: Pool) -> dict:
+        with pool.lock:
+            return {
+                'pool': str(pool),
+                'subpool': str(pool.subpool),
+                'options': pool.options,
+                'sequence': pool.journal_sequence,
+                'current': pool.current,
+                'allocations': list(pool.allocator.ranges()),
+                'restored': list(pool.restored.ranges()) if pool.restored is not None else [],
+                'quarantined': list(pool.quarantined) if pool.quarantined is not None else [],
+            }
+
+    def _load_pool(self, state: dict) -> Pool:
+        pool = Pool(pool=state['pool'], subPool=state['subpool'], options=state['options'])
+        for start, end in state['allocations']:
+            pool.allocate_range(start, end)
+        pool.journal_sequence = state['sequence']
+        pool.current = state['current']
+        # Keep exemptions until the log is replayed, Pool.restore resets them afterwards
+        pool.restored = IntervalAllocator(pool.size)
+        for start, end in state['restored']:
+            pool.restored.allocate_range(start, end)
+        pool.restored_until = float('inf')
+        # Quarantined addresses are in allocations, their delay starts over as monotonic time does
+        if pool.quarantined is not None:
+            for offset in state.get('quarantined', ()):
+                pool._quarantine(offset)
+        return pool
+
+    def record(self, op: str, space: Space, pool: Pool, **fields):
+        """
+        Appends an entry. Caller must hold space lock (for pool changes)
+        or pool lock (for address changes) of the change being recorded.
+        """
+        with self.lock:
+            self.sequence += 1
+            if op in POOL_OPS:
+                space.journal_sequence = self.sequence
+            if op != 'ReleasePool':
+                pool.journal_sequence = self.sequence
+            fields.update(seq=self.sequence, op=op, space=space.name, pool=str(pool))
+            self.log.write(json.dumps(fields, separators=(',', ':')) + '\n')
+            self.log.flush()
+            if self.fsync:
+                os.fsync(self.log.fileno())
+            self.entries += 1
+
+    def checkpoint(self):
+        """Writes a snapshot if enough entries were recorded. Caller must not hold any locks."""
+        if self.entries >= self.snapshot_interval:
+            self.snapshot()
+
+    def snapshot(self):
+        with self.snapshot_lock:
+            with self.lock:
+                if self.log is not None:
+                    self.log.close()
+                # Old log is kept if previous snapshot did not complete
+                if not os.path.exists(self.old_log_path) and os.path.exists(self.log_path):
+                    os.replace(self.log_path, self.old_log_path)
+                self.log = open(self.log_path, 'a')
+                self.entries = 0
+
+            state = {
+                'sequence': self.sequence,
+                'spaces': {},
+            }
+            for name, space in list(self.spaces.items()):
+                with space.lock:
+                    sequence = space.journal_sequence
+                    pools = list(space.pools.values()) + list(space.pools6.values())
+                state['spaces'][name] = {
+                    'sequence': sequence,
+                    'pools': [self._dump_pool(pool) for pool in pools],
+                }
+            with self.lock:
+                state['sequence'] = self.sequence
+
+            temporary = self.snapshot_path + '.tmp'
+            with open(temporary, 'w') as f:
+                json.dump(state, f, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, self.snapshot_path)
+            if os.path.exists(self.old_log_path):
+                os.remove(self.old_log_path)
+
+
+__all__ = ['Journal']
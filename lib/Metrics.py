@@ -0,0 +1,150 @@
+import bisect
+import http.server
+import os
+import socketserver
+import threading
+import time
+
+# Upper bounds of latency histogram buckets in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        # Last bucket is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    Request counters and latency histograms of instrumented handlers,
+    together with gauges read from pools when rendered.
+    Handlers are not touched until instrument is called, so there is
+    no overhead when metrics are disabled.
+    """
+
+    def __init__(self, spaces: dict, replay=None):
+        self.spaces = spaces
+        # ReplayProgress of the driver, if its counters should be rendered as well
+        self.replay = replay
+        self.requests = {}
+        self.errors = {}
+        self.latency = {}
+        self.lock = threading.Lock()
+
+    def observe(self, endpoint: str, seconds: float, error: bool):
+        with self.lock:
+            if endpoint not in self.requests:
+                self.requests[endpoint] = 0
+                self.errors[endpoint] = 0
+                self.latency[endpoint] = Histogram()
+            self.requests[endpoint] += 1
+            if error:
+                self.errors[endpoint] += 1
+            self.latency[endpoint].observe(seconds)
+
+    def wrap(self, endpoint: str, handler):
+        def instrumented(data: dict) -> dict:
+            start = time.perf_counter()
+            error = True
+            try:
+                response = handler(data)
+                error = False
+                return response
+            finally:
+                self.observe(endpoint, time.perf_counter() - start, error)
+        return instrumented
+
+    def instrument(self, handlers: dict):
+        """Replaces handlers in place with instrumented ones"""
+        for path, handler in list(handlers.items()):
+            handlers[path] = self.wrap(path.rsplit('.', 1)[-1], handler)
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            endpoints = sorted(self.requests)
+            lines.append('# TYPE pyipam_requests_total counter')
+            for endpoint in endpoints:
+                lines.append('pyipam_requests_total{{endpoint="{}"}} {}'.format(endpoint, self.requests[endpoint]))
+            lines.append('# TYPE pyipam_errors_total counter')
+            for endpoint in endpoints:
+                lines.append('pyipam_errors_total{{endpoint="{}"}} {}'.format(endpoint, self.errors[endpoint]))
+            lines.append('# TYPE pyipam_request_duration_seconds histogram')
+            for endpoint in endpoints:
+                histogram = self.latency[endpoint]
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append('pyipam_request_duration_seconds_bucket{{endpoint="{}",le="{}"}} {}'.format(
+                        endpoint, bound, cumulative))
+                lines.append('pyipam_request_duration_seconds_sum{{endpoint="{}"}} {}'.format(endpoint, histogram.sum))
+                lines.append('pyipam_request_duration_seconds_count{{endpoint="{}"}} {}'.format(
+                    endpoint, histogram.count))
+
+        pools = []
+        for name, space in list(self.spaces.items()):
+            with space.lock:
+                pools.extend((name, pool) for pool in list(space.pools.values()) + list(space.pools6.values()))
+        for gauge in ('allocated', 'free', 'utilization'):
+            lines.append('# TYPE pyipam_pool_{} gauge'.format(gauge))
+            for name, pool in pools:
+                value = pool.used if gauge == 'allocated' else getattr(pool, gauge)
+                lines.append('pyipam_pool_{}{{space="{}",pool="{}"}} {}'.format(gauge, name, pool, value))
+
+        if self.replay is not None:
+            lines.extend([
+                '# TYPE pyipam_replayed_pools_total counter',
+                'pyipam_replayed_pools_total {}'.format(self.replay.pools),
+                '# TYPE pyipam_replayed_addresses_total counter',
+                'pyipam_replayed_addresses_total {}'.format(self.replay.addresses),
+                '# TYPE pyipam_replay_pending_addresses gauge',
+                'pyipam_replay_pending_addresses {}'.format(self.replay.pending()),
+                '# TYPE pyipam_replay_duration_seconds gauge',
+                'pyipam_replay_duration_seconds {}'.format(self.replay.duration),
+            ])
+        return '\n'.join(lines) + '\n'
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(metrics: Metrics, path: str) -> threading.Thread:
+    """Serves metrics on a separate unix socket in a background thread"""
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def address_string(self):
+            return path
+
+        def log_message(self, format, *args):
+            pass
+
+    if os.path.exists(path):
+        os.unlink(path)
+    server = _UnixHTTPServer(path, Handler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics', daemon=True)
+    thread.start()
+    return thread
+
+
+__all__ = ['Metrics', 'serve']
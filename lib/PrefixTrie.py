@@ -0,0 +1,160 @@
+class _Node:
+    __slots__ = ('key', 'length', 'value', 'children')
+
+    def __init__(self, key: int, length: int, value=None):
+        self.key = key
+        self.length = length
+        self.value = value
+        self.children = [None, None]
+
+
+class PrefixTrie:
+    """
+    Path-compressed binary trie of network prefixes. Keys are network
+    addresses as integers, every node is labelled with a prefix length.
+    """
+
+    def __init__(self, bits: int):
+        self.bits = bits
+        self.root = None
+        self.count = 0
+
+    def _mask(self, key: int, length: int) -> int:
+        shift = self.bits - length
+        return key >> shift << shift
+
+    def _bit(self, key: int, index: int) -> int:
+        return key >> (self.bits - 1 - index) & 1
+
+    def _common(self, key1: int, length1: int, key2: int, length2: int) -> int:
+        return min(self.bits - (key1 ^ key2).bit_length(), length1, length2)
+
+    def _subtree_value(self, node: _Node):
+        # Nodes without value always have two children
+        while node.value is None:
+            node = node.children[0] or node.children[1]
+        return node.value
+
+    def insert(self, key: int, length: int, value):
+        key = self._mask(key, length)
+        parent, index, node = None, 0, self.root
+        while node is not None:
+            common = self._common(node.key, node.length, key, length)
+            if common < node.length:
+                if common == length:
+                    new = _Node(key, length, value)
+                else:
+                    new = _Node(self._mask(key, common), common)
+                    leaf = _Node(key, length, value)
+                    new.children[self._bit(key, common)] = leaf
+                new.children[self._bit(node.key, common)] = node
+                node = new
+                break
+            if node.length == length:
+                if node.value is None:
+                    self.count += 1
+                node.value = value
+                return
+            parent, index, node = node, self._bit(key, node.length), node.children[self._bit(key, node.length)]
+        else:
+            node = _Node(key, length, value)
+        self.count += 1
+        if parent is None:
+            self.root = node
+        else:
+            parent.children[index] = node
+
+    def load(self, items):
+        """Inserts (key, length, value) tuples, shortest prefixes first."""
+        for key, length, value in sorted(items, key=lambda item: (item[1], item[0])):
+            self.insert(key, length, value)
+
+    def get(self, key: int, length: int):
+        key = self._mask(key, length)
+        node = self.root
+        while node is not None and node.length <= length:
+            if self._mask(key, node.length) != node.key:
+                return None
+            if node.length == length:
+                return node.value
+            node = node.children[self._bit(key, node.length)]
+        return None
+
+    def longest_match(self, key: int, length: int = None):
+        """Returns value of the most specific prefix containing key/length."""
+        if length is None:
+            length = self.bits
+        key = self._mask(key, length)
+        result = None
+        node = self.root
+        while node is not None and node.length <= length:
+            if self._mask(key, node.length) != node.key:
+                break
+            if node.value is not None:
+                result = node.value
+            if node.length == length:
+                break
+            node = node.children[self._bit(key, node.length)]
+        return result
+
+    def find_overlap(self, key: int, length: int):
+        """Returns value of any prefix that contains or is contained in key/length."""
+        key = self._mask(key, length)
+        node = self.root
+        while node is not None:
+            common = self._common(node.key, node.length, key, length)
+            if common < node.length:
+                if common == length:
+                    return self._subtree_value(node)
+                return None
+            if node.value is not None:
+                return node.value
+            if node.length == length:
+                return self._subtree_value(node)
+            node = node.children[self._bit(key, node.length)]
+        return None
+
+    def remove(self, key: int, length: int):
+        key = self._mask(key, length)
+        grandparent, parent, node = None, None, self.root
+        while node is not None and node.length < length:
+            if self._mask(key, node.length) != node.key:
+                return None
+            grandparent, parent, node = parent, node, node.children[self._bit(key, node.length)]
+        if node is None or node.length != length or node.key != key or node.value is None:
+            return None
+
+        value = node.value
+        node.value = None
+        self.count -= 1
+        children = [child for child in node.children if child is not None]
+        if len(children) == 2:
+            return value
+        self._replace(parent, node, children[0] if children else None)
+        # Parent might have become a glue node with single child
+        if not children and parent is not None and parent.value is None:
+            remaining = parent.children[0] or parent.children[1]
+            self._replace(grandparent, parent, remaining)
+        return value
+
+    def _replace(self, parent: _Node, node: _Node, new: _Node):
+        if parent is None:
+            self.root = new
+        elif parent.children[0] is node:
+            parent.children[0] = new
+        else:
+            parent.children[1] = new
+
+    def values(self):
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            if node.value is not None:
+                yield node.value
+            stack.extend(child for child in reversed(node.children) if child is not None)
+
+    def __len__(self):
+        return self.count
+
+
+__all__ = ['PrefixTrie']
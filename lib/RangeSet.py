@@ -0,0 +1,88 @@
+import bisect
+
+
+class RangeSet:
+    """
+    Immutable set of integers kept as sorted, disjoint and non-adjacent
+    ranges [starts[i], ends[i]). Totals hold the number of integers
+    in all ranges before the given one, so that the n-th one can be found.
+    """
+
+    __slots__ = ('starts', 'ends', 'totals')
+
+    def __init__(self, ranges=()):
+        self.starts, self.ends = [], []
+        for start, end in sorted(ranges):
+            if start >= end:
+                continue
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+        self.totals = []
+        total = 0
+        for start, end in zip(self.starts, self.ends):
+            self.totals.append(total)
+            total += end - start
+
+    def ranges(self):
+        return zip(self.starts, self.ends)
+
+    def __len__(self):
+        if not self.starts:
+            return 0
+        return self.totals[-1] + self.ends[-1] - self.starts[-1]
+
+    def __contains__(self, value: int) -> bool:
+        index = bisect.bisect_right(self.starts, value) - 1
+        return index >= 0 and value < self.ends[index]
+
+    def intersection(self, start: int, end: int) -> 'RangeSet':
+        return RangeSet((max(s, start), min(e, end)) for s, e in self.ranges())
+
+    def difference(self, other: 'RangeSet') -> 'RangeSet':
+        result = []
+        for start, end in self.ranges():
+            # Ranges of other overlapping this one
+            index = max(bisect.bisect_right(other.ends, start), 0)
+            while index < len(other.starts) and other.starts[index] < end:
+                if other.starts[index] > start:
+                    result.append((start, other.starts[index]))
+                start = max(start, other.ends[index])
+                index += 1
+            if start < end:
+                result.append((start, end))
+        return RangeSet(result)
+
+    def within(self, start: int, end: int):
+        """Yields parts of ranges within [start, end), in order."""
+        index = bisect.bisect_right(self.ends, start)
+        while index < len(self.starts) and self.starts[index] < end:
+            yield max(self.starts[index], start), min(self.ends[index], end)
+            index += 1
+
+    def nth(self, index: int) -> int:
+        """Returns index-th integer of the set, counting from 0."""
+        position = bisect.bisect_right(self.totals, index) - 1
+        return self.starts[position] + index - self.totals[position]
+
+    def find_free(self, allocator, offset: int):
+        """
+        Returns the lowest offset of the set at or after given one that is free in allocator,
+        wrapping around to the beginning of the set, or None. Allocated ranges are skipped
+        by the allocator, ranges not in the set are skipped as a whole.
+        """
+        index = bisect.bisect_right(self.ends, offset)
+        for position in range(index, len(self.starts)):
+            found = allocator.find_free(max(self.starts[position], offset), self.ends[position])
+            if found is not None:
+                return found
+        for position in range(min(index + 1, len(self.starts))):
+            found = allocator.find_free(self.starts[position], min(self.ends[position], offset))
+            if found is not None:
+                return found
+        return None
+
+
+__all__ = ['RangeSet']
@@ -0,0 +1,446 @@
+import array
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+
+from docker_plugin_api.Plugin import InputValidationException
+
+from .Allocator import *
+from .Ipam import *
+
+MAGIC = b'pyIPAM01'
+# Sparse file, only pages touched by pools take up memory
+DEFAULT_SIZE = 256 << 20
+MAX_POOLS = 4096
+HEADER_SIZE = 4096
+SLOT_SIZE = 512
+TABLE_END = HEADER_SIZE + MAX_POOLS * SLOT_SIZE
+
+# Magic, generation (bumped whenever a pool is added or removed), last serial, end of regions
+HEADER = struct.Struct('<8sQQQ')
+# Serial (0 if free), region offset, region size, length of JSON spec following the slot header
+SLOT = struct.Struct('<QQQQ')
+# Every region starts with allocator count, pool used and current (relative to first) counters
+REGION_HEADER_SIZE = 24
+# Followed by number of addresses handed out more than once and their (offset + 1, holders) pairs
+MAX_REFERENCES = 64
+REFERENCES_SIZE = 8 + MAX_REFERENCES * 16
+
+
+class ProcessLock:
+    """
+    Reentrant lock excluding both threads of this process and other processes
+    holding a lock on the same byte of the same file.
+    POSIX record locks are owned by processes, so the thread lock ensures that
+    only one thread of the process takes the record lock at a time.
+    """
+
+    def __init__(self, fd: int, offset: int):
+        self.fd = fd
+        self.offset = offset
+        self.lock = threading.RLock()
+        self.depth = 0
+
+    def acquire(self):
+        self.lock.acquire()
+        if self.depth == 0:
+            try:
+                fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, self.offset)
+            except BaseException:
+                self.lock.release()
+                raise
+        self.depth += 1
+
+    def release(self):
+        self.depth -= 1
+        if self.depth == 0:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, self.offset)
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class PoolLock(ProcessLock):
+    """Fails to be acquired if the pool was released by another process in the meantime"""
+
+    def __init__(self, pool: 'SharedPool', fd: int, offset: int):
+        super().__init__(fd, offset)
+        self.pool = pool
+
+    def acquire(self):
+        super().acquire()
+        if not self.pool.valid():
+            self.release()
+            raise InputValidationException('Unknown pool {}'.format(self.pool))
+
+
+class SharedBitmapAllocator(BitmapAllocator):
+    """Bitmap allocator kept in a buffer shared between processes, including its count"""
+    __slots__ = ('header',)
+
+    def __init__(self, size: int, header: memoryview, buffer: memoryview, initialize: bool):
+        # Allocator.__init__ is skipped, as it would reset the count of an existing bitmap
+        self.size = size
+        self.header = header.cast('Q')
+        self.levels = self.build_levels(size, buffer, initialize)
+
+    @property
+    def count(self) -> int:
+        return self.header[0]
+
+    @count.setter
+    def count(self, value: int):
+        self.header[0] = value
+
+
+class WindowAllocator(Allocator):
+    """Tracks only offsets from origin to origin + inner.size, used for pools too large for a shared bitmap"""
+    __slots__ = ('origin', 'inner')
+
+    def __init__(self, size: int, origin: int, inner: Allocator):
+        self.size = size
+        self.origin = origin
+        self.inner = inner
+
+    @property
+    def count(self) -> int:
+        return self.inner.count
+
+    def _clip(self, start: int, end: int):
+        return max(start - self.origin, 0), min(end - self.origin, self.inner.size)
+
+    def is_allocated(self, offset: int) -> bool:
+        offset -= self.origin
+        return 0 <= offset < self.inner.size and self.inner.is_allocated(offset)
+
+    def allocate(self, offset: int) -> bool:
+        if not 0 <= offset - self.origin < self.inner.size:
+            raise InputValidationException('Address is outside of the range tracked in shared mode')
+        return self.inner.allocate(offset - self.origin)
+
+    def release(self, offset: int) -> bool:
+        offset -= self.origin
+        return 0 <= offset < self.inner.size and self.inner.release(offset)
+
+    def allocate_range(self, start: int, end: int) -> int:
+        start, end = self._clip(start, end)
+        return self.inner.allocate_range(start, end) if start < end else 0
+
+    def release_range(self, start: int, end: int) -> int:
+        start, end = self._clip(start, end)
+        return self.inner.release_range(start, end) if start < end else 0
+
+    def find_free(self, start: int, end: int):
+        start, end = self._clip(start, end)
+        if start >= end:
+            return None
+        found = self.inner.find_free(start, end)
+        return None if found is None else found + self.origin
+
+    def snapshot(self) -> 'WindowAllocator':
+        return WindowAllocator(self.size, self.origin, self.inner.snapshot())
+
+    def ranges(self):
+        for start, end in self.inner.ranges():
+            yield start + self.origin, end + self.origin
+
+
+class SharedReferences:
+    """
+    Holders of addresses handed out more than once, as Pool.references, but kept in the region
+    of a shared pool so that every worker process sees them. Entries are kept packed at the
+    beginning of the table, a pool rarely has more than a few of them.
+    """
+    __slots__ = ('table',)
+
+    def __init__(self, buffer: memoryview):
+        # Number of entries followed by pairs of offset + 1 (0 if free) and number of holders
+        self.table = buffer.cast('Q')
+
+    def __len__(self) -> int:
+        return self.table[0]
+
+    def _find(self, offset: int) -> int:
+        table = self.table
+        key = offset + 1
+        for index in range(1, 1 + 2 * table[0], 2):
+            if table[index] == key:
+                return index
+        return 0
+
+    def __contains__(self, offset: int) -> bool:
+        return self.table[0] != 0 and self._find(offset) != 0
+
+    def get(self, offset: int, default: int = None) -> int:
+        index = self._find(offset)
+        return self.table[index + 1] if index else default
+
+    def __getitem__(self, offset: int) -> int:
+        index = self._find(offset)
+        if not index:
+            raise KeyError(offset)
+        return self.table[index + 1]
+
+    def __setitem__(self, offset: int, holders: int):
+        table = self.table
+        index = self._find(offset)
+        if not index:
+            if table[0] == MAX_REFERENCES:
+                raise InputValidationException('Too many addresses handed out more than once, at most {} '
+                                               'are supported in shared mode'.format(MAX_REFERENCES))
+            index = 1 + 2 * table[0]
+            table[index] = offset + 1
+            table[0] += 1
+        table[index + 1] = holders
+
+    def __delitem__(self, offset: int):
+        table = self.table
+        index = self._find(offset)
+        if not index:
+            raise KeyError(offset)
+        # Last entry takes place of the removed one
+        last = 2 * table[0] - 1
+        table[index], table[index + 1] = table[last], table[last + 1]
+        table[last] = table[last + 1] = 0
+        table[0] -= 1
+
+    def clear(self):
+        for index in range(1 + 2 * self.table[0]):
+            self.table[index] = 0
+
+
+class SharedPool(Pool):
+    """
+    Pool with allocations and counters kept in SharedState once attached,
+    so that all worker processes see the same allocations.
+    Pools larger than a bitmap can hold track only the beginning of their host range.
+    """
+    __slots__ = ('counters', 'reference_table', 'shared', 'slot', 'serial', 'origin', 'window')
+
+    def __init__(self, *args, **kwargs):
+        # Counters are kept locally until the pool is attached
+        self.counters = array.array('Q', [0, 0])
+        # Pools are attached before any allocation, so there are no references until then
+        self.reference_table = None
+        self.shared = None
+        self.slot = None
+        self.serial = 0
+        super().__init__(*args, **kwargs)
+        if self.reuse_delay:
+            # Quarantine is kept by the process releasing addresses, others would see them as used
+            raise InputValidationException('reuse_delay is not supported with more than one worker')
+        if self.size <= BITMAP_MAX_SIZE:
+            self.origin, self.window = 0, self.size
+        else:
+            self.last = min(self.last, self.first + BITMAP_MAX_SIZE)
+            self.origin, self.window = self.first, self.last - self.first
+            if self.spans is not None:
+                self.spans = self.spans.intersection(self.first, self.last)
+
+    @property
+    def used(self) -> int:
+        return self.counters[0]
+
+    @used.setter
+    def used(self, value: int):
+        self.counters[0] = value
+
+    @property
+    def current(self) -> int:
+        return self.first + self.counters[1]
+
+    @current.setter
+    def current(self, value: int):
+        self.counters[1] = value - self.first
+
+    @property
+    def references(self) -> SharedReferences:
+        return self.reference_table
+
+    @references.setter
+    def references(self, value):
+        # Pool only ever resets references, the table is changed in place otherwise
+        if value is not None and self.reference_table is None:
+            raise InputValidationException('Pool {} is not shared yet'.format(self))
+        if self.reference_table is not None:
+            self.reference_table.clear()
+
+    @property
+    def region_size(self) -> int:
+        return REGION_HEADER_SIZE + REFERENCES_SIZE + BitmapAllocator.buffer_size(self.window)
+
+    def attach(self, shared: 'SharedState', slot: int, serial: int, offset: int, create: bool):
+        region = shared.view[offset:offset + self.region_size]
+        counters = region[8:REGION_HEADER_SIZE].cast('Q')
+        if create:
+            counters[0], counters[1] = self.counters
+        self.reference_table = SharedReferences(region[REGION_HEADER_SIZE:REGION_HEADER_SIZE + REFERENCES_SIZE])
+        inner = SharedBitmapAllocator(self.window, region[:8], region[REGION_HEADER_SIZE + REFERENCES_SIZE:], create)
+        self.allocator = inner if self.window == self.size else WindowAllocator(self.size, self.origin, inner)
+        self.counters = counters
+        self.shared, self.slot, self.serial = shared, slot, serial
+        self.lock = PoolLock(self, shared.fd, shared.slot_offset(slot))
+
+    def valid(self) -> bool:
+        """Whether the pool is still present in shared state"""
+        return self.shared is None or self.shared.serial(self.slot) == self.serial
+
+
+class SharedState:
+    """
+    Pool table and allocation bitmaps in a memory-mapped file shared by worker processes.
+
+    The file starts with a header and a table of fixed-size slots, one for every pool,
+    followed by regions holding allocation bitmaps. Slots and regions are changed with
+    the table lock held, bitmaps with the lock of the pool slot held. Every process
+    keeps its own Space and SharedPool objects, brought up to date by sync whenever
+    the generation in the header changes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR)
+        self.size = os.fstat(self.fd).st_size
+        self.map = mmap.mmap(self.fd, self.size)
+        self.view = memoryview(self.map)
+        # Serials of slots, for validity checks without unpacking whole slots
+        self.table = self.view[HEADER_SIZE:TABLE_END].cast('Q')
+        magic, _, _, _ = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError('{} is not a shared state file'.format(path))
+        self.counters = self.view[8:HEADER.size].cast('Q')
+        self.lock = ProcessLock(self.fd, 0)
+        # Generation of the table seen by the last sync
+        self.generation = None
+
+    @staticmethod
+    def create(path: str, size: int = DEFAULT_SIZE):
+        """Creates empty state file, must be done before worker processes attach to it"""
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.ftruncate(fd, max(size, TABLE_END))
+            os.pwrite(fd, HEADER.pack(MAGIC, 0, 0, TABLE_END), 0)
+        finally:
+            os.close(fd)
+
+    def slot_offset(self, slot: int) -> int:
+        return HEADER_SIZE + slot * SLOT_SIZE
+
+    def serial(self, slot: int) -> int:
+        return self.table[slot * (SLOT_SIZE // 8)]
+
+    def changed(self) -> bool:
+        return self.counters[0] != self.generation
+
+    def entries(self):
+        """Yields slot, serial, region offset and spec of all pools"""
+        for slot in range(MAX_POOLS):
+            serial, offset, size, length = SLOT.unpack_from(self.map, self.slot_offset(slot))
+            if serial:
+                position = self.slot_offset(slot) + SLOT.size
+                yield slot, serial, offset, json.loads(bytes(self.map[position:position + length]))
+
+    def publish(self, space: Space, pool: SharedPool):
+        """Adds pool to the table and attaches it. Caller must hold the table lock."""
+        spec = json.dumps({
+            'space': space.name,
+            'pool': str(pool),
+            'subpool': str(pool.subpool),
+            'options': pool.options,
+        }, separators=(',', ':')).encode()
+        if len(spec) > SLOT_SIZE - SLOT.size:
+            raise InputValidationException('Pool options are too long to be shared')
+        needed = (pool.region_size + 7) & ~7
+
+        # Free slot with large enough region is preferred, its region is reused
+        chosen = None
+        for slot in range(MAX_POOLS):
+            serial, offset, size, _ = SLOT.unpack_from(self.map, self.slot_offset(slot))
+            if serial:
+                continue
+            if size >= needed:
+                chosen = slot, offset, size
+                break
+            if chosen is None:
+                chosen = slot, None, 0
+        if chosen is None:
+            raise InputValidationException('Too many pools, at most {} can be shared'.format(MAX_POOLS))
+        slot, offset, size = chosen
+
+        generation, serial, end = self.counters
+        if offset is None:
+            if end + needed > self.size:
+                raise InputValidationException('Not enough space left in shared state file')
+            offset, size = end, needed
+            end += needed
+        else:
+            self.map[offset:offset + needed] = bytes(needed)
+
+        serial += 1
+        position = self.slot_offset(slot)
+        self.map[position + SLOT.size:position + SLOT.size + len(spec)] = spec
+        SLOT.pack_into(self.map, position, serial, offset, size, len(spec))
+        pool.attach(self, slot, serial, offset, True)
+        self._bump(generation, serial, end)
+
+    def withdraw(self, pool: SharedPool):
+        """Removes pool from the table. Caller must hold the table lock."""
+        if pool.shared is not self or not pool.valid():
+            return
+        self.table[pool.slot * (SLOT_SIZE // 8)] = 0
+        generation, serial, end = self.counters
+        self._bump(generation, serial, end)
+
+    def _bump(self, generation: int, serial: int, end: int):
+        # Local state already includes the change if it was synced before it
+        if self.generation == generation:
+            self.generation = generation + 1
+        self.counters[0], self.counters[1], self.counters[2] = generation + 1, serial, end
+
+    def sync(self, spaces: dict):
+        """
+        Updates pools of given spaces to match the table.
+        Caller must hold the table lock. Returns lists of (space, pool) added and removed.
+        """
+        added, removed = [], []
+        generation = self.counters[0]
+        if generation == self.generation:
+            return added, removed
+
+        entries = {serial: (slot, offset, spec) for slot, serial, offset, spec in self.entries()}
+        known = set()
+        for space in list(spaces.values()):
+            for pool in list(space.pools.values()) + list(space.pools6.values()):
+                if not isinstance(pool, SharedPool) or pool.shared is not self:
+                    continue
+                if pool.serial in entries:
+                    known.add(pool.serial)
+                else:
+                    space.remove_pool(pool)
+                    removed.append((space, pool))
+
+        for serial, (slot, offset, spec) in sorted(entries.items()):
+            if serial in known:
+                continue
+            space = spaces.get(spec['space'])
+            if space is None:
+                space = spaces[spec['space']] = Space(spec['space'])
+                space.lock = self.lock
+            pool = SharedPool(pool=spec['pool'], subPool=spec['subpool'], options=spec['options'])
+            pool.attach(self, slot, serial, offset, False)
+            space.add_pool(pool)
+            added.append((space, pool))
+        self.generation = generation
+        return added, removed
+
+
+__all__ = ['DEFAULT_SIZE', 'MAX_POOLS', 'MAX_REFERENCES', 'ProcessLock', 'SharedBitmapAllocator', 'WindowAllocator',
+           'SharedReferences', 'SharedPool', 'SharedState']
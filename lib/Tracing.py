@@ -0,0 +1,84 @@
+import collections
+import json
+import threading
+import time
+
+from docker_plugin_api.Plugin import InputValidationException
+
+# Number of most recent requests kept by default
+TRACE_SIZE = 4096
+
+
+class Tracer:
+    """
+    Fixed-size ring buffer of recent requests of instrumented handlers, with pool ID,
+    address, outcome and time spent looking the pool up versus changing it.
+    Handlers mark the end of the lookup, everything after it counts as allocation.
+    Request and response are only referenced when recorded and decoded when dumped,
+    appending to a bounded deque is atomic, so no lock is taken on the request path.
+    """
+
+    def __init__(self, size: int = TRACE_SIZE):
+        self.events = collections.deque(maxlen=size)
+        self.local = threading.local()
+        self.enabled = False
+        # Converts perf_counter values to wall clock time
+        self.epoch = time.time() - time.perf_counter()
+
+    def resize(self, size: int):
+        self.events = collections.deque(self.events, maxlen=size)
+
+    def mark(self):
+        """Marks the end of the pool lookup of the request handled by this thread"""
+        if self.enabled:
+            self.local.looked_up = time.perf_counter()
+
+    def wrap(self, endpoint: str, handler):
+        local = self.local
+        perf_counter = time.perf_counter
+
+        def traced(data: dict) -> dict:
+            local.looked_up = None
+            start = perf_counter()
+            try:
+                response = handler(data)
+            except Exception as e:
+                # Exception itself is not kept, as it would keep frames of the handler alive
+                self.events.append((start, endpoint, data, None, self._outcome(e), local.looked_up, perf_counter()))
+                raise
+            self.events.append((start, endpoint, data, response, 'ok', local.looked_up, perf_counter()))
+            return response
+        return traced
+
+    def instrument(self, handlers: dict):
+        """Replaces handlers in place with traced ones"""
+        self.enabled = True
+        for path, handler in list(handlers.items()):
+            handlers[path] = self.wrap(path.rsplit('.', 1)[-1], handler)
+
+    @staticmethod
+    def _outcome(error: Exception) -> str:
+        if isinstance(error, InputValidationException):
+            return 'error: {}'.format(error)
+        return 'exception: {}'.format(type(error).__name__)
+
+    def dump(self):
+        """Yields recorded events as JSON lines, oldest first"""
+        # Copying the deque is atomic, requests keep being recorded meanwhile
+        for start, endpoint, data, response, outcome, looked_up, end in list(self.events):
+            if not isinstance(response, dict):
+                response = {}
+            if looked_up is None:
+                looked_up = start
+            yield json.dumps({
+                'time': self.epoch + start,
+                'endpoint': endpoint,
+                'pool': response.get('PoolID') or data.get('PoolID') or data.get('Pool'),
+                'address': response.get('Address') or data.get('Address'),
+                'outcome': outcome,
+                'lookup_us': round((looked_up - start) * 1e6, 1),
+                'allocation_us': round((end - looked_up) * 1e6, 1),
+            }) + '\n'
+
+
+__all__ = ['TRACE_SIZE', 'Tracer']
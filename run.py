@@ -1,13 +1,33 @@
 #!/usr/bin/env python3
 
-import logging
 import os
+import socket
+
+SOCKET = os.environ.get('SOCKET', '/run/docker/plugins/pyipam.sock')
+METRICS_SOCKET = '/run/docker/plugins/pyipam-metrics.sock'
+
+
+def listen(path: str) -> socket.socket:
+	if os.path.exists(path):
+		os.unlink(path)
+	listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	listener.bind(path)
+	listener.listen(1024)
+	return listener
+
+
+production = __name__ == '__main__' and os.environ.get('ENVIRONMENT', 'dev') != 'dev'
+if production:
+	# Docker Engine waits for the socket to appear, so create it before importing
+	# anything else - connections wait in the backlog until the server is started
+	listener = listen(SOCKET)
+
+import logging
 import signal
 import sys
 
 import docker_plugin_api.Plugin
 import flask
-import waitress
 
 app = flask.Flask('pyIPAM')
 app.logger.setLevel(logging.DEBUG)
@@ -18,9 +38,101 @@ import lib.IpamDriver
 docker_plugin_api.Plugin.functions.append('IpamDriver')
 app.register_blueprint(lib.IpamDriver.app)
 
+import lib.IpamExtension
+app.register_blueprint(lib.IpamExtension.app)
+
+import lib.IpamDebug
+app.register_blueprint(lib.IpamDebug.app)
+
+import lib.IpamDriverData
+lib.IpamDriverData.replay_window = float(os.environ.get('PERSISTENCE_REPLAY_WINDOW', '300'))
+
+if os.environ.get('PERSISTENCE', '0') == '1':
+	lib.IpamDriverData.enable_persistence(
+		os.path.join(os.environ.get('HOME', '.'), 'state'),
+		int(os.environ.get('PERSISTENCE_SNAPSHOT_INTERVAL', '1000')),
+		os.environ.get('PERSISTENCE_FSYNC', '1') == '1',
+		lib.IpamDriverData.replay_window,
+	)
+
+if os.environ.get('TRACING', '1') == '1':
+	import lib.IpamDriverData
+	import lib.Tracing
+	tracer = lib.IpamDriverData.tracer
+	tracer.resize(int(os.environ.get('TRACE_SIZE', lib.Tracing.TRACE_SIZE)))
+	tracer.instrument(lib.IpamDriver.handlers)
+	tracer.instrument(lib.IpamExtension.handlers)
+	# Recent requests are written to stderr (Docker Engine log) on demand
+	signal.signal(signal.SIGUSR1, lambda signum, frame: sys.stderr.writelines(tracer.dump()))
+
+if os.environ.get('METRICS', '0') == '1':
+	import lib.IpamDriverData
+	import lib.Metrics
+	metrics = lib.Metrics.Metrics(lib.IpamDriverData.spaces, lib.IpamDriverData.replay)
+	metrics.instrument(lib.IpamDriver.handlers)
+	metrics.instrument(lib.IpamExtension.handlers)
+	lib.Metrics.serve(metrics, os.environ.get('METRICS_SOCKET', METRICS_SOCKET))
+
+
+def serve():
+	# Servers are imported only when used
+	if os.environ.get('SERVER', 'waitress') == 'asyncio':
+		import lib.AsyncServer
+		handlers = {'/Plugin.Activate': lambda data: docker_plugin_api.Plugin.Activate()}
+		handlers.update(lib.IpamDriver.handlers)
+		handlers.update(lib.IpamExtension.handlers)
+		handlers.update(lib.IpamDebug.handlers)
+		lib.AsyncServer.serve(handlers, sock=listener)
+	else:
+		import waitress
+		waitress.serve(app, sockets=[listener], threads=int(os.environ.get('THREADS', '4')))
+
+
+def serve_workers(count: int):
+	# Workers accept connections from the same listener and share
+	# allocations through a memory-mapped file
+	import lib.IpamDriverData
+	import lib.SharedState
+	path = os.path.join(os.environ.get('HOME', '.'), 'shared.state')
+	lib.SharedState.SharedState.create(path, int(os.environ.get('WORKERS_STATE_SIZE', lib.SharedState.DEFAULT_SIZE)))
+	children = []
+	for _ in range(count):
+		pid = os.fork()
+		if pid == 0:
+			signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+			lib.IpamDriverData.enable_shared_state(path)
+			serve()
+			os._exit(0)
+		children.append(pid)
+
+	def stop(signum, frame):
+		for child in children:
+			try:
+				os.kill(child, signal.SIGTERM)
+			except ProcessLookupError:
+				pass
+		sys.exit(0)
+
+	def forward(signum, frame):
+		for child in children:
+			os.kill(child, signum)
+
+	signal.signal(signal.SIGTERM, stop)
+	signal.signal(signal.SIGUSR1, forward)
+	# Plugin is restarted as a whole if any of the workers dies
+	os.wait()
+	stop(None, None)
+
+
 if __name__ == '__main__':
-	if os.environ.get('ENVIRONMENT', 'dev') == 'dev':
+	if not production:
 		app.run(debug=True)
 	else:
-		signal.signal(signal.SIGTERM, lambda: sys.exit(0))
-		waitress.serve(app, unix_socket='/run/docker/plugins/pyipam.sock', threads=1)
+		workers = int(os.environ.get('WORKERS', '1'))
+		if workers > 1:
+			if os.environ.get('PERSISTENCE', '0') == '1' or os.environ.get('METRICS', '0') == '1':
+				sys.exit('PERSISTENCE and METRICS are not supported with WORKERS > 1')
+			serve_workers(workers)
+		else:
+			signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+			serve()
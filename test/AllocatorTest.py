@@ -0,0 +1,169 @@
+import random
+import unittest
+
+from lib.Allocator import *
+from docker_plugin_api.Plugin import InputValidationException
+
+
+class AllocatorTestMixin:
+    allocator = None
+
+    def test_empty(self):
+        allocator = self.allocator(0)
+        self.assertIsNone(allocator.find_free(0, 10))
+        self.assertEqual(list(allocator.ranges()), [])
+
+    def test_allocate_release(self):
+        allocator = self.allocator(100)
+        self.assertFalse(allocator.is_allocated(5))
+        self.assertTrue(allocator.allocate(5))
+        self.assertFalse(allocator.allocate(5))
+        self.assertTrue(allocator.is_allocated(5))
+        self.assertEqual(len(allocator), 1)
+        self.assertTrue(allocator.release(5))
+        self.assertFalse(allocator.release(5))
+        self.assertFalse(allocator.is_allocated(5))
+        self.assertEqual(len(allocator), 0)
+
+    def test_find_free(self):
+        allocator = self.allocator(200)
+        for offset in range(0, 150):
+            allocator.allocate(offset)
+        self.assertEqual(allocator.find_free(0, 200), 150)
+        self.assertEqual(allocator.find_free(160, 200), 160)
+        self.assertIsNone(allocator.find_free(0, 150))
+        allocator.release(70)
+        self.assertEqual(allocator.find_free(0, 150), 70)
+        self.assertEqual(allocator.find_free(71, 200), 150)
+        for offset in range(150, 200):
+            allocator.allocate(offset)
+        self.assertIsNone(allocator.find_free(71, 200))
+
+    def test_ranges(self):
+        allocator = self.allocator(130)
+        for offset in [0, 1, 2, 63, 64, 65, 127, 128, 129]:
+            allocator.allocate(offset)
+        self.assertEqual(list(allocator.ranges()), [(0, 3), (63, 66), (127, 130)])
+        self.assertEqual(list(allocator), [0, 1, 2, 63, 64, 65, 127, 128, 129])
+
+    def test_random(self):
+        rng = random.Random(1)
+        size = 5000
+        allocator = self.allocator(size)
+        reference = set()
+        for _ in range(20000):
+            offset = rng.randrange(size)
+            if rng.random() < 0.6:
+                self.assertEqual(allocator.allocate(offset), offset not in reference)
+                reference.add(offset)
+            else:
+                self.assertEqual(allocator.release(offset), offset in reference)
+                reference.discard(offset)
+            start = rng.randrange(size)
+            expected = next((o for o in range(start, size) if o not in reference), None)
+            self.assertEqual(allocator.find_free(start, size), expected)
+        self.assertEqual(len(allocator), len(reference))
+        self.assertEqual(list(allocator), sorted(reference))
+
+
+class BitmapAllocatorTest(AllocatorTestMixin, unittest.TestCase):
+    allocator = BitmapAllocator
+
+    def test_full(self):
+        allocator = self.allocator(64 * 64 + 1)
+        for offset in range(allocator.size):
+            allocator.allocate(offset)
+        self.assertIsNone(allocator.find_free(0, allocator.size))
+        allocator.release(64 * 64)
+        self.assertEqual(allocator.find_free(0, allocator.size), 64 * 64)
+        allocator.release(100)
+        self.assertEqual(allocator.find_free(0, allocator.size), 100)
+
+
+class IntervalAllocatorTest(AllocatorTestMixin, unittest.TestCase):
+    allocator = IntervalAllocator
+
+    def test_huge(self):
+        allocator = self.allocator(1 << 64)
+        allocator.allocate(0)
+        allocator.allocate((1 << 64) - 1)
+        self.assertEqual(allocator.find_free(0, 1 << 64), 1)
+        self.assertEqual(allocator.find_free((1 << 64) - 1, 1 << 64), None)
+        self.assertEqual(list(allocator.ranges()), [(0, 1), ((1 << 64) - 1, 1 << 64)])
+
+
+class CreateAllocatorTest(unittest.TestCase):
+    def test_default(self):
+        self.assertIsInstance(create_allocator(256), BitmapAllocator)
+        self.assertIsInstance(create_allocator(1 << 12), BitmapAllocator)
+        # Larger pools do not pay for a bitmap, unless allocations are scattered over it
+        self.assertIsInstance(create_allocator(1 << 16), IntervalAllocator)
+        self.assertIsInstance(create_allocator(1 << 16, scattered=True), BitmapAllocator)
+        self.assertIsInstance(create_allocator(1 << 64, scattered=True), IntervalAllocator)
+        self.assertIsInstance(create_allocator(1 << 64), IntervalAllocator)
+
+    def test_explicit(self):
+        self.assertIsInstance(create_allocator(256, 'interval'), IntervalAllocator)
+
+    def test_unknown(self):
+        with self.assertRaises(InputValidationException):
+            create_allocator(256, 'unknown')
+
+    def test_bitmap_too_large(self):
+        self.assertIsInstance(create_allocator(BITMAP_MAX_SIZE, 'bitmap'), BitmapAllocator)
+        for size in (BITMAP_MAX_SIZE + 1, 1 << 32, 1 << 64):
+            with self.subTest(size=size), self.assertRaises(InputValidationException):
+                create_allocator(size, 'bitmap')
+
+
+class IntervalAllocatorRangeTest(unittest.TestCase):
+    def test_allocate_range(self):
+        allocator = IntervalAllocator(100)
+        allocator.allocate(15)
+        self.assertEqual(allocator.allocate_range(10, 20), 9)
+        self.assertEqual(allocator.allocate_range(30, 40), 10)
+        self.assertEqual(allocator.allocate_range(15, 35), 10)
+        self.assertEqual(list(allocator.ranges()), [(10, 40)])
+        self.assertEqual(allocator.allocate_range(90, 200), 10)
+        self.assertEqual(len(allocator), 40)
+
+    def test_release_range(self):
+        allocator = IntervalAllocator(100)
+        allocator.allocate_range(0, 100)
+        self.assertEqual(allocator.release_range(10, 20), 10)
+        self.assertEqual(allocator.release_range(30, 40), 10)
+        self.assertEqual(allocator.release_range(15, 35), 10)
+        self.assertEqual(list(allocator.ranges()), [(0, 10), (40, 100)])
+        self.assertEqual(allocator.release_range(40, 41), 1)
+        self.assertEqual(list(allocator.ranges()), [(0, 10), (41, 100)])
+        self.assertEqual(len(allocator), 69)
+
+    def test_generic_range(self):
+        allocator = BitmapAllocator(100)
+        self.assertEqual(allocator.allocate_range(10, 20), 10)
+        self.assertEqual(allocator.release_range(15, 25), 5)
+        self.assertEqual(list(allocator.ranges()), [(10, 15)])
+
+
+class BitmapAllocatorRangeTest(unittest.TestCase):
+    def test_random_ranges(self):
+        rng = random.Random(3)
+        size = 64 * 64 * 3 + 17
+        allocator = BitmapAllocator(size)
+        reference = set()
+        for _ in range(300):
+            start = rng.randrange(size)
+            end = min(size, start + rng.randrange(1, 1000))
+            if rng.random() < 0.5:
+                self.assertEqual(allocator.allocate_range(start, end), len(set(range(start, end)) - reference))
+                reference.update(range(start, end))
+            else:
+                self.assertEqual(allocator.release_range(start, end), len(set(range(start, end)) & reference))
+                reference.difference_update(range(start, end))
+            point = rng.randrange(size)
+            expected = next((o for o in range(point, size) if o not in reference), None)
+            self.assertEqual(allocator.find_free(point, size), expected)
+        self.assertEqual(len(allocator), len(reference))
+        self.assertEqual(list(allocator), sorted(reference))
+        allocator.allocate_range(0, size)
+        self.assertIsNone(allocator.find_free(0, size))
@@ -0,0 +1,177 @@
+import asyncio
+import http.client
+import json
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+import lib.AsyncServer
+from lib.AsyncServer import *
+from lib.IpamDriver import handlers
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str):
+        super().__init__('localhost')
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+class DispatchTest(unittest.TestCase):
+    def test_unknown(self):
+        status, response = dispatch(handlers, '/IpamDriver.Unknown', b'{}')
+        self.assertEqual(status, 404)
+
+    def test_invalid_json(self):
+        status, response = dispatch(handlers, '/IpamDriver.RequestPool', b'{')
+        self.assertEqual(status, 400)
+
+    def test_validation_error(self):
+        status, response = dispatch(handlers, '/IpamDriver.RequestPool', b'{"AddressSpace": "local"}')
+        self.assertEqual(status, 200)
+        self.assertIn('Err', response)
+
+    def test_capabilities(self):
+        status, response = dispatch(handlers, '/IpamDriver.GetCapabilities', b'')
+        self.assertEqual(status, 200)
+        self.assertTrue(response['RequiresRequestReplay'])
+
+
+class AsyncServerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'test.sock')
+        self.loop = asyncio.new_event_loop()
+        timeout = lib.AsyncServer.READ_TIMEOUT
+        lib.AsyncServer.READ_TIMEOUT = 0.2
+        self.addCleanup(setattr, lib.AsyncServer, 'READ_TIMEOUT', timeout)
+        started = threading.Event()
+
+        async def start():
+            self.server = await asyncio.start_unix_server(
+                lambda reader, writer: handle_connection(handlers, reader, writer), path=self.path,
+            )
+            started.set()
+
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(start(), self.loop)
+        started.wait(5)
+        self.addCleanup(self.stop)
+
+    def stop(self):
+        async def close():
+            self.server.close()
+            await self.server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(close(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def call(self, connection: http.client.HTTPConnection, path: str, data: dict, **headers):
+        connection.request('POST', path, json.dumps(data), headers)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+
+    def test_keep_alive(self):
+        connection = UnixHTTPConnection(self.path)
+        self.addCleanup(connection.close)
+        status, pool = self.call(connection, '/IpamDriver.RequestPool', {
+            'AddressSpace': 'local', 'Pool': '10.250.0.0/24',
+        })
+        self.assertEqual(status, 200)
+        self.assertEqual(pool['Pool'], '10.250.0.0/24')
+        status, address = self.call(connection, '/IpamDriver.RequestAddress', {'PoolID': pool['PoolID']})
+        self.assertEqual(address['Address'], '10.250.0.1/24')
+        status, response = self.call(connection, '/IpamDriver.RequestAddress', {
+            'PoolID': pool['PoolID'], 'Address': '10.250.0.1',
+        })
+        self.assertIn('Err', response)
+        self.assertEqual(self.call(connection, '/IpamDriver.ReleaseAddress', {
+            'PoolID': pool['PoolID'], 'Address': '10.250.0.1',
+        }), (200, {}))
+        self.assertEqual(self.call(connection, '/IpamDriver.ReleasePool', {'PoolID': pool['PoolID']}), (200, {}))
+
+    def test_chunked(self):
+        connection = UnixHTTPConnection(self.path)
+        self.addCleanup(connection.close)
+        body = json.dumps({'AddressSpace': 'local', 'Pool': '10.251.0.0/24'}).encode()
+        connection.request('POST', '/IpamDriver.RequestPool', iter([body[:10], body[10:]]),
+                           {'Transfer-Encoding': 'chunked'}, encode_chunked=True)
+        response = connection.getresponse()
+        self.assertEqual(json.loads(response.read())['Pool'], '10.251.0.0/24')
+        self.call(connection, '/IpamDriver.ReleasePool', {'PoolID': 'local-10.251.0.0/24'})
+
+    def test_streamed(self):
+        handlers['/Test.Stream'] = lambda data: iter(['{"Items": [', '', '1, 2', ']}'])
+        self.addCleanup(handlers.pop, '/Test.Stream')
+        connection = UnixHTTPConnection(self.path)
+        self.addCleanup(connection.close)
+        self.assertEqual(self.call(connection, '/Test.Stream', {}), (200, {'Items': [1, 2]}))
+        # Connection is kept alive after the last chunk
+        self.assertEqual(self.call(connection, '/Test.Stream', {}), (200, {'Items': [1, 2]}))
+
+    def test_method_not_allowed(self):
+        connection = UnixHTTPConnection(self.path)
+        self.addCleanup(connection.close)
+        connection.request('GET', '/IpamDriver.GetCapabilities')
+        response = connection.getresponse()
+        self.assertEqual(response.status, 405)
+        response.read()
+
+    def test_truncated_request(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(sock.close)
+        sock.settimeout(5)
+        sock.connect(self.path)
+        sock.sendall(b'POST /IpamDriver.GetCapabilities HTTP/1.1\r\nContent-Length: 10\r\n\r\n{')
+        # Server gives up waiting for the rest of the body and closes the connection
+        self.assertEqual(sock.recv(1024), b'')
+
+    def test_not_found(self):
+        connection = UnixHTTPConnection(self.path)
+        self.addCleanup(connection.close)
+        status, response = self.call(connection, '/Unknown', {}, Connection='close')
+        self.assertEqual(status, 404)
+
+
+class ServeTest(unittest.TestCase):
+    def test_listening_socket(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'test.sock')
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen()
+        # Connection made before the server is started waits in the backlog
+        connection = UnixHTTPConnection(path)
+        self.addCleanup(connection.close)
+        connection.connect()
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        task = loop.create_task(lib.AsyncServer._serve(handlers, sock=listener))
+
+        def run():
+            try:
+                loop.run_until_complete(task)
+            except asyncio.CancelledError:
+                pass
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        try:
+            connection.request('POST', '/IpamDriver.GetCapabilities', '{}', {'Connection': 'close'})
+            response = connection.getresponse()
+            self.assertEqual(response.status, 200)
+            self.assertTrue(json.loads(response.read())['RequiresMACAddress'])
+        finally:
+            loop.call_soon_threadsafe(task.cancel)
+            thread.join(5)
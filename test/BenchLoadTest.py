@@ -0,0 +1,100 @@
+import unittest
+
+from bench.load import *
+
+
+class ScriptedLoad(Load):
+    """Answers requests with handlers given per endpoint instead of sending them"""
+
+    def __init__(self, entries: list, responses: dict, concurrency: int = 1):
+        super().__init__(None, entries, concurrency)
+        self.responses = responses
+        self.sent = []
+
+    def call(self, connection, endpoint: str, data: dict) -> dict:
+        self.sent.append((endpoint, data))
+        return self.responses[endpoint](data)
+
+    def replay(self):
+        for entries in self.workers:
+            for entry in entries:
+                self.step(None, entry)
+
+
+class LoadTest(unittest.TestCase):
+    def test_synthetic(self):
+        entries = synthetic(2, 3)
+        self.assertEqual(len(entries), 2 * (3 * 2 + 2))
+        self.assertEqual([entry['endpoint'] for entry in entries[:8]],
+                         ['RequestPool'] + ['RequestAddress'] * 3 + ['ReleaseAddress'] * 3 + ['ReleasePool'])
+        self.assertEqual(entries[0]['data'], {'AddressSpace': 'local', 'Pool': '10.0.0.0/24'})
+        self.assertEqual({entry['data'].get('PoolID') for entry in entries[8:]}, {None, 'local-10.0.1.0/24'})
+
+    def test_partition(self):
+        workers = partition(synthetic(5, 2), 2)
+        # Whole sequence of every pool is sent by a single worker, in order
+        self.assertEqual([len(entries) for entries in workers], [3 * 6, 2 * 6])
+        self.assertEqual([entry['endpoint'] for entry in workers[1][:6]],
+                         ['RequestPool', 'RequestAddress', 'RequestAddress', 'ReleaseAddress', 'ReleaseAddress',
+                          'ReleasePool'])
+
+    def test_recorded_pool_id(self):
+        self.assertEqual(recorded_pool_id({'endpoint': 'RequestPool', 'data': {
+            'AddressSpace': 'local', 'Pool': '10.0.0.5/24'}}), 'local-10.0.0.0/24')
+        self.assertEqual(recorded_pool_id({'endpoint': 'RequestPool', 'data': {'AddressSpace': 'local', 'V6': False},
+                                           'response': {'PoolID': 'local-172.16.0.0/24'}}), 'local-172.16.0.0/24')
+        with self.assertRaises(ValueError):
+            recorded_pool_id({'endpoint': 'RequestPool', 'data': {'AddressSpace': 'local', 'V6': False}})
+
+    def test_recorded_auto_pool(self):
+        recorded = 'local-172.16.0.0/24'
+        entries = [
+            {'endpoint': 'RequestPool', 'data': {'AddressSpace': 'local', 'V6': False},
+             'response': {'PoolID': recorded}},
+            {'endpoint': 'RequestAddress', 'data': {'PoolID': recorded}},
+            {'endpoint': 'ReleaseAddress', 'data': {'PoolID': recorded}},
+            {'endpoint': 'ReleasePool', 'data': {'PoolID': recorded}},
+        ]
+        load = ScriptedLoad(entries, {
+            'RequestPool': lambda data: {'PoolID': 'local-172.20.0.0/24'},
+            'RequestAddress': lambda data: {'Address': '172.20.0.1/24'},
+            'ReleaseAddress': lambda data: {},
+            'ReleasePool': lambda data: {},
+        }, concurrency=2)
+        self.assertEqual([len(entries) for entries in load.workers], [4, 0])
+        load.replay()
+        # Requests refer to the pool returned by the plugin, not the recorded one
+        self.assertEqual([data.get('PoolID') for _, data in load.sent[1:]], ['local-172.20.0.0/24'] * 3)
+        self.assertEqual(load.sent[2][1]['Address'], '172.20.0.1')
+
+    def test_duplicates(self):
+        entries = synthetic(1, 3)
+        # Plugin hands out the same address twice while it is still held
+        addresses = iter(['10.0.0.1/24', '10.0.0.2/24', '10.0.0.1/24'])
+        load = ScriptedLoad(entries, {
+            'RequestPool': lambda data: {'PoolID': 'local-10.0.0.0/24'},
+            'RequestAddress': lambda data: {'Address': next(addresses)},
+            'ReleaseAddress': lambda data: {},
+            'ReleasePool': lambda data: {},
+        })
+        load.replay()
+        self.assertEqual(load.duplicates, [('local-10.0.0.0/24', '10.0.0.1')])
+        # Both holders release the address
+        released = [data['Address'] for endpoint, data in load.sent if endpoint == 'ReleaseAddress']
+        self.assertEqual(sorted(released), ['10.0.0.1', '10.0.0.1', '10.0.0.2'])
+
+    def test_shared_addresses(self):
+        entries = [
+            {'endpoint': 'RequestPool', 'data': {'AddressSpace': 'local', 'Pool': '10.0.0.0/24',
+                                                 'Options': {'validate': '0'}}},
+            {'endpoint': 'RequestAddress', 'data': {'PoolID': 'local-10.0.0.0/24', 'Address': '10.0.0.5'}},
+            {'endpoint': 'RequestAddress', 'data': {'PoolID': 'local-10.0.0.0/24', 'Address': '10.0.0.5'}},
+            {'endpoint': 'RequestAddress', 'data': {'PoolID': 'local-10.0.0.0/24'}},
+        ]
+        load = ScriptedLoad(entries, {
+            'RequestPool': lambda data: {'PoolID': 'local-10.0.0.0/24'},
+            'RequestAddress': lambda data: {'Address': '10.0.0.5/24'},
+        })
+        load.replay()
+        # Explicit duplicates are allowed with validate=0, automatic ones are not
+        self.assertEqual(load.duplicates, [('local-10.0.0.0/24', '10.0.0.5')])
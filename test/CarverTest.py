@@ -0,0 +1,57 @@
+import ipaddress
+import unittest
+
+from lib.Carver import *
+from docker_plugin_api.Plugin import InputValidationException
+
+
+class CarveOptionsTest(unittest.TestCase):
+    def test_defaults(self):
+        self.assertEqual(carve_options(False), (ipaddress.ip_network('172.16.0.0/12'), 24))
+        self.assertEqual(carve_options(True), (ipaddress.ip_network('fd00::/8'), 64))
+
+    def test_options(self):
+        options = {'supernet': '10.0.0.0/8', 'prefixlen': '16', 'supernet6': 'fd12::/16', 'prefixlen6': '56'}
+        self.assertEqual(carve_options(False, options), (ipaddress.ip_network('10.0.0.0/8'), 16))
+        self.assertEqual(carve_options(True, options), (ipaddress.ip_network('fd12::/16'), 56))
+
+    def test_invalid(self):
+        with self.assertRaises(InputValidationException):
+            carve_options(False, {'supernet': 'fd00::/8'})
+        with self.assertRaises(InputValidationException):
+            carve_options(False, {'prefixlen': '8'})
+        with self.assertRaises(InputValidationException):
+            carve_options(False, {'prefixlen': 'x'})
+
+
+class SubnetCarverTest(unittest.TestCase):
+    def test_carve_all(self):
+        carver = SubnetCarver(ipaddress.ip_network('10.0.0.0/22'), 24)
+        carved = set()
+        for _ in range(4):
+            network = carver.carve()
+            self.assertNotIn(network, carved)
+            carver.mark(network)
+            carved.add(network)
+        self.assertEqual(carved, set(ipaddress.ip_network('10.0.0.0/22').subnets(new_prefix=24)))
+        with self.assertRaises(InputValidationException):
+            carver.carve()
+
+    def test_mark_unmark(self):
+        carver = SubnetCarver(ipaddress.ip_network('10.0.0.0/22'), 24)
+        carver.mark(ipaddress.ip_network('10.0.0.0/23'))
+        carver.mark(ipaddress.ip_network('10.0.2.0/25'))
+        carver.mark(ipaddress.ip_network('10.0.2.128/25'))
+        carver.mark(ipaddress.ip_network('192.168.0.0/24'))
+        self.assertEqual(carver.carve(), ipaddress.ip_network('10.0.3.0/24'))
+        carver.unmark(ipaddress.ip_network('10.0.2.0/25'), lambda block: True)
+        carver.mark(ipaddress.ip_network('10.0.3.0/24'))
+        with self.assertRaises(InputValidationException):
+            carver.carve()
+        carver.unmark(ipaddress.ip_network('10.0.0.0/23'), lambda block: False)
+        self.assertIn(carver.carve(), list(ipaddress.ip_network('10.0.0.0/23').subnets(new_prefix=24)))
+
+    def test_huge(self):
+        carver = SubnetCarver(ipaddress.ip_network('fd00::/8'), 64)
+        carver.mark(ipaddress.ip_network('fd00::/9'))
+        self.assertTrue(carver.carve().subnet_of(ipaddress.ip_network('fd80::/9')))
@@ -0,0 +1,133 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+import lib.IpamDriverData
+from lib.Ipam import *
+from lib.IpamDriver import handlers
+from lib.Journal import *
+from docker_plugin_api.Plugin import InputValidationException
+from . import HandlerStateTestCase
+
+
+def run_threads(count: int, target):
+    barrier = threading.Barrier(count)
+    errors = []
+
+    def worker(index):
+        barrier.wait()
+        try:
+            target(index)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+class ConcurrencyTest(unittest.TestCase):
+    def setUp(self):
+        # Force frequent thread switches to expose races
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval, interval)
+
+    def test_allocate_unique(self):
+        pool = Pool(pool='10.0.0.0/20')
+        results = [[] for _ in range(16)]
+
+        def allocate(index):
+            for _ in range(255):
+                results[index].append(pool.allocate())
+
+        self.assertEqual(run_threads(16, allocate), [])
+        addresses = [address for result in results for address in result]
+        self.assertEqual(len(addresses), 16 * 255)
+        self.assertEqual(len(set(addresses)), len(addresses))
+        self.assertEqual(len(pool.allocator), len(addresses))
+
+    def test_allocate_release_exhaustion(self):
+        pool = Pool(pool='10.0.0.0/24')
+        results = [set() for _ in range(8)]
+
+        def allocate_release(index):
+            for i in range(500):
+                try:
+                    results[index].add(pool.allocate().split('/')[0])
+                except InputValidationException:
+                    pass
+                if i % 3 == 0 and results[index]:
+                    pool.deallocate(results[index].pop())
+
+        self.assertEqual(run_threads(8, allocate_release), [])
+        held = [address for result in results for address in result]
+        self.assertEqual(len(set(held)), len(held))
+        self.assertEqual(len(pool.allocator), len(held))
+
+    def test_add_pool_unique(self):
+        space = Space('test')
+        options = {'supernet': '10.0.0.0/16'}
+        results = [[] for _ in range(8)]
+
+        def add(index):
+            for _ in range(32):
+                with space.lock:
+                    pool = Pool(pool=space.carve_pool(False, options))
+                    results[index].append(space.add_pool(pool))
+
+        self.assertEqual(run_threads(8, add), [])
+        pools = [pool for result in results for pool in result]
+        self.assertEqual(len(set(pools)), 256)
+        self.assertEqual(len(space.pools), 256)
+
+
+class HandlerConcurrencyTest(HandlerStateTestCase):
+    def setUp(self):
+        super().setUp()
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval, interval)
+        # Changes are journaled, so that locking around journal entries is exercised as well
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'state')
+        journal = Journal(self.path, lib.IpamDriverData.spaces, snapshot_interval=100)
+        journal.open()
+        self.addCleanup(setattr, lib.IpamDriverData, 'journal', lib.IpamDriverData.journal)
+        lib.IpamDriverData.journal = journal
+        self.addCleanup(journal.close)
+
+    def test_request_address_unique(self):
+        request_pool = handlers['/IpamDriver.RequestPool']
+        request_address = handlers['/IpamDriver.RequestAddress']
+        release_address = handlers['/IpamDriver.ReleaseAddress']
+        results = [set() for _ in range(8)]
+
+        def allocate_release(index):
+            # Every thread requests the same pool, as replayed requests do
+            pool_id = request_pool({'AddressSpace': 'local', 'Pool': '10.0.0.0/21'})['PoolID']
+            for i in range(200):
+                results[index].add(request_address({'PoolID': pool_id})['Address'].split('/')[0])
+                if i % 4 == 0:
+                    release_address({'PoolID': pool_id, 'Address': results[index].pop()})
+
+        self.assertEqual(run_threads(8, allocate_release), [])
+        held = [address for result in results for address in result]
+        self.assertEqual(len(set(held)), len(held))
+        self.assertEqual(list(lib.IpamDriverData.pool_ids), ['local-10.0.0.0/21'])
+        pool = lib.IpamDriverData.spaces['local'].get_pool('10.0.0.0/21')
+        self.assertEqual(len(pool.allocator), len(held))
+
+        # Journal holds the same allocations, in order consistent with the changes
+        lib.IpamDriverData.journal.close()
+        spaces = {'local': Space('local')}
+        journal = Journal(self.path, spaces)
+        journal.open()
+        self.addCleanup(journal.close)
+        self.assertEqual(list(spaces['local'].get_pool('10.0.0.0/21').allocator), list(pool.allocator))
@@ -0,0 +1,71 @@
+import json
+
+import flask
+
+import lib.IpamDebug
+import lib.IpamDriverData
+from lib.IpamDebug import handlers
+from lib.IpamDriver import handlers as driver_handlers
+from docker_plugin_api.Plugin import InputValidationException
+from . import HandlerStateTestCase
+
+
+class IpamDebugTest(HandlerStateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.pool_id = driver_handlers['/IpamDriver.RequestPool']({
+            'AddressSpace': 'local', 'Pool': '10.0.0.0/16', 'SubPool': '10.0.1.0/24', 'Options': {'ptp': '0'},
+        })['PoolID']
+
+    def allocate(self, address: str):
+        driver_handlers['/IpamDriver.RequestAddress']({'PoolID': self.pool_id, 'Address': address})
+
+    def test_spaces(self):
+        self.allocate('10.0.1.5')
+        self.allocate('10.0.5.5')
+        pools = handlers['/IpamDebug.Spaces']({})['Spaces']['local']
+        self.assertEqual(pools, [{
+            'PoolID': 'local-10.0.0.0/16',
+            'Pool': '10.0.0.0/16',
+            'SubPool': '10.0.1.0/24',
+            'Options': {'ptp': '0'},
+            'Allocated': 2,
+            'Used': 1,
+            'Free': 253,
+            'Utilization': 1 / 254,
+            'Quarantined': 0,
+        }])
+
+    def test_allocations(self):
+        for address in ('10.0.1.1', '10.0.1.2', '10.0.1.3', '10.0.1.7', '10.0.200.1'):
+            self.allocate(address)
+        chunks = handlers['/IpamDebug.Allocations']({'PoolID': self.pool_id})
+        # Allocations done after the request are not included
+        self.allocate('10.0.1.4')
+        response = json.loads(''.join(chunks))
+        self.assertEqual(response['Allocated'], 5)
+        self.assertEqual(response['Allocations'], [
+            ['10.0.1.1', '10.0.1.3'], ['10.0.1.7', '10.0.1.7'], ['10.0.200.1', '10.0.200.1'],
+        ])
+
+    def test_chunks(self):
+        pool = lib.IpamDriverData.spaces['local'].get_pool('10.0.0.0/16')
+        # Every other address, so that none of them are merged into a range
+        for index in range(2 * lib.IpamDebug.RANGES_PER_CHUNK + 1):
+            pool.allocate(pool.address(2 * index + 2))
+        chunks = list(handlers['/IpamDebug.Allocations']({'PoolID': self.pool_id}))
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(len(json.loads(''.join(chunks))['Allocations']), 2 * lib.IpamDebug.RANGES_PER_CHUNK + 1)
+
+    def test_unknown_pool(self):
+        with self.assertRaises(InputValidationException):
+            handlers['/IpamDebug.Allocations']({'PoolID': 'local-10.1.0.0/16'})
+
+    def test_route(self):
+        app = flask.Flask(__name__)
+        app.register_blueprint(lib.IpamDebug.app)
+        self.allocate('10.0.1.1')
+        response = app.test_client().post('/IpamDebug.Allocations', data=json.dumps({'PoolID': self.pool_id}))
+        self.assertEqual(response.get_json()['Allocations'], [['10.0.1.1', '10.0.1.1']])
+        response = app.test_client().post('/IpamDebug.Allocations', data=json.dumps({'PoolID': 'local-10.9.0.0/16'}))
+        self.assertIn('Err', response.get_json())
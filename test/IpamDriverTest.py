@@ -0,0 +1,88 @@
+import lib.IpamDriverData
+from lib.IpamDriver import handlers
+from lib.IpamExtension import handlers as extension_handlers
+from docker_plugin_api.Plugin import InputValidationException
+from . import HandlerStateTestCase
+
+
+class IpamDriverTest(HandlerStateTestCase):
+    space_names = ('local', 'dashed-space')
+
+    def call(self, endpoint: str, **data) -> dict:
+        return handlers['/IpamDriver.' + endpoint](data)
+
+    def test_pool_lifecycle(self):
+        pool_id = self.call('RequestPool', AddressSpace='local', Pool='10.0.0.0/24')['PoolID']
+        self.assertEqual(pool_id, 'local-10.0.0.0/24')
+        self.assertEqual(self.call('RequestAddress', PoolID=pool_id)['Address'], '10.0.0.1/24')
+        self.call('ReleaseAddress', PoolID=pool_id, Address='10.0.0.1')
+        self.call('ReleasePool', PoolID=pool_id)
+        with self.assertRaises(InputValidationException):
+            self.call('RequestAddress', PoolID=pool_id)
+
+    def test_replayed_pool(self):
+        pool_id = self.call('RequestPool', AddressSpace='local', Pool='10.0.0.0/24')['PoolID']
+        self.call('RequestAddress', PoolID=pool_id)
+        self.assertEqual(self.call('RequestPool', AddressSpace='local', Pool='10.0.0.0/24')['PoolID'], pool_id)
+        # Replayed request maps to the pool already holding allocations
+        self.assertEqual(self.call('RequestAddress', PoolID=pool_id)['Address'], '10.0.0.2/24')
+        # Also when the network is written differently
+        self.assertEqual(self.call('RequestPool', AddressSpace='local', Pool='10.0.0.5/24')['PoolID'], pool_id)
+        self.assertEqual(self.call('RequestAddress', PoolID=pool_id)['Address'], '10.0.0.3/24')
+
+    def test_replayed_addresses(self):
+        pool_id = self.call('RequestPool', AddressSpace='local', Pool='10.0.0.0/24')['PoolID']
+        self.call('RequestAddress', PoolID=pool_id, Address='10.0.0.7')
+        with self.assertRaises(InputValidationException):
+            self.call('RequestAddress', PoolID=pool_id, Address='10.0.0.7')
+        # Replayed pool request lets Docker Engine re-assert addresses it holds, once each
+        self.call('RequestPool', AddressSpace='local', Pool='10.0.0.0/24')
+        self.assertEqual(self.call('RequestAddress', PoolID=pool_id, Address='10.0.0.7')['Address'], '10.0.0.7/24')
+        with self.assertRaises(InputValidationException):
+            self.call('RequestAddress', PoolID=pool_id, Address='10.0.0.7')
+        self.assertEqual(self.call('RequestAddress', PoolID=pool_id)['Address'], '10.0.0.1/24')
+
+    def test_replay_progress(self):
+        replay = lib.IpamDriverData.replay
+        pools, addresses = replay.pools, replay.addresses
+        pool_id = self.call('RequestPool', AddressSpace='local', Pool='10.0.0.0/24')['PoolID']
+        self.call('RequestAddress', PoolID=pool_id, Address='10.0.0.7')
+        pool = lib.IpamDriverData.spaces['local'].get_pool('10.0.0.0/24')
+        pool.restore(300)
+        self.assertEqual(replay.pending(), 1)
+        self.call('RequestPool', AddressSpace='local', Pool='10.0.0.0/24')
+        self.assertEqual(self.call('RequestAddress', PoolID=pool_id, Address='10.0.0.7')['Address'], '10.0.0.7/24')
+        self.assertEqual((replay.pools - pools, replay.addresses - addresses), (1, 1))
+        self.assertEqual(replay.pending(), 0)
+        self.assertGreater(replay.duration, 0)
+
+    def test_dashed_space(self):
+        pool_id = self.call('RequestPool', AddressSpace='dashed-space', Pool='fd00::/64')['PoolID']
+        self.assertEqual(pool_id, 'dashed-space-fd00::/64')
+        self.assertEqual(self.call('RequestAddress', PoolID=pool_id)['Address'], 'fd00::1/64')
+
+    def test_unknown(self):
+        for pool_id in ('local-10.0.0.0/24', 'unknown', ''):
+            with self.assertRaises(InputValidationException):
+                self.call('RequestAddress', PoolID=pool_id)
+
+    def test_malformed(self):
+        pool_id = self.call('RequestPool', AddressSpace='local', Pool='10.0.0.0/24')['PoolID']
+        with self.assertRaises(TypeError):
+            self.call('RequestAddress', Address='10.0.0.1')
+        with self.assertRaises(TypeError):
+            self.call('RequestAddress', PoolID=pool_id, Unknown=1)
+        with self.assertRaises(TypeError):
+            self.call('ReleaseAddress', PoolID=pool_id)
+        self.assertEqual(self.call('RequestAddress', PoolID=pool_id, Address=None, Options=None)['Address'],
+                         '10.0.0.1/24')
+
+    def test_extension(self):
+        pool_id = self.call('RequestPool', AddressSpace='local', Pool='10.0.0.0/29')['PoolID']
+        addresses = extension_handlers['/IpamExtension.RequestAddresses'](
+            {'PoolID': pool_id, 'Count': 2, 'Addresses': ['10.0.0.5']})['Addresses']
+        self.assertEqual(addresses, ['10.0.0.5/29', '10.0.0.1/29', '10.0.0.2/29'])
+        with self.assertRaises(InputValidationException):
+            extension_handlers['/IpamExtension.RequestAddresses']({'PoolID': pool_id, 'Count': 4})
+        extension_handlers['/IpamExtension.ReleaseAddresses']({'PoolID': pool_id, 'Addresses': ['10.0.0.1', '10.0.0.5']})
+        self.assertEqual(self.call('RequestAddress', PoolID=pool_id, Address='10.0.0.5')['Address'], '10.0.0.5/29')
@@ -1,6 +1,8 @@
+import collections
 import ipaddress
 import unittest
 
+from lib.Allocator import *
 from lib.Ipam import *
 from docker_plugin_api.Plugin import InputValidationException
 
@@ -326,3 +328,388 @@ class TestPoolWithoutValidation(unittest.TestCase):
         self.assertEqual(pool.allocate(), 'fe80::3/126')
         self.assertEqual(pool.allocate('fe80::1'), 'fe80::1/126')
         self.assertEqual(pool.allocate('fe80::1'), 'fe80::1/126')
+
+    def test_pool_release_duplicates(self):
+        pool = Pool(pool='127.0.0.0/24', options={'validate': '0'})
+        pool.allocate('127.0.0.5')
+        pool.allocate('127.0.0.5')
+        pool.allocate('127.0.0.5')
+        self.assertEqual(pool.used, 1)
+        pool.deallocate('127.0.0.5')
+        pool.deallocate('127.0.0.5')
+        # Last holder still uses the address
+        self.assertTrue(pool.is_allocated(5))
+        pool.deallocate('127.0.0.5')
+        self.assertFalse(pool.is_allocated(5))
+        self.assertEqual(pool.references, {})
+        pool.deallocate('127.0.0.5')
+        self.assertEqual(pool.used, 0)
+
+    def test_pool_bulk_duplicates(self):
+        pool = Pool(pool='127.0.0.0/30', options={'validate': '0'})
+        pool.allocate('127.0.0.1')
+        pool.allocate_many(addresses=['127.0.0.1', '127.0.0.2'])
+        with self.assertRaises(InputValidationException):
+            pool.allocate_many(addresses=['127.0.0.1', '127.0.0.2', '127.0.0.0'])
+        # Failed request does not leave extra holders behind
+        self.assertEqual(pool.references, {1: 1})
+        pool.deallocate_many(['127.0.0.1', '127.0.0.2'])
+        self.assertTrue(pool.is_allocated(1))
+        self.assertFalse(pool.is_allocated(2))
+        pool.deallocate('127.0.0.1')
+        self.assertFalse(pool.is_allocated(1))
+
+    def test_pool_restore_duplicates(self):
+        pool = Pool(pool='127.0.0.0/24', options={'validate': '0'})
+        pool.allocate('127.0.0.5')
+        pool.allocate('127.0.0.5')
+        pool.restore(300)
+        # Both holders request the address again after restart
+        pool.allocate('127.0.0.5')
+        pool.allocate('127.0.0.5')
+        pool.deallocate('127.0.0.5')
+        self.assertTrue(pool.is_allocated(5))
+        pool.deallocate('127.0.0.5')
+        self.assertFalse(pool.is_allocated(5))
+
+
+class TestPoolAllocator(unittest.TestCase):
+    def test_pool_offsets_ipv4(self):
+        pool = Pool(pool='127.0.0.0/8', subPool='127.1.0.0/16')
+        self.assertEqual(pool.allocate(), '127.1.0.1/8')
+        self.assertEqual(pool.allocate('127.0.0.5'), '127.0.0.5/8')
+        self.assertTrue(pool.is_allocated(5))
+        self.assertTrue(pool.is_allocated(pool.offset('127.1.0.1')))
+        self.assertFalse(pool.is_allocated(pool.offset('127.1.0.2')))
+        self.assertEqual(pool.address(pool.offset('127.1.0.1')), '127.1.0.1')
+        self.assertEqual(len(pool.allocator), 2)
+        pool.deallocate('127.0.0.5')
+        self.assertFalse(pool.is_allocated(5))
+
+    def test_pool_offset_parsing(self):
+        pool = Pool(pool='10.0.0.0/8')
+        self.assertEqual(pool.offset('10.1.2.3'), 0x010203)
+        self.assertEqual(pool.offset('11.0.0.0'), 1 << 24)
+        self.assertEqual(pool.offset('fd00::1'), -1)
+        self.assertEqual(pool.address(0xff00fe), '10.255.0.254')
+        # Addresses rejected by ipaddress are rejected as well
+        for address in ('010.0.0.1', '10.0.0.256', '10.0.0', '10.0.0.1/8', ' 10.0.0.1', '10.0.0.\u0661'):
+            with self.subTest(address=address), self.assertRaises(ValueError):
+                pool.offset(address)
+
+    def test_pool_allocator_option(self):
+        pool = Pool(pool='127.0.0.0/29', options={'allocator': 'interval'})
+        self.assertIsInstance(pool.allocator, IntervalAllocator)
+        self.assertEqual(pool.allocate(), '127.0.0.1/29')
+        self.assertEqual(pool.allocate('127.0.0.3'), '127.0.0.3/29')
+        self.assertEqual(pool.allocate(), '127.0.0.2/29')
+        self.assertEqual(pool.allocate(), '127.0.0.4/29')
+
+    def test_pool_allocate_full_ipv4(self):
+        pool = Pool(pool='10.0.0.0/16')
+        for _ in range(65534):
+            pool.allocate()
+        with self.assertRaises(InputValidationException):
+            pool.allocate()
+        pool.deallocate('10.0.128.0')
+        self.assertEqual(pool.allocate(), '10.0.128.0/16')
+
+
+class TestPoolUtilization(unittest.TestCase):
+    def test_pool_utilization_ipv4(self):
+        pool = Pool(pool='127.0.0.0/24', subPool='127.0.0.128/25')
+        self.assertEqual(pool.capacity, 126)
+        self.assertEqual(pool.free, 126)
+        pool.allocate()
+        pool.allocate('127.0.0.5')
+        self.assertEqual(pool.used, 1)
+        self.assertEqual(pool.free, 125)
+        pool.allocate_range(pool.offset('127.0.0.100'), pool.offset('127.0.0.200'))
+        self.assertEqual(pool.used, 71)
+        pool.deallocate('127.0.0.129')
+        pool.deallocate('127.0.0.5')
+        self.assertEqual(pool.used, 70)
+        self.assertAlmostEqual(pool.utilization, 70 / 126)
+
+    def test_pool_utilization_ptp(self):
+        pool = Pool(pool='127.0.0.0/31', options={'ptp': '1'})
+        pool.allocate()
+        pool.allocate()
+        self.assertEqual(pool.free, 0)
+        self.assertEqual(pool.utilization, 1.0)
+
+
+class TestPoolHugeIPv6(unittest.TestCase):
+    PREFIXES = [32, 48, 64, 96, 120, 127, 128]
+
+    def pools(self):
+        for prefixlen in self.PREFIXES:
+            # Last subnet of the pool, so that host range does not start at network address
+            subpool = ipaddress.ip_network(('fd00:0:ffff:ffff:ffff:ffff:ffff:ffff', prefixlen), strict=False)
+            yield prefixlen, Pool(pool='fd00::/32', subPool=str(subpool))
+
+    def test_near_full(self):
+        for prefixlen, pool in self.pools():
+            with self.subTest(prefixlen=prefixlen):
+                pool.allocate_range(pool.first, pool.last - 1)
+                self.assertEqual(pool.free, 1)
+                self.assertEqual(pool.allocate(), '{}/32'.format(pool.address(pool.last - 1)))
+                self.assertEqual(pool.free, 0)
+                self.assertEqual(pool.utilization, 1.0)
+                with self.assertRaises(InputValidationException):
+                    pool.allocate()
+
+    def test_full_wrap_around(self):
+        for prefixlen, pool in self.pools():
+            with self.subTest(prefixlen=prefixlen):
+                pool.allocate_range(pool.first, pool.last)
+                pool.current = pool.last - 1
+                middle = pool.address(pool.first + pool.capacity // 2)
+                pool.deallocate(middle)
+                self.assertEqual(pool.allocate(), '{}/32'.format(middle))
+                with self.assertRaises(InputValidationException):
+                    pool.allocate()
+
+    def test_manual_assignments(self):
+        pool = Pool(pool='fd00::/32', subPool='fd00:0:1::/48')
+        for offset in range(pool.first + 1, pool.first + 2001, 2):
+            pool.allocate(pool.address(offset))
+        self.assertEqual(pool.allocate(), 'fd00:0:1::1/32')
+        self.assertEqual(pool.allocate(), 'fd00:0:1::3/32')
+        self.assertEqual(pool.used, 1002)
+        self.assertEqual(pool.free, (1 << 80) - 1 - 1002)
+
+    def test_restore_expire(self):
+        pool = Pool(pool='fd00::/32')
+        pool.allocate_range(pool.first, pool.last)
+        pool.restore(300)
+        self.assertEqual(pool.allocate('fd00::5'), 'fd00::5/32')
+        pool.restored_until = 0
+        # Replayed, so the rest of restored addresses is released in ranges
+        self.assertEqual(pool.allocate(), 'fd00::1/32')
+        self.assertEqual(pool.used, 2)
+        self.assertEqual(list(pool.allocator.ranges()), [(1, 2), (5, 6)])
+
+
+class TestPoolStrategy(unittest.TestCase):
+    def test_unknown(self):
+        with self.assertRaises(InputValidationException):
+            Pool(pool='10.0.0.0/24', options={'strategy': 'unknown'})
+
+    def test_random(self):
+        pool = Pool(pool='10.0.0.0/28', options={'strategy': 'random'})
+        addresses = {pool.allocate() for _ in range(14)}
+        self.assertEqual(addresses, {'10.0.0.{}/28'.format(host) for host in range(1, 15)})
+        with self.assertRaises(InputValidationException):
+            pool.allocate()
+
+    def test_random_huge_ipv6(self):
+        pool = Pool(pool='fd00::/48', options={'strategy': 'random'})
+        self.assertNotEqual(pool.allocate(), pool.allocate())
+        self.assertEqual(pool.used, 2)
+
+    def test_mac_hash(self):
+        pool = Pool(pool='10.0.0.0/16', options={'strategy': 'mac-hash'})
+        address = pool.allocate(mac='02:42:ac:11:00:02')
+        pool.deallocate(address.split('/')[0])
+        self.assertEqual(pool.allocate(mac='02:42:AC:11:00:02'), address)
+        # Collision falls back to the next free address
+        self.assertNotEqual(pool.allocate(mac='02:42:ac:11:00:02'), address)
+        self.assertNotEqual(pool.allocate(mac='02:42:ac:11:00:03'), address)
+
+    def test_mac_hash_without_mac(self):
+        pool = Pool(pool='10.0.0.0/24', options={'strategy': 'mac-hash'})
+        self.assertEqual(pool.allocate(), '10.0.0.1/24')
+
+    def test_mac_hash_ptp(self):
+        pool = Pool(pool='10.0.0.0/31', options={'strategy': 'mac-hash', 'ptp': '1'})
+        addresses = {pool.allocate(mac='02:42:ac:11:00:0{}'.format(i)) for i in range(2)}
+        self.assertEqual(addresses, {'10.0.0.0/32', '10.0.0.1/32'})
+
+    def test_explicit_address(self):
+        pool = Pool(pool='10.0.0.0/24', options={'strategy': 'random'})
+        self.assertEqual(pool.allocate('10.0.0.7', mac='02:42:ac:11:00:02'), '10.0.0.7/24')
+        with self.assertRaises(InputValidationException):
+            pool.allocate('10.0.0.7')
+
+
+class TestPoolAllocateMany(unittest.TestCase):
+    def test_allocate_many(self):
+        pool = Pool(pool='10.0.0.0/24')
+        self.assertEqual(pool.allocate_many(3, ['10.0.0.2', '10.0.0.10']),
+                         ['10.0.0.2/24', '10.0.0.10/24', '10.0.0.1/24', '10.0.0.3/24', '10.0.0.4/24'])
+        self.assertEqual(pool.used, 5)
+
+    def test_allocate_many_atomic(self):
+        pool = Pool(pool='10.0.0.0/29')
+        pool.allocate('10.0.0.5')
+        for count, addresses in ((0, ['10.0.0.1', '10.0.0.5']), (0, ['10.0.0.1', '10.0.1.1']),
+                                 (0, ['10.0.0.1', 'invalid']), (0, ['10.0.0.1', '10.0.0.1']), (6, [])):
+            with self.subTest(count=count, addresses=addresses):
+                with self.assertRaises(InputValidationException):
+                    pool.allocate_many(count, addresses)
+                self.assertEqual(list(pool.allocator), [5])
+        self.assertEqual(len(pool.allocate_many(5)), 5)
+
+    def test_allocate_many_rollback(self):
+        # Subpool contains pool network address, which is only found when allocating
+        pool = Pool(pool='10.0.0.0/24', subPool='10.0.0.0/31')
+        with self.assertRaises(InputValidationException):
+            pool.allocate_many(1, ['10.0.0.1'])
+        self.assertEqual(list(pool.allocator), [])
+        self.assertEqual(pool.current, pool.first)
+
+    def test_allocate_many_restored(self):
+        pool = Pool(pool='10.0.0.0/24')
+        pool.allocate('10.0.0.1')
+        pool.restore(300)
+        with self.assertRaises(InputValidationException):
+            pool.allocate_many(1, ['10.0.0.1', '10.0.0.0'])
+        # Exemption is not used up by failed request
+        self.assertEqual(pool.allocate_many(1, ['10.0.0.1']), ['10.0.0.1/24', '10.0.0.2/24'])
+
+    def test_deallocate_many(self):
+        pool = Pool(pool='10.0.0.0/24')
+        pool.allocate_many(5)
+        with self.assertRaises(InputValidationException):
+            pool.deallocate_many(['10.0.0.1', '10.0.1.1'])
+        self.assertEqual(pool.used, 5)
+        pool.deallocate_many(['10.0.0.1', '10.0.0.3', '10.0.0.200'])
+        self.assertEqual(list(pool.allocator), [2, 4, 5])
+
+
+class TestPoolCompact(unittest.TestCase):
+    def test_no_instance_dict(self):
+        pool = Pool(pool='10.0.0.0/24')
+        self.assertFalse(hasattr(pool, '__dict__'))
+        self.assertFalse(hasattr(pool.allocator, '__dict__'))
+        self.assertIsNone(pool.restored)
+
+    def test_networks(self):
+        pool = Pool(pool='10.0.0.5/16', subPool='10.0.128.0/17')
+        self.assertEqual(str(pool), '10.0.0.0/16')
+        self.assertEqual(pool.pool, ipaddress.ip_network('10.0.0.0/16'))
+        self.assertEqual(pool.subpool, ipaddress.ip_network('10.0.128.0/17'))
+        self.assertEqual(Pool(pool='fd00::/64').subpool, ipaddress.ip_network('fd00::/64'))
+
+    def test_overlaps(self):
+        pool = Pool(pool='10.0.0.0/16')
+        self.assertTrue(pool.overlaps(Pool(pool='10.0.5.0/24')))
+        self.assertTrue(pool.overlaps(Pool(pool='10.0.0.0/8')))
+        self.assertFalse(pool.overlaps(Pool(pool='10.1.0.0/16')))
+        self.assertTrue(Pool(pool='fd00::/64').overlaps(Pool(pool='fd00::/48')))
+
+
+class TestPoolRanges(unittest.TestCase):
+    def test_include_exclude(self):
+        pool = Pool(pool='10.0.0.0/24', options={
+            'include': '10.0.0.10-10.0.0.12, 10.0.0.100/30', 'exclude': '10.0.0.11,10.0.0.101',
+        })
+        self.assertEqual(pool.capacity, 5)
+        self.assertEqual([pool.allocate() for _ in range(5)],
+                         ['10.0.0.10/24', '10.0.0.12/24', '10.0.0.100/24', '10.0.0.102/24', '10.0.0.103/24'])
+        with self.assertRaises(InputValidationException):
+            pool.allocate()
+        # Excluded addresses can still be requested explicitly, e.g. for a gateway
+        self.assertEqual(pool.allocate('10.0.0.11'), '10.0.0.11/24')
+        self.assertEqual((pool.used, pool.free), (5, 0))
+        pool.deallocate('10.0.0.11')
+        pool.deallocate('10.0.0.102')
+        self.assertEqual(pool.allocate(), '10.0.0.102/24')
+
+    def test_exclude_with_subpool(self):
+        pool = Pool(pool='10.0.0.0/16', subPool='10.0.1.0/24', options={'exclude': '10.0.0.0/24, 10.0.1.1-10.0.1.9'})
+        self.assertEqual(pool.capacity, 254 - 9)
+        self.assertEqual(pool.allocate(), '10.0.1.10/16')
+
+    def test_range_update(self):
+        pool = Pool(pool='10.0.0.0/24', options={'exclude': '10.0.0.10-10.0.0.19'})
+        self.assertEqual(pool.allocate_range(5, 25), 20)
+        self.assertEqual(pool.used, 10)
+        self.assertEqual(pool.release_range(0, 256), 20)
+        self.assertEqual(pool.used, 0)
+
+    def test_random(self):
+        pool = Pool(pool='10.0.0.0/24', options={'include': '10.0.0.200-10.0.0.209', 'strategy': 'random'})
+        addresses = {pool.allocate() for _ in range(10)}
+        self.assertEqual(addresses, {'10.0.0.{}/24'.format(host) for host in range(200, 210)})
+
+    def test_invalid(self):
+        for options in ({'include': '10.0.1.0/24'}, {'exclude': 'fd00::1'}, {'include': '10.0.0.9-10.0.0.1'},
+                        {'exclude': '10.0.0.300'}, {'include': '10.0.0.1-fd00::1'}):
+            with self.subTest(options=options), self.assertRaises(InputValidationException):
+                Pool(pool='10.0.0.0/24', options=options)
+
+
+class TestPoolQuarantine(unittest.TestCase):
+    @staticmethod
+    def elapse(pool: Pool, seconds: float):
+        # Moves releases back in time instead of waiting
+        pool.quarantine = collections.deque((expires - seconds, offset) for expires, offset in pool.quarantine)
+        pool.quarantined = {offset: expires - seconds for offset, expires in pool.quarantined.items()}
+
+    def test_delayed_reuse(self):
+        pool = Pool(pool='10.0.0.0/29', options={'reuse_delay': '60'})
+        self.assertEqual(len(pool.allocate_many(6)), 6)
+        pool.deallocate('10.0.0.3')
+        pool.deallocate('10.0.0.3')
+        self.assertEqual((pool.used, list(pool.quarantined)), (6, [3]))
+        with self.assertRaises(InputValidationException):
+            pool.allocate()
+        self.elapse(pool, 30)
+        with self.assertRaises(InputValidationException):
+            pool.allocate()
+        self.elapse(pool, 30)
+        self.assertEqual(pool.allocate(), '10.0.0.3/29')
+        self.assertEqual(pool.quarantined, {})
+
+    def test_explicit_request(self):
+        pool = Pool(pool='10.0.0.0/29', options={'reuse_delay': '60'})
+        pool.allocate('10.0.0.1')
+        pool.deallocate('10.0.0.1')
+        # Quarantine only applies to automatic assignment
+        self.assertEqual(pool.allocate('10.0.0.1'), '10.0.0.1/29')
+        with self.assertRaises(InputValidationException):
+            pool.allocate('10.0.0.1')
+        self.elapse(pool, 60)
+        pool.deallocate('10.0.0.1')
+        # Entry of the first release is stale, the address is quarantined again
+        self.assertEqual(pool.allocate(), '10.0.0.2/29')
+        self.assertEqual(list(pool.quarantined), [1])
+        self.assertEqual(len(pool.quarantine), 1)
+
+    def test_allocate_many_rollback(self):
+        pool = Pool(pool='10.0.0.0/29', options={'reuse_delay': '60'})
+        pool.allocate('10.0.0.1')
+        pool.deallocate('10.0.0.1')
+        with self.assertRaises(InputValidationException):
+            pool.allocate_many(0, ['10.0.0.1', '10.0.0.7'])
+        self.assertEqual(list(pool.quarantined), [1])
+        self.assertEqual(pool.allocate_many(1, ['10.0.0.1']), ['10.0.0.1/29', '10.0.0.2/29'])
+
+    def test_restore(self):
+        pool = Pool(pool='10.0.0.0/29', options={'reuse_delay': '60'})
+        pool.allocate_many(2)
+        pool.deallocate('10.0.0.1')
+        pool.restore(300)
+        # Quarantined addresses are not expected to be requested again
+        self.assertEqual(list(pool.restored), [2])
+        self.assertEqual(pool.allocate('10.0.0.2'), '10.0.0.2/29')
+        pool.restored_until = 0
+        self.assertEqual(pool.allocate(), '10.0.0.3/29')
+        self.assertEqual(list(pool.allocator), [1, 2, 3])
+        self.elapse(pool, 60)
+        self.assertEqual(pool.allocate(), '10.0.0.4/29')
+        self.assertEqual(list(pool.allocator), [2, 3, 4])
+
+    def test_disabled(self):
+        pool = Pool(pool='10.0.0.0/29', options={'reuse_delay': '0'})
+        pool.allocate('10.0.0.1')
+        pool.deallocate('10.0.0.1')
+        self.assertIsNone(pool.quarantine)
+        self.assertEqual(pool.allocate('10.0.0.1'), '10.0.0.1/29')
+
+    def test_invalid(self):
+        for delay in ('soon', '-1', 'inf', 'nan'):
+            with self.subTest(delay=delay), self.assertRaises(InputValidationException):
+                Pool(pool='10.0.0.0/24', options={'reuse_delay': delay})
@@ -0,0 +1,109 @@
+import ipaddress
+import unittest
+
+from lib.Carver import MAX_CARVERS
+from lib.Ipam import *
+from docker_plugin_api.Plugin import InputValidationException
+
+
+class SpaceTest(unittest.TestCase):
+    def test_add_pool(self):
+        space = Space('test')
+        self.assertEqual(space.add_pool(Pool(pool='10.0.0.0/16')), '10.0.0.0/16')
+        self.assertEqual(space.add_pool(Pool(pool='10.1.0.0/16')), '10.1.0.0/16')
+        self.assertEqual(space.add_pool(Pool(pool='fd00::/64')), 'fd00::/64')
+        self.assertEqual(space.add_pool(Pool(pool='10.0.0.0/16')), '10.0.0.0/16')
+        with self.assertRaises(InputValidationException):
+            space.add_pool(Pool(pool='10.0.0.0/8'))
+        with self.assertRaises(InputValidationException):
+            space.add_pool(Pool(pool='10.0.5.0/24'))
+        with self.assertRaises(InputValidationException):
+            space.add_pool(Pool(pool='10.0.0.0/16', subPool='10.0.0.0/24'))
+        with self.assertRaises(InputValidationException):
+            space.add_pool(Pool(pool='fd00::/48'))
+
+    def test_get_pool(self):
+        space = Space('test')
+        pool = Pool(pool='10.0.0.0/16')
+        space.add_pool(pool)
+        self.assertIs(space.get_pool('10.0.0.0/16'), pool)
+        with self.assertRaises(InputValidationException):
+            space.get_pool('10.0.0.0/24')
+
+    def test_find_pool(self):
+        space = Space('test')
+        pool = Pool(pool='fd00::/64')
+        space.add_pool(pool)
+        self.assertIs(space.find_pool('fd00::1'), pool)
+        self.assertIs(space.find_pool('fd00::/96'), pool)
+        with self.assertRaises(InputValidationException):
+            space.find_pool('fd00::/48')
+
+    def test_remove_pool(self):
+        space = Space('test')
+        space.add_pool(Pool(pool='10.0.0.0/16'))
+        space.remove_pool('10.0.0.0/16')
+        with self.assertRaises(InputValidationException):
+            space.remove_pool('10.0.0.0/16')
+        self.assertEqual(space.add_pool(Pool(pool='10.0.0.0/8')), '10.0.0.0/8')
+
+    def test_load_pools(self):
+        space = Space('test')
+        space.add_pool(Pool(pool='10.0.0.0/16'))
+        space.load_pools([Pool(pool='10.1.0.0/16'), Pool(pool='fd00::/64'), Pool(pool='10.2.0.0/16')])
+        self.assertEqual(len(space.pools), 3)
+        self.assertEqual(len(space.pools6), 1)
+        with self.assertRaises(InputValidationException):
+            space.load_pools([Pool(pool='10.3.0.0/16'), Pool(pool='10.3.1.0/24')])
+        with self.assertRaises(InputValidationException):
+            space.load_pools([Pool(pool='10.0.0.0/8')])
+
+
+class SpaceCarveTest(unittest.TestCase):
+    def test_carve_pool(self):
+        space = Space('test')
+        options = {'supernet': '10.0.0.0/20', 'prefixlen': '24'}
+        for _ in range(16):
+            space.add_pool(Pool(pool=space.carve_pool(False, options), options=options))
+        with self.assertRaises(InputValidationException):
+            space.carve_pool(False, options)
+        space.remove_pool('10.0.5.0/24')
+        self.assertEqual(space.carve_pool(False, options), '10.0.5.0/24')
+
+    def test_carve_pool_existing(self):
+        space = Space('test')
+        space.add_pool(Pool(pool='10.0.0.0/25'))
+        space.add_pool(Pool(pool='10.0.0.128/25'))
+        options = {'supernet': '10.0.0.0/23'}
+        self.assertEqual(space.carve_pool(False, options), '10.0.1.0/24')
+        space.remove_pool('10.0.0.0/25')
+        self.assertEqual(space.carve_pool(False, options), '10.0.1.0/24')
+        space.remove_pool('10.0.0.128/25')
+        space.add_pool(Pool(pool='10.0.1.0/24'))
+        self.assertEqual(space.carve_pool(False, options), '10.0.0.0/24')
+
+    def test_carve_pool_ipv6(self):
+        space = Space('test')
+        pool = space.carve_pool(True)
+        self.assertTrue(ipaddress.ip_network(pool).subnet_of(ipaddress.ip_network('fd00::/8')))
+        self.assertEqual(ipaddress.ip_network(pool).prefixlen, 64)
+
+    def test_carvers_bounded(self):
+        space = Space('test')
+        for index in range(MAX_CARVERS * 2):
+            space.carve_pool(False, {'supernet': '10.{}.0.0/16'.format(index)})
+        self.assertEqual(len(space.carvers), MAX_CARVERS)
+        space.add_pool(Pool(pool='10.0.0.0/17'))
+        # Evicted carver is rebuilt with existing pools
+        self.assertEqual(space.carve_pool(False, {'supernet': '10.0.0.0/16', 'prefixlen': '17'}), '10.0.128.0/17')
+
+    def test_get_existing(self):
+        space = Space('test')
+        pool = Pool(pool='10.0.0.0/16', subPool='10.0.1.0/24')
+        space.add_pool(pool)
+        space.add_pool(Pool(pool='fd00::/64'))
+        self.assertIs(space.get_existing('10.0.0.0/16', '10.0.1.0/24'), pool)
+        self.assertIsNone(space.get_existing('10.0.0.0/16'))
+        self.assertIsNone(space.get_existing('10.0.0.0/16', '10.0.2.0/24'))
+        self.assertIsNone(space.get_existing('10.1.0.0/16'))
+        self.assertIsNotNone(space.get_existing('fd00::/64', ''))
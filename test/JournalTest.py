@@ -0,0 +1,176 @@
+import os
+import tempfile
+import unittest
+
+from lib.Ipam import *
+from lib.Journal import *
+from docker_plugin_api.Plugin import InputValidationException
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'state')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def open(self, snapshot_interval: int = 1000, replay_window: float = 300):
+        spaces = {'local': Space('local')}
+        journal = Journal(self.path, spaces, snapshot_interval, replay_window=replay_window)
+        journal.open()
+        self.addCleanup(journal.close)
+        return spaces, journal
+
+    def populate(self, spaces: dict, journal: Journal):
+        space = spaces['local']
+        pool = Pool(pool='10.0.0.0/24', options={'ptp': '1'})
+        space.add_pool(pool)
+        journal.record('RequestPool', space, pool, subpool=str(pool.subpool), options=pool.options)
+        for _ in range(3):
+            address = pool.allocate().split('/')[0]
+            journal.record('RequestAddress', space, pool, address=address, auto=True)
+        pool.deallocate('10.0.0.1')
+        journal.record('ReleaseAddress', space, pool, address='10.0.0.1')
+        other = Pool(pool='fd00::/64')
+        space.add_pool(other)
+        journal.record('RequestPool', space, other, subpool=str(other.subpool), options=other.options)
+        other.allocate('fd00::5')
+        journal.record('RequestAddress', space, other, address='fd00::5')
+        space.remove_pool(str(other))
+        journal.record('ReleasePool', space, other)
+
+    def check(self, spaces: dict):
+        space = spaces['local']
+        self.assertEqual(list(space.pools), ['10.0.0.0/24'])
+        self.assertEqual(list(space.pools6), [])
+        pool = space.get_pool('10.0.0.0/24')
+        self.assertTrue(pool.ptp)
+        self.assertEqual(list(pool.allocator), [0, 2])
+        self.assertEqual(list(pool.restored), [0, 2])
+        self.assertEqual(pool.allocate(), '10.0.0.3/32')
+        # Addresses requested again by Docker are not conflicts, but only once
+        self.assertEqual(pool.allocate('10.0.0.2'), '10.0.0.2/32')
+        with self.assertRaises(InputValidationException):
+            pool.allocate('10.0.0.2')
+
+    def test_log_replay(self):
+        spaces, journal = self.open()
+        self.populate(spaces, journal)
+        journal.close()
+        self.check(self.open()[0])
+
+    def test_snapshot(self):
+        spaces, journal = self.open(snapshot_interval=2)
+        self.populate(spaces, journal)
+        journal.snapshot()
+        journal.close()
+        self.check(self.open()[0])
+
+    def test_skip_snapshotted_entries(self):
+        spaces, journal = self.open()
+        self.populate(spaces, journal)
+        with open(journal.log_path) as f:
+            log = f.read()
+        journal.snapshot()
+        journal.close()
+        # Simulate crash between writing snapshot and truncating the log
+        with open(journal.log_path, 'w') as f:
+            f.write(log)
+        self.check(self.open()[0])
+
+    def test_snapshot_interleaved(self):
+        spaces, journal = self.open()
+        self.populate(spaces, journal)
+        journal.snapshot()
+        space = spaces['local']
+        pool = space.get_pool('10.0.0.0/24')
+        pool.deallocate('10.0.0.2')
+        journal.record('ReleaseAddress', space, pool, address='10.0.0.2')
+        pool.allocate('10.0.0.2')
+        journal.record('RequestAddress', space, pool, address='10.0.0.2')
+        pool.deallocate('10.0.0.0')
+        journal.record('ReleaseAddress', space, pool, address='10.0.0.0')
+        journal.close()
+        pool = self.open()[0]['local'].get_pool('10.0.0.0/24')
+        self.assertEqual(list(pool.allocator), [2])
+
+    def test_bulk_replay(self):
+        spaces, journal = self.open()
+        space = spaces['local']
+        pool = Pool(pool='10.0.0.0/24')
+        space.add_pool(pool)
+        journal.record('RequestPool', space, pool, subpool=str(pool.subpool), options=pool.options)
+        addresses = [address.split('/')[0] for address in pool.allocate_many(3, ['10.0.0.10'])]
+        journal.record('RequestAddresses', space, pool, addresses=addresses, current=pool.current)
+        pool.deallocate_many(['10.0.0.1', '10.0.0.10'])
+        journal.record('ReleaseAddresses', space, pool, addresses=['10.0.0.1', '10.0.0.10'])
+        journal.close()
+        pool = self.open()[0]['local'].get_pool('10.0.0.0/24')
+        self.assertEqual(list(pool.allocator), [2, 3])
+        self.assertEqual(pool.current, 4)
+
+    def test_pool_recreated(self):
+        spaces, journal = self.open()
+        self.populate(spaces, journal)
+        space = spaces['local']
+        other = Pool(pool='fd00::/64')
+        space.add_pool(other)
+        journal.record('RequestPool', space, other, subpool=str(other.subpool), options=other.options)
+        journal.snapshot()
+        journal.close()
+        # Allocation of the released pool with the same ID is not applied to the new one
+        spaces = self.open()[0]
+        self.assertEqual(len(spaces['local'].get_pool('fd00::/64').allocator), 0)
+
+    def test_replay_window(self):
+        spaces, journal = self.open()
+        self.populate(spaces, journal)
+        journal.close()
+        pool = self.open(replay_window=0)[0]['local'].get_pool('10.0.0.0/24')
+        # Not replayed by Docker - addresses are kept, but no longer exempt
+        with self.assertRaises(InputValidationException):
+            pool.allocate('10.0.0.2')
+        self.assertIsNone(pool.restored)
+        self.assertEqual(list(pool.allocator), [0, 2])
+
+    def test_replay_window_stale(self):
+        spaces, journal = self.open()
+        self.populate(spaces, journal)
+        journal.close()
+        pool = self.open()[0]['local'].get_pool('10.0.0.0/24')
+        self.assertEqual(pool.allocate('10.0.0.2'), '10.0.0.2/32')
+        pool.restored_until = 0
+        # Docker replayed the pool, so address not requested again is released
+        self.assertEqual(pool.allocate(), '10.0.0.3/32')
+        self.assertEqual(list(pool.allocator), [2, 3])
+        self.assertEqual(pool.allocate('10.0.0.0'), '10.0.0.0/32')
+
+    def test_snapshot_quarantine(self):
+        spaces, journal = self.open()
+        pool = Pool(pool='10.0.0.0/29', options={'reuse_delay': '60'})
+        spaces['local'].add_pool(pool)
+        journal.record('RequestPool', spaces['local'], pool, subpool=str(pool.subpool), options=pool.options)
+        pool.allocate_many(2)
+        pool.deallocate('10.0.0.1')
+        journal.snapshot()
+        journal.close()
+        pool = self.open(replay_window=0)[0]['local'].get_pool('10.0.0.0/29')
+        self.assertEqual(list(pool.quarantined), [1])
+        self.assertEqual(pool.allocate(), '10.0.0.3/29')
+
+    def test_checkpoint(self):
+        spaces, journal = self.open(snapshot_interval=5)
+        self.populate(spaces, journal)
+        self.assertEqual(journal.entries, 8)
+        journal.checkpoint()
+        self.assertEqual(journal.entries, 0)
+        self.assertEqual(os.path.getsize(journal.log_path), 0)
+        self.assertFalse(os.path.exists(journal.old_log_path))
+
+    def test_torn_write(self):
+        spaces, journal = self.open()
+        self.populate(spaces, journal)
+        journal.log.write('{"seq":100,"op":"Requ')
+        journal.close()
+        self.check(self.open()[0])
@@ -0,0 +1,67 @@
+import os
+import socket
+import tempfile
+import unittest
+
+from docker_plugin_api.Plugin import InputValidationException
+
+from lib.Ipam import *
+from lib.IpamDriverData import ReplayProgress
+from lib.Metrics import *
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.space = Space('local')
+        self.metrics = Metrics({'local': self.space})
+
+    def test_instrument(self):
+        def fail(data):
+            raise InputValidationException('Failed')
+
+        handlers = {'/IpamDriver.Ok': lambda data: {}, '/IpamDriver.Fail': fail}
+        self.metrics.instrument(handlers)
+        handlers['/IpamDriver.Ok']({})
+        handlers['/IpamDriver.Ok']({})
+        with self.assertRaises(InputValidationException):
+            handlers['/IpamDriver.Fail']({})
+
+        output = self.metrics.render()
+        self.assertIn('pyipam_requests_total{endpoint="Ok"} 2', output)
+        self.assertIn('pyipam_errors_total{endpoint="Ok"} 0', output)
+        self.assertIn('pyipam_errors_total{endpoint="Fail"} 1', output)
+        self.assertIn('pyipam_request_duration_seconds_bucket{endpoint="Ok",le="+Inf"} 2', output)
+        self.assertIn('pyipam_request_duration_seconds_count{endpoint="Fail"} 1', output)
+
+    def test_pool_gauges(self):
+        pool = Pool(pool='10.0.0.0/30')
+        self.space.add_pool(pool)
+        pool.allocate()
+        output = self.metrics.render()
+        self.assertIn('pyipam_pool_allocated{space="local",pool="10.0.0.0/30"} 1', output)
+        self.assertIn('pyipam_pool_free{space="local",pool="10.0.0.0/30"} 1', output)
+        self.assertIn('pyipam_pool_utilization{space="local",pool="10.0.0.0/30"} 0.5', output)
+
+    def test_replay(self):
+        replay = ReplayProgress()
+        replay.record(pools=2)
+        replay.record(addresses=3)
+        output = Metrics({'local': self.space}, replay).render()
+        self.assertIn('pyipam_replayed_pools_total 2', output)
+        self.assertIn('pyipam_replayed_addresses_total 3', output)
+        self.assertIn('pyipam_replay_pending_addresses 0', output)
+
+    def test_serve(self):
+        path = os.path.join(tempfile.mkdtemp(), 'metrics.sock')
+        serve(self.metrics, path)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(path)
+            client.sendall(b'GET /metrics HTTP/1.0\r\n\r\n')
+            response = b''
+            while True:
+                data = client.recv(4096)
+                if not data:
+                    break
+                response += data
+        self.assertTrue(response.startswith(b'HTTP/1.0 200'))
+        self.assertIn(b'pyipam_requests_total', response)
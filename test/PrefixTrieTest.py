@@ -0,0 +1,86 @@
+import ipaddress
+import random
+import unittest
+
+from lib.PrefixTrie import *
+
+
+def prefix(network: str):
+    network = ipaddress.ip_network(network)
+    return int(network.network_address), network.prefixlen
+
+
+class PrefixTrieTest(unittest.TestCase):
+    def test_get(self):
+        trie = PrefixTrie(32)
+        trie.insert(*prefix('10.0.0.0/8'), 'a')
+        trie.insert(*prefix('10.1.0.0/16'), 'b')
+        trie.insert(*prefix('192.168.0.0/24'), 'c')
+        self.assertEqual(trie.get(*prefix('10.0.0.0/8')), 'a')
+        self.assertEqual(trie.get(*prefix('10.1.0.0/16')), 'b')
+        self.assertEqual(trie.get(*prefix('192.168.0.0/24')), 'c')
+        self.assertIsNone(trie.get(*prefix('10.0.0.0/16')))
+        self.assertIsNone(trie.get(*prefix('192.168.0.0/16')))
+        self.assertEqual(len(trie), 3)
+
+    def test_overlap(self):
+        trie = PrefixTrie(32)
+        trie.insert(*prefix('10.1.0.0/16'), 'a')
+        trie.insert(*prefix('10.2.0.0/16'), 'b')
+        self.assertEqual(trie.find_overlap(*prefix('10.1.2.0/24')), 'a')
+        self.assertEqual(trie.find_overlap(*prefix('10.1.0.0/16')), 'a')
+        self.assertIn(trie.find_overlap(*prefix('10.0.0.0/8')), ('a', 'b'))
+        self.assertIn(trie.find_overlap(*prefix('0.0.0.0/0')), ('a', 'b'))
+        self.assertIsNone(trie.find_overlap(*prefix('10.3.0.0/16')))
+        self.assertIsNone(trie.find_overlap(*prefix('10.4.0.0/15')))
+
+    def test_longest_match(self):
+        trie = PrefixTrie(128)
+        trie.insert(*prefix('fd00::/16'), 'a')
+        trie.insert(*prefix('fd00:1::/32'), 'b')
+        self.assertEqual(trie.longest_match(*prefix('fd00:1:2::/48')), 'b')
+        self.assertEqual(trie.longest_match(*prefix('fd00:2::/48')), 'a')
+        self.assertEqual(trie.longest_match(int(ipaddress.ip_address('fd00:1::5'))), 'b')
+        self.assertIsNone(trie.longest_match(*prefix('fd01::/16')))
+        self.assertIsNone(trie.longest_match(*prefix('fd00::/8')))
+
+    def test_remove(self):
+        trie = PrefixTrie(32)
+        trie.insert(*prefix('10.0.0.0/8'), 'a')
+        trie.insert(*prefix('10.1.0.0/16'), 'b')
+        trie.insert(*prefix('10.2.0.0/16'), 'c')
+        self.assertIsNone(trie.remove(*prefix('10.3.0.0/16')))
+        self.assertEqual(trie.remove(*prefix('10.0.0.0/8')), 'a')
+        self.assertIsNone(trie.find_overlap(*prefix('10.3.0.0/16')))
+        self.assertEqual(trie.remove(*prefix('10.1.0.0/16')), 'b')
+        self.assertEqual(trie.find_overlap(*prefix('10.0.0.0/8')), 'c')
+        self.assertEqual(trie.remove(*prefix('10.2.0.0/16')), 'c')
+        self.assertIsNone(trie.root)
+        self.assertEqual(len(trie), 0)
+
+    def test_random(self):
+        rng = random.Random(2)
+        trie = PrefixTrie(32)
+        reference = {}
+        for _ in range(500):
+            length = rng.randrange(8, 25)
+            network = ipaddress.ip_network((rng.randrange(1 << 32) >> (32 - length) << (32 - length), length))
+            overlaps = [n for n in reference if n.overlaps(network)]
+            found = trie.find_overlap(int(network.network_address), length)
+            if overlaps:
+                self.assertIn(found, overlaps)
+                if rng.random() < 0.5:
+                    victim = rng.choice(overlaps)
+                    self.assertEqual(trie.remove(int(victim.network_address), victim.prefixlen), victim)
+                    del reference[victim]
+            else:
+                self.assertIsNone(found)
+                trie.insert(int(network.network_address), length, network)
+                reference[network] = True
+        self.assertEqual(sorted(trie.values()), sorted(reference))
+
+    def test_load(self):
+        trie = PrefixTrie(32)
+        trie.load([prefix('10.1.0.0/16') + ('b',), prefix('10.0.0.0/8') + ('a',)])
+        self.assertEqual(trie.get(*prefix('10.0.0.0/8')), 'a')
+        self.assertEqual(trie.longest_match(*prefix('10.1.1.0/24')), 'b')
@@ -0,0 +1,40 @@
+import random
+import unittest
+
+from lib.Allocator import *
+from lib.RangeSet import *
+
+
+class RangeSetTest(unittest.TestCase):
+    def test_merge(self):
+        ranges = RangeSet([(10, 20), (0, 5), (5, 7), (15, 25), (30, 30)])
+        self.assertEqual(list(ranges.ranges()), [(0, 7), (10, 25)])
+        self.assertEqual(len(ranges), 22)
+        self.assertIn(6, ranges)
+        self.assertNotIn(7, ranges)
+        self.assertNotIn(25, ranges)
+        self.assertEqual(len(RangeSet()), 0)
+
+    def test_difference(self):
+        ranges = RangeSet([(0, 10), (20, 30)]).difference(RangeSet([(0, 2), (5, 6), (9, 21), (25, 40)]))
+        self.assertEqual(list(ranges.ranges()), [(2, 5), (6, 9), (21, 25)])
+
+    def test_intersection(self):
+        ranges = RangeSet([(0, 10), (20, 30)]).intersection(5, 25)
+        self.assertEqual(list(ranges.ranges()), [(5, 10), (20, 25)])
+        self.assertEqual(list(ranges.within(8, 22)), [(8, 10), (20, 22)])
+
+    def test_nth(self):
+        ranges = RangeSet([(10, 12), (20, 23)])
+        self.assertEqual([ranges.nth(index) for index in range(len(ranges))], [10, 11, 20, 21, 22])
+
+    def test_find_free(self):
+        rng = random.Random(5)
+        ranges = RangeSet((start, start + rng.randrange(1, 20)) for start in rng.sample(range(1000), 30))
+        allocator = BitmapAllocator(1100)
+        for offset in rng.sample(range(1100), 600):
+            allocator.allocate(offset)
+        members = [offset for offset in range(1100) if offset in ranges and not allocator.is_allocated(offset)]
+        for offset in range(0, 1100, 7):
+            expected = next((member for member in members if member >= offset), members[0] if members else None)
+            self.assertEqual(ranges.find_free(allocator, offset), expected)
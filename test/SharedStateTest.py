@@ -0,0 +1,167 @@
+import multiprocessing
+import os
+import tempfile
+import unittest
+
+import lib.IpamDriverData
+from lib.Ipam import *
+from lib.IpamDriver import handlers
+from lib.SharedState import *
+from docker_plugin_api.Plugin import InputValidationException
+
+
+def worker(path: str, count: int, connection):
+    # Runs in a forked process, so module state of the driver is its own
+    try:
+        lib.IpamDriverData.enable_shared_state(path)
+        pool_id = handlers['/IpamDriver.RequestPool']({'AddressSpace': 'local', 'Pool': '10.0.0.0/16'})['PoolID']
+        addresses = []
+        for _ in range(count):
+            response = handlers['/IpamDriver.RequestAddress']({'PoolID': pool_id})
+            addresses.append(response['Address'])
+        connection.send(addresses)
+    except Exception as e:
+        connection.send(repr(e))
+    finally:
+        connection.close()
+
+
+class SharedStateTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'shared.state')
+        SharedState.create(self.path, 16 << 20)
+
+    def attach(self):
+        state = SharedState(self.path)
+        spaces = {'local': Space('local')}
+        for space in spaces.values():
+            space.lock = state.lock
+        return state, spaces
+
+    def publish(self, state: SharedState, space: Space, network: str, options: dict = None) -> SharedPool:
+        pool = SharedPool(pool=network, options=options)
+        space.add_pool(pool)
+        state.publish(space, pool)
+        return pool
+
+    def test_sync(self):
+        first, first_spaces = self.attach()
+        second, second_spaces = self.attach()
+        first.sync(first_spaces)
+        pool = self.publish(first, first_spaces['local'], '10.0.0.0/24', {'strategy': 'sequential'})
+        self.assertFalse(first.changed())
+        self.assertEqual(pool.allocate(), '10.0.0.1/24')
+
+        added, removed = second.sync(second_spaces)
+        self.assertEqual(len(added), 1)
+        other = second_spaces['local'].get_pool('10.0.0.0/24')
+        self.assertEqual(other.options, {'strategy': 'sequential'})
+        self.assertTrue(other.is_allocated(1))
+        self.assertEqual(other.allocate(), '10.0.0.2/24')
+        self.assertEqual((pool.used, pool.current), (2, 3))
+        self.assertEqual(second.sync(second_spaces), ([], []))
+
+        first_spaces['local'].remove_pool(pool)
+        first.withdraw(pool)
+        added, removed = second.sync(second_spaces)
+        self.assertEqual(removed, [(second_spaces['local'], other)])
+        self.assertFalse(other.valid())
+        with self.assertRaises(InputValidationException):
+            other.allocate()
+
+    def test_references(self):
+        first, first_spaces = self.attach()
+        second, second_spaces = self.attach()
+        pool = self.publish(first, first_spaces['local'], '10.0.0.0/24', {'validate': '0'})
+        second.sync(second_spaces)
+        other = second_spaces['local'].get_pool('10.0.0.0/24')
+        self.assertEqual(pool.allocate('10.0.0.5'), '10.0.0.5/24')
+        self.assertEqual(pool.allocate('10.0.0.5'), '10.0.0.5/24')
+        self.assertEqual(other.allocate('10.0.0.6'), '10.0.0.6/24')
+        self.assertEqual(other.allocate('10.0.0.6'), '10.0.0.6/24')
+        # Holders are counted in shared state, whichever worker releases the address
+        other.deallocate('10.0.0.5')
+        self.assertTrue(pool.is_allocated(5))
+        self.assertEqual(other.allocate(), '10.0.0.1/24')
+        pool.deallocate('10.0.0.6')
+        pool.deallocate('10.0.0.5')
+        other.deallocate('10.0.0.6')
+        self.assertEqual(list(pool.allocator), [1])
+        self.assertEqual(len(other.references), 0)
+
+    def test_references_full(self):
+        state, spaces = self.attach()
+        pool = self.publish(state, spaces['local'], '10.0.0.0/24', {'validate': '0'})
+        addresses = ['10.0.0.{}'.format(host) for host in range(1, MAX_REFERENCES + 2)]
+        pool.allocate_many(addresses=addresses)
+        pool.allocate_many(addresses=addresses[:MAX_REFERENCES])
+        with self.assertRaises(InputValidationException):
+            pool.allocate(addresses[-1])
+        # Failed bulk request leaves counts as they were
+        with self.assertRaises(InputValidationException):
+            pool.allocate_many(addresses=addresses[-2:])
+        self.assertEqual(pool.references.get(MAX_REFERENCES), 1)
+        self.assertNotIn(MAX_REFERENCES + 1, pool.references)
+        pool.deallocate(addresses[0])
+        self.assertEqual(pool.allocate(addresses[-1]), addresses[-1] + '/24')
+
+    def test_reuse_delay(self):
+        # Other workers would not know when quarantined addresses expire
+        with self.assertRaises(InputValidationException):
+            SharedPool(pool='10.0.0.0/24', options={'reuse_delay': '60'})
+        self.assertIsNone(SharedPool(pool='10.0.0.0/24', options={'reuse_delay': '0'}).quarantine)
+
+    def test_region_reuse(self):
+        state, spaces = self.attach()
+        pool = self.publish(state, spaces['local'], '10.0.0.0/24')
+        pool.allocate()
+        spaces['local'].remove_pool(pool)
+        state.withdraw(pool)
+        pool = self.publish(state, spaces['local'], '10.0.1.0/24')
+        self.assertEqual(pool.used, 0)
+        self.assertEqual(pool.allocate(), '10.0.1.1/24')
+
+    def test_window(self):
+        state, spaces = self.attach()
+        pool = self.publish(state, spaces['local'], 'fd00::/64')
+        self.assertEqual(pool.allocate(), 'fd00::1/64')
+        self.assertEqual(pool.capacity, 1 << 24)
+        with self.assertRaises(InputValidationException):
+            pool.allocate('fd00::1:0:0')
+
+    def test_full(self):
+        SharedState.create(self.path, 4 << 20)
+        state, spaces = self.attach()
+        # Pool table takes 2 MiB, bitmap of a /8 does not fit in the rest
+        with self.assertRaises(InputValidationException):
+            self.publish(state, spaces['local'], '10.0.0.0/8')
+        self.publish(state, spaces['local'], '11.0.0.0/16')
+
+    def test_processes(self):
+        context = multiprocessing.get_context('fork')
+        processes, connections = [], []
+        for _ in range(4):
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=worker, args=(self.path, 500, sender))
+            process.start()
+            sender.close()
+            processes.append(process)
+            connections.append(receiver)
+        results = [connection.recv() for connection in connections]
+        for process in processes:
+            process.join()
+
+        addresses = []
+        for result in results:
+            self.assertIsInstance(result, list, result)
+            addresses.extend(result)
+        self.assertEqual(len(addresses), 2000)
+        self.assertEqual(len(set(addresses)), 2000)
+
+        state, spaces = self.attach()
+        state.sync(spaces)
+        pool = spaces['local'].get_pool('10.0.0.0/16')
+        self.assertEqual(pool.used, 2000)
+        self.assertEqual(len(pool.allocator), 2000)
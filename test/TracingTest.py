@@ -0,0 +1,67 @@
+import json
+import unittest
+
+import lib.IpamDriverData
+from lib.IpamDriver import handlers
+from lib.Tracing import *
+from docker_plugin_api.Plugin import InputValidationException
+from . import HandlerStateTestCase
+
+
+class TracerTest(unittest.TestCase):
+    def test_ring_buffer(self):
+        tracer = Tracer(3)
+        traced = tracer.wrap('Echo', lambda data: {'Address': data['Address']})
+        for host in range(5):
+            traced({'PoolID': 'local-10.0.0.0/24', 'Address': '10.0.0.{}'.format(host)})
+        events = [json.loads(line) for line in tracer.dump()]
+        self.assertEqual([event['address'] for event in events], ['10.0.0.2', '10.0.0.3', '10.0.0.4'])
+        self.assertEqual(events[0]['pool'], 'local-10.0.0.0/24')
+        self.assertEqual(events[0]['outcome'], 'ok')
+        tracer.resize(2)
+        self.assertEqual(len(list(tracer.dump())), 2)
+
+    def test_errors(self):
+        tracer = Tracer()
+
+        def fail(data: dict):
+            raise InputValidationException('No free addresses in pool')
+
+        with self.assertRaises(InputValidationException):
+            tracer.wrap('Fail', fail)({})
+        with self.assertRaises(KeyError):
+            tracer.wrap('Crash', lambda data: data['PoolID'])({})
+        outcomes = [json.loads(line)['outcome'] for line in tracer.dump()]
+        self.assertEqual(outcomes, ['error: No free addresses in pool', 'exception: KeyError'])
+
+
+class TracedHandlersTest(HandlerStateTestCase):
+    def setUp(self):
+        super().setUp()
+        tracer = lib.IpamDriverData.tracer
+        self.addCleanup(setattr, tracer, 'events', tracer.events)
+        self.addCleanup(setattr, tracer, 'enabled', tracer.enabled)
+        tracer.resize(100)
+        tracer.events.clear()
+        self.handlers = dict(handlers)
+        tracer.instrument(self.handlers)
+
+    def test_phases(self):
+        pool_id = self.handlers['/IpamDriver.RequestPool']({'AddressSpace': 'local', 'Pool': '10.0.0.0/24'})['PoolID']
+        self.handlers['/IpamDriver.RequestAddress']({'PoolID': pool_id})
+        with self.assertRaises(InputValidationException):
+            self.handlers['/IpamDriver.RequestAddress']({'PoolID': pool_id, 'Address': '10.0.0.1'})
+        self.handlers['/IpamDriver.GetCapabilities']({})
+        events = [json.loads(line) for line in lib.IpamDriverData.tracer.dump()]
+        self.assertEqual([(event['endpoint'], event['pool'], event['address']) for event in events], [
+            ('RequestPool', pool_id, None),
+            ('RequestAddress', pool_id, '10.0.0.1/24'),
+            ('RequestAddress', pool_id, '10.0.0.1'),
+            ('GetCapabilities', None, None),
+        ])
+        self.assertEqual(events[2]['outcome'], 'error: Requested address 10.0.0.1 is already used')
+        for event in events:
+            self.assertGreaterEqual(event['lookup_us'], 0)
+            self.assertGreaterEqual(event['allocation_us'], 0)
+        # Lookup of a pool is measured separately from the allocation
+        self.assertGreater(events[1]['lookup_us'], 0)
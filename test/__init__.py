@@ -0,0 +1,23 @@
+import unittest
+
+import lib.IpamDriverData
+from lib.Ipam import Space
+
+
+class HandlerStateTestCase(unittest.TestCase):
+    """Base for tests calling request handlers, which share module state"""
+
+    # Address spaces present at the start of each test
+    space_names = ('local',)
+
+    def setUp(self):
+        # Replace contents of module state for the duration of the test
+        spaces = {name: Space(name) for name in self.space_names}
+        for state, value in ((lib.IpamDriverData.spaces, spaces), (lib.IpamDriverData.pool_ids, {})):
+            self.addCleanup(self.replace, state, dict(state))
+            self.replace(state, value)
+
+    @staticmethod
+    def replace(state: dict, value: dict):
+        state.clear()
+        state.update(value)